@@ -0,0 +1,350 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+#    Módulo para el acceso a servicios web por HTTP y HTTPS mediante
+#    conexiones persistentes (keep-alive) reutilizadas entre peticiones,
+#    lo que evita un nuevo establecimiento de conexión y de TLS en cada
+#    una de ellas.
+#
+#    Léase acerca de la biblioteca httplib
+#    <https://docs.python.org/2/library/httplib.html>.
+#
+#   Copyright (C) 2015, David Abián <da [at] davidabian.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import httplib
+import json
+import mimetypes
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import urllib
+import urlparse
+
+AGENTE = "csv-a-commons/1.0 (https://github.com/davidabian/csv-a-commons)"
+
+class Respuesta (object):
+    """Respuesta a una petición HTTP, ya leída por completo."""
+
+    __slots__ = ("estado", "cabeceras", "contenido")
+
+    def __init__ (self, estado, cabeceras, contenido):
+        self.estado = estado
+        # Nombres de las cabeceras en minúsculas
+        self.cabeceras = cabeceras
+        self.contenido = contenido
+
+    def json (self):
+        return json.loads(self.contenido)
+
+class Sesion (object):
+    """Reserva de conexiones HTTP(S) persistentes, agrupadas por
+    servidor, que pueden compartir varios hilos.
+
+    Se conservan hasta [maxConexiones] conexiones libres por servidor;
+    cada petición toma una de ellas, o abre una nueva si no hay ninguna
+    libre, y la devuelve al terminar. [tEspera] es el tiempo máximo en
+    segundos de espera por la red en cada operación.
+    Las cookies que fijan los servidores se guardan en [cookies] y se
+    envían en las peticiones siguientes a cualquiera de ellos.
+    """
+
+    def __init__ (self, tEspera=30, maxConexiones=8):
+        self.tEspera = tEspera
+        self.maxConexiones = maxConexiones
+        self.libres = {}
+        self.cookies = {}
+        self.cerrojo = threading.Lock()
+
+    def tomar_conexion (self, servidor):
+        with self.cerrojo:
+            libres = self.libres.get(servidor)
+            if libres:
+                return libres.pop(), True
+        esquema, host, puerto = servidor
+        if esquema == "https":
+            con = httplib.HTTPSConnection(host, puerto, timeout=self.tEspera)
+        else:
+            con = httplib.HTTPConnection(host, puerto, timeout=self.tEspera)
+        return con, False
+
+    def devolver_conexion (self, servidor, con):
+        with self.cerrojo:
+            libres = self.libres.setdefault(servidor, [])
+            if len(libres) < self.maxConexiones:
+                libres.append(con)
+                return
+        con.close()
+
+    def peticion (self, metodo, url, cuerpo=None, cabeceras=None):
+        """Envía una petición [metodo] a [url] y devuelve su Respuesta.
+
+        Si una conexión reutilizada resulta haber sido cerrada por el
+        servidor, la petición se repite una vez con una conexión nueva.
+        Otros errores de red se propagan como excepciones.
+        """
+        if isinstance(url, unicode):
+            url = url.encode('utf-8')
+        partes = urlparse.urlsplit(url)
+        puerto = partes.port
+        if puerto is None:
+            puerto = 443 if partes.scheme == "https" else 80
+        servidor = (partes.scheme, partes.hostname, puerto)
+        ruta = partes.path or "/"
+        if partes.query:
+            ruta = "{}?{}".format(ruta, partes.query)
+        cab = {"User-Agent": AGENTE}
+        with self.cerrojo:
+            if self.cookies:
+                cab["Cookie"] = "; ".join("{}={}".format(k, v) for k, v
+                                          in sorted(self.cookies.items()))
+        if cabeceras:
+            cab.update(cabeceras)
+        for intento in (1, 2):
+            con, reutilizada = self.tomar_conexion(servidor)
+            try:
+                con.request(metodo, ruta, cuerpo, cab)
+                r = con.getresponse()
+                contenido = r.read()
+            except (httplib.HTTPException, socket.error):
+                con.close()
+                if reutilizada and intento == 1:
+                    continue
+                raise
+            respuesta = Respuesta(r.status,
+                                  dict((k.lower(), v)
+                                       for k, v in r.getheaders()),
+                                  contenido)
+            self.guardar_cookies(r.msg.getheaders("set-cookie"))
+            if r.will_close:
+                con.close()
+            else:
+                self.devolver_conexion(servidor, con)
+            return respuesta
+
+    def guardar_cookies (self, cabeceras):
+        """Guarda las cookies de las cabeceras Set-Cookie [cabeceras]."""
+        with self.cerrojo:
+            for cabecera in cabeceras:
+                nombre, _, valor = cabecera.split(";")[0].partition("=")
+                if valor and valor != "deleted":
+                    self.cookies[nombre.strip()] = valor.strip()
+                else:
+                    self.cookies.pop(nombre.strip(), None)
+
+    def get (self, url, params=None, cabeceras=None):
+        """Envía una petición GET a [url] con los parámetros [params]
+        (diccionario) en la cadena de consulta.
+        """
+        if params:
+            url = "{}?{}".format(url, codificar(params))
+        return self.peticion("GET", url, cabeceras=cabeceras)
+
+    def post (self, url, params=None, cabeceras=None):
+        """Envía una petición POST a [url] con los parámetros [params]
+        (diccionario) como formulario en el cuerpo.
+        """
+        cab = {"Content-Type": "application/x-www-form-urlencoded"}
+        if cabeceras:
+            cab.update(cabeceras)
+        return self.peticion("POST", url, codificar(params or {}), cab)
+
+    def post_multipart (self, url, params=None, ficheros=None,
+                        cabeceras=None):
+        """Envía una petición POST a [url] con los parámetros [params]
+        y los ficheros [ficheros] ({nombre del parámetro: (nombre del
+        fichero, contenido)}) como formulario multipart/form-data.
+        """
+        cuerpo, tipo = multipart(params or {}, ficheros or {})
+        cab = {"Content-Type": tipo}
+        if cabeceras:
+            cab.update(cabeceras)
+        return self.peticion("POST", url, cuerpo, cab)
+
+    def cerrar (self):
+        """Cierra todas las conexiones libres."""
+        with self.cerrojo:
+            libres, self.libres = self.libres, {}
+        for conexiones in libres.values():
+            for con in conexiones:
+                con.close()
+
+class Saturacion (Exception):
+    """El servidor pide esperar [espera] segundos antes de volver a
+    intentarlo.
+    """
+
+    def __init__ (self, espera, motivo=None):
+        Exception.__init__(self, espera, motivo)
+        self.espera = espera
+        self.motivo = motivo
+
+def espera_pedida (respuesta, porDefecto=5):
+    """Devuelve los segundos que el servidor pide esperar con la
+    respuesta [respuesta], o bien None si no lo pide.
+    
+    Se considera que lo pide si la respuesta incluye la cabecera
+    Retry-After, si su estado es 429 o 503, o si es un error de la API
+    de MediaWiki por retraso de replicación (maxlag) o por superar el
+    límite de acciones (ratelimited). Si no indica cuánto esperar, se
+    devuelven [porDefecto] segundos.
+    """
+    error = respuesta.cabeceras.get("mediawiki-api-error")
+    if "retry-after" not in respuesta.cabeceras and \
+       respuesta.estado not in (429, 503) and \
+       error not in ("maxlag", "ratelimited"):
+        return None
+    try:
+        return max(0, float(respuesta.cabeceras["retry-after"]))
+    except (KeyError, ValueError):
+        return porDefecto
+
+class LimitadorTasa (object):
+    """Limitador del número de operaciones por segundo, según el
+    algoritmo de la cubeta de fichas (token bucket), compartible entre
+    varios hilos.
+    
+    La tasa parte de [tasa] operaciones por segundo y se adapta a las
+    respuestas del servidor: crece poco a poco con cada operación
+    satisfactoria (exito), hasta [tasaMax], y se reduce a la mitad,
+    hasta [tasaMin], cada vez que el servidor pide esperar (penalizar).
+    La cubeta admite ráfagas de hasta [capacidad] operaciones.
+    """
+
+    def __init__ (self, tasa, tasaMin, tasaMax, capacidad=1):
+        self.tasaMin = tasaMin
+        self.tasaMax = tasaMax
+        self.tasa = min(max(tasa, tasaMin), tasaMax)
+        self.capacidad = capacidad
+        self.fichas = capacidad
+        self.tFichas = time.time()
+        self.pausaHasta = 0
+        self.cerrojo = threading.Lock()
+
+    def esperar (self):
+        """Espera hasta que pueda realizarse una operación."""
+        while True:
+            with self.cerrojo:
+                ahora = time.time()
+                self.fichas = min(self.capacidad,
+                                  self.fichas +
+                                  (ahora - self.tFichas) * self.tasa)
+                self.tFichas = ahora
+                if ahora < self.pausaHasta:
+                    espera = self.pausaHasta - ahora
+                elif self.fichas >= 1:
+                    self.fichas -= 1
+                    return
+                else:
+                    espera = (1 - self.fichas) / self.tasa
+            time.sleep(espera)
+
+    def exito (self):
+        """Informa de una operación satisfactoria."""
+        with self.cerrojo:
+            self.tasa = min(self.tasaMax,
+                            self.tasa + self.tasaMax / 20.0)
+
+    def penalizar (self, espera=0):
+        """Informa de que el servidor pide esperar [espera] segundos."""
+        with self.cerrojo:
+            self.tasa = max(self.tasaMin, self.tasa / 2.0)
+            self.fichas = min(self.fichas, 0)
+            self.pausaHasta = max(self.pausaHasta, time.time() + espera)
+
+class LimitadorCompartido (LimitadorTasa):
+    """LimitadorTasa compartible también entre varios procesos, creados
+    con multiprocessing después que él: la tasa, las fichas y la pausa
+    se guardan en memoria compartida, protegidas por un cerrojo entre
+    procesos, de modo que todos consumen de la misma cubeta.
+    """
+
+    def __init__ (self, tasa, tasaMin, tasaMax, capacidad=1):
+        self.estado = multiprocessing.Array('d', 4, lock=False)
+        LimitadorTasa.__init__(self, tasa, tasaMin, tasaMax, capacidad)
+        self.cerrojo = multiprocessing.Lock()
+
+    def _propiedad (i):
+        return property(lambda self: self.estado[i],
+                        lambda self, valor: self.estado.__setitem__(i, valor))
+
+    tasa = _propiedad(0)
+    fichas = _propiedad(1)
+    tFichas = _propiedad(2)
+    pausaHasta = _propiedad(3)
+    del _propiedad
+
+def codificar (params):
+    """Codifica el diccionario [params] como cadena de consulta,
+    admitiendo valores unicode (en UTF-8).
+    """
+    pares = []
+    for k, v in sorted(params.items()):
+        if isinstance(v, unicode):
+            v = v.encode('utf-8')
+        pares.append((k, v))
+    return urllib.urlencode(pares)
+
+def multipart (params, ficheros):
+    """Devuelve el cuerpo y el tipo de contenido de un formulario
+    multipart/form-data con los parámetros [params] y los ficheros
+    [ficheros], como en Sesion.post_multipart.
+    """
+    limite = "----csvac{}".format(os.urandom(12).encode('hex'))
+    partes = []
+    for k, v in sorted(params.items()):
+        if isinstance(v, unicode):
+            v = v.encode('utf-8')
+        partes.append('--{}\r\nContent-Disposition: form-data; '
+                      'name="{}"\r\n\r\n{}\r\n'.format(limite, k, v))
+    for k, (nombre, contenido) in sorted(ficheros.items()):
+        if isinstance(nombre, unicode):
+            nombre = nombre.encode('utf-8')
+        tipo = mimetypes.guess_type(nombre)[0] or "application/octet-stream"
+        partes.append('--{}\r\nContent-Disposition: form-data; '
+                      'name="{}"; filename="{}"\r\nContent-Type: {}'
+                      '\r\n\r\n'.format(limite, k,
+                                        nombre.replace('"', '%22'), tipo))
+        partes.append(contenido)
+        partes.append("\r\n")
+    partes.append("--{}--\r\n".format(limite))
+    return "".join(partes), "multipart/form-data; boundary={}".format(limite)
+
+#  Sesión compartida por todo el programa, creada al configurar el
+#  módulo o, con los valores por defecto, en su primer uso.
+#
+SESION = None
+
+def config (tEspera=30, maxConexiones=8):
+    global SESION
+    if SESION is not None:
+        SESION.cerrar()
+    SESION = Sesion(tEspera, maxConexiones)
+
+def sesion ():
+    if SESION is None:
+        config()
+    return SESION
+
+def get (url, params=None, cabeceras=None):
+    return sesion().get(url, params, cabeceras)
+
+def post (url, params=None, cabeceras=None):
+    return sesion().post(url, params, cabeceras)
+
+def post_multipart (url, params=None, ficheros=None, cabeceras=None):
+    return sesion().post_multipart(url, params, ficheros, cabeceras)
@@ -22,12 +22,204 @@
 #   You should have received a copy of the GNU General Public License
 #   along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import atexit
+import codecs
+import heapq
+import json
 import logging
+import os
+import Queue
+import re
+import threading
 
-def config (f):
-    logging.basicConfig(filename=f,\
-                        level=logging.DEBUG,\
-                        format='%(asctime)s %(levelname)s: %(message)s')
+FORMATO = '%(asctime)s %(levelname)s: %(message)s'
+
+#  La constante [RE_INICIO] reconoce el comienzo de cada registro de
+#  texto, para distinguirlo de las siguientes líneas de un mensaje de
+#  varias.
+#
+RE_INICIO = re.compile(r'(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3}) ')
+
+#  La constante [TAM_BUFER] es el tamaño en bytes del búfer del fichero
+#  de registros en el modo asíncrono.
+#
+TAM_BUFER = 64 * 1024
+
+class FormatoJson (logging.Formatter):
+    """Formato compacto de registros en JSON, uno por línea. Si se
+    indica, el número de [proceso] se incluye en cada registro.
+    """
+
+    def __init__ (self, proceso=None):
+        logging.Formatter.__init__(self)
+        self.proceso = proceso
+
+    def format (self, registro):
+        r = {"t": round(registro.created, 3), "nivel": registro.levelname,
+             "msj": registro.getMessage()}
+        if self.proceso is not None:
+            r["proceso"] = self.proceso
+        return json.dumps(r, ensure_ascii=False, separators=(",", ":"))
+
+class FicheroConBufer (logging.FileHandler):
+    """Manejador que escribe los registros en un fichero con un búfer de
+    TAM_BUFER bytes, que solo se vacía al llamar a vaciar o al cerrarlo.
+    """
+
+    def __init__ (self, f):
+        logging.FileHandler.__init__(self, f, encoding='utf-8')
+
+    def _open (self):
+        return codecs.open(self.baseFilename, self.mode, self.encoding,
+                           buffering=TAM_BUFER)
+
+    def flush (self):
+        pass
+
+    def vaciar (self):
+        logging.FileHandler.flush(self)
+
+class ManejadorCola (logging.Handler):
+    """Manejador que pasa los registros a un hilo en segundo plano, que
+    los escribe con el [manejador] indicado, de modo que quien registra
+    nunca espera por la escritura.
+    """
+
+    def __init__ (self, manejador):
+        logging.Handler.__init__(self)
+        self.manejador = manejador
+        self.cola = Queue.Queue()
+        self.hilo = threading.Thread(target=self.escribir)
+        self.hilo.daemon = True
+        self.hilo.start()
+
+    def emit (self, registro):
+        # El mensaje se compone ya, por si sus argumentos cambian antes
+        # de escribirse.
+        registro.msg = registro.getMessage()
+        registro.args = None
+        registro.exc_info = None
+        self.cola.put(registro)
+
+    def escribir (self):
+        while True:
+            registro = self.cola.get()
+            while registro is not None:
+                self.manejador.handle(registro)
+                try:
+                    registro = self.cola.get_nowait()
+                except Queue.Empty:
+                    break
+            self.manejador.vaciar()
+            if registro is None:
+                return
+
+    def close (self):
+        if self.hilo.is_alive():
+            self.cola.put(None)
+            self.hilo.join()
+        self.manejador.close()
+        logging.Handler.close(self)
+
+def formato (enJson=False, proceso=None):
+    """Devuelve el formato de los registros, en JSON si [enJson] es True,
+    con el número de [proceso], si se indica.
+    """
+    if enJson:
+        return FormatoJson(proceso)
+    if proceso is not None:
+        return logging.Formatter(FORMATO.replace(
+            '%(message)s', '[{}] %(message)s'.format(proceso)))
+    return logging.Formatter(FORMATO)
+
+def config (f, asincrono=False, enJson=False, proceso=None):
+    """Configura el registro en el fichero [f].
+    
+    Si [asincrono] es True, los registros se escriben en un hilo en
+    segundo plano a través de un búfer, que se vacía cada vez que no
+    quedan registros por escribir y al terminar el programa. Si [enJson]
+    es True, se escriben en JSON, uno por línea. Si se indica el número
+    de [proceso], se hace constar en cada registro.
+    """
+    if not asincrono:
+        logging.basicConfig(filename=f,\
+                            level=logging.DEBUG,\
+                            format=FORMATO)
+        if enJson or proceso is not None:
+            for manejador in logging.getLogger().handlers:
+                manejador.setFormatter(formato(enJson, proceso))
+        return
+    manejador = FicheroConBufer(f)
+    manejador.setFormatter(formato(enJson, proceso))
+    raiz = logging.getLogger()
+    for anterior in raiz.handlers[:]:
+        raiz.removeHandler(anterior)
+        anterior.close()
+    cola = ManejadorCola(manejador)
+    raiz.addHandler(cola)
+    raiz.setLevel(logging.DEBUG)
+    atexit.register(cola.close)
+
+def cerrar ():
+    """Escribe los registros pendientes y cierra el fichero de registros.
+    Después, el registro puede configurarse de nuevo con config.
+    """
+    raiz = logging.getLogger()
+    for manejador in raiz.handlers[:]:
+        raiz.removeHandler(manejador)
+        manejador.close()
+
+def instante (linea, enJson=False):
+    """Devuelve el instante del registro que comienza en la línea
+    [linea], de un fichero de registros en JSON si [enJson] es True, o
+    None si esta continúa un mensaje de varias líneas.
+    """
+    if enJson:
+        try:
+            return json.loads(linea)["t"]
+        except (ValueError, KeyError, TypeError):
+            return None
+    m = RE_INICIO.match(linea)
+    return m.group(1) if m else None
+
+def en_json (ruta):
+    """Indica si el fichero de registros [ruta] está en JSON, según su
+    primera línea.
+    """
+    with open(ruta, 'rb') as f:
+        primera = f.readline()
+    return RE_INICIO.match(primera) is None and \
+           instante(primera, True) is not None
+
+def registros (ruta):
+    """Genera los registros del fichero de registros [ruta] como pares
+    (instante, texto), con las líneas de los mensajes de varias juntas.
+    """
+    enJson = en_json(ruta)
+    with open(ruta, 'rb') as f:
+        momento, texto = None, []
+        for linea in f:
+            t = instante(linea, enJson)
+            if t is not None:
+                if texto:
+                    yield momento, "".join(texto)
+                    texto = []
+                momento = t
+            texto.append(linea)
+        if texto:
+            yield momento, "".join(texto)
+
+def fusionar (destino, origenes):
+    """Añade al fichero de registros [destino] los de los ficheros
+    [origenes], todos en el mismo formato, ordenados por instante, y
+    elimina estos.
+    """
+    with open(destino, 'ab') as f:
+        for momento, texto in heapq.merge(*[registros(ruta)
+                                             for ruta in origenes]):
+            f.write(texto)
+    for ruta in origenes:
+        os.remove(ruta)
 
 def debug (msj):
     logging.debug(msj)
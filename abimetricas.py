@@ -0,0 +1,191 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+#    Módulo para la medida del tiempo de cada etapa de un proceso y el
+#    recuento de sucesos, con exportación periódica en JSON y en el
+#    formato de texto de Prometheus.
+#
+#    Léase acerca del formato de exposición de Prometheus
+#    <https://prometheus.io/docs/instrumenting/exposition_formats/>.
+#
+#   Copyright (C) 2015, David Abián <da [at] davidabian.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import contextlib
+import json
+import os
+import threading
+import time
+
+#  La constante [MUESTRAS_MAX] es el número máximo de duraciones
+#  recientes que se conservan por etapa para calcular los percentiles,
+#  de modo que la memoria empleada no crece con la duración del proceso.
+#
+MUESTRAS_MAX = 10000
+
+PERCENTILES = (50, 95, 99)
+
+def percentil (ordenadas, p):
+    """Devuelve el percentil [p] (por rango más cercano) de la lista de
+    valores [ordenadas], ya ordenada, o None si está vacía.
+    """
+    if not ordenadas:
+        return None
+    rango = int(round(p / 100.0 * len(ordenadas) + 0.5)) - 1
+    return ordenadas[min(max(rango, 0), len(ordenadas) - 1)]
+
+class Etapa (object):
+    """Duraciones de una etapa: número, suma, máximo y muestras
+    recientes.
+    """
+
+    __slots__ = ("n", "suma", "maximo", "muestras")
+
+    def __init__ (self):
+        self.n = 0
+        self.suma = 0.0
+        self.maximo = 0.0
+        self.muestras = collections.deque(maxlen=MUESTRAS_MAX)
+
+    def anotar (self, segundos):
+        self.n += 1
+        self.suma += segundos
+        self.maximo = max(self.maximo, segundos)
+        self.muestras.append(segundos)
+
+    def resumen (self):
+        ordenadas = sorted(self.muestras)
+        r = {"n": self.n, "suma": self.suma, "max": self.maximo}
+        for p in PERCENTILES:
+            r["p{}".format(p)] = percentil(ordenadas, p)
+        return r
+
+class Metricas (object):
+    """Tiempos por etapa y contadores de un proceso, que pueden
+    compartir varios hilos.
+    """
+
+    def __init__ (self):
+        self.etapas = {}
+        self.contadores = {}
+        self.t0 = time.time()
+        self.tExportacion = 0
+        self.cerrojo = threading.Lock()
+
+    def anotar (self, etapa, segundos):
+        """Anota una duración de [segundos] en la etapa [etapa]."""
+        with self.cerrojo:
+            if etapa not in self.etapas:
+                self.etapas[etapa] = Etapa()
+            self.etapas[etapa].anotar(segundos)
+
+    @contextlib.contextmanager
+    def medir (self, etapa):
+        """Anota en la etapa [etapa] la duración del bloque with."""
+        t0 = time.time()
+        try:
+            yield
+        finally:
+            self.anotar(etapa, time.time() - t0)
+
+    def contar (self, contador, n=1):
+        """Suma [n] al contador [contador]."""
+        with self.cerrojo:
+            self.contadores[contador] = self.contadores.get(contador, 0) + n
+
+    def resumen (self):
+        """Devuelve un diccionario con todas las métricas."""
+        with self.cerrojo:
+            return {
+                "segundos": time.time() - self.t0,
+                "etapas": dict((nombre, etapa.resumen())
+                               for nombre, etapa in self.etapas.items()),
+                "contadores": dict(self.contadores),
+            }
+
+    def texto (self):
+        """Devuelve un resumen legible de las métricas, una línea por
+        etapa y una con los contadores.
+        """
+        r = self.resumen()
+        lineas = []
+        for nombre in sorted(r["etapas"]):
+            e = r["etapas"][nombre]
+            lineas.append(u"{}: {} veces, {:.1f} s en total, "
+                          u"p50 {:.3f} s, p95 {:.3f} s, "
+                          u"p99 {:.3f} s".format(nombre, e["n"], e["suma"],
+                                                 e["p50"], e["p95"],
+                                                 e["p99"]))
+        if r["contadores"]:
+            lineas.append(u", ".join(u"{}: {}".format(c, v) for c, v in
+                                     sorted(r["contadores"].items())))
+        return lineas
+
+    def prometheus (self, prefijo="csvac"):
+        """Devuelve las métricas en el formato de texto de
+        Prometheus.
+        """
+        r = self.resumen()
+        lineas = ["# TYPE {}_etapa_segundos summary".format(prefijo)]
+        for nombre in sorted(r["etapas"]):
+            e = r["etapas"][nombre]
+            for p in PERCENTILES:
+                lineas.append('{}_etapa_segundos{{etapa="{}",quantile="{}"}} '
+                              '{!r}'.format(prefijo, nombre, p / 100.0,
+                                            e["p{}".format(p)]))
+            lineas.append('{}_etapa_segundos_sum{{etapa="{}"}} '
+                          '{!r}'.format(prefijo, nombre, e["suma"]))
+            lineas.append('{}_etapa_segundos_count{{etapa="{}"}} '
+                          '{}'.format(prefijo, nombre, e["n"]))
+        for c in sorted(r["contadores"]):
+            lineas.append("# TYPE {}_{}_total counter".format(prefijo, c))
+            lineas.append("{}_{}_total {}".format(prefijo, c,
+                                                  r["contadores"][c]))
+        return "\n".join(lineas) + "\n"
+
+    def exportar (self, base):
+        """Escribe las métricas en [base].json y [base].prom, sustituyendo
+        de forma atómica las de la exportación anterior.
+        """
+        for ruta, contenido in (
+                (u"{}.json".format(base), json.dumps(self.resumen(),
+                                                     sort_keys=True)),
+                (u"{}.prom".format(base), self.prometheus())):
+            tmp = u"{}.tmp".format(ruta)
+            with open(tmp, 'w') as f:
+                f.write(contenido)
+            os.rename(tmp, ruta)
+        self.tExportacion = time.time()
+
+    def exportar_cada (self, base, intervalo):
+        """Exporta las métricas como exportar si han pasado más de
+        [intervalo] segundos desde la última exportación.
+        """
+        if time.time() - self.tExportacion >= intervalo:
+            self.exportar(base)
+
+#  Métricas compartidas por todo el programa.
+#
+METRICAS = Metricas()
+
+def medir (etapa):
+    return METRICAS.medir(etapa)
+
+def anotar (etapa, segundos):
+    METRICAS.anotar(etapa, segundos)
+
+def contar (contador, n=1):
+    METRICAS.contar(contador, n)
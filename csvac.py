@@ -34,18 +34,44 @@
 #   You should have received a copy of the GNU General Public License
 #   along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import argparse
+import array
+import collections
+import contextlib
 import csv
 import getpass
+import glob
 import hashlib
+import itertools
 import json
+import mmap
+import multiprocessing
+import operator
 import os.path
+import Queue
 import random
 import re
+import socket
+import sqlite3
+import stat
 import sys
+import threading
 import time
-import urllib
+import traceback
 
+from multiprocessing.pool import ThreadPool
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+import abihttp
 import abilog
+import abimetricas
 import csvcfg
 
 #  La constante [INTERACTIVO] determina si un operador controlará todo
@@ -62,6 +88,28 @@ INTERACTIVO = True
 #
 SIMULACION = False
 
+#  La variable [DESATENDIDO] indica si el programa se ejecuta en modo
+#  desatendido (True), para colecciones ya revisadas y aprobadas: sin
+#  operador (INTERACTIVO es False), sin esperas fijas y con una línea de
+#  progreso periódica en lugar de los datos de cada fichero, que solo se
+#  registran. Se activa con la opción --desatendido.
+#
+DESATENDIDO = False
+
+#  La variable [FRAGMENTO] es, en cada proceso trabajador de una subida
+#  en varios procesos (véase coordinar), el par (k, n) que indica que el
+#  proceso sube el fragmento k (de 0 a n-1) de los n en que se reparten
+#  las filas; en otro caso, es None.
+#
+FRAGMENTO = None
+
+#  La variable [NODO] es, en el modo de nodo (véase TablaArriendos), el
+#  identificador de este proceso entre todos los que toman filas de la
+#  misma tabla de arriendos, de la forma «máquina-pid»; en otro caso,
+#  es None. Se activa con la opción --arriendos.
+#
+NODO = None
+
 #  La variable [correoAyuda] alberga la dirección de correo electrónico
 #  a la que el operador del programa deberá dirigirse en caso de que
 #  algo salga mal o cuando necesite ayuda.
@@ -71,12 +119,64 @@ correoAyuda = u"da [at] davidabian.com"
 
 correoAyuda = correoAyuda.replace(u" [at] ", u"@")
 
-def comprobar_pwb():
-    """Comprueba si Pywikibot core se encuentra instalado en las
-    proximidades del directorio actual.
-    
-    Devuelve la ruta de dicha instalación si se encuentra, o bien None
-    si no se encuentra, emitiendo un error en este último caso.
+#  La constante [VAR_DIR_PWB] es el nombre de la variable de entorno que
+#  puede indicar el directorio de la instalación de Pywikibot core.
+#
+VAR_DIR_PWB = "CSVAC_PWB"
+
+#  La constante [CACHE_PWB] es la ruta del fichero donde se recuerda,
+#  para cada directorio de trabajo, el directorio de la instalación de
+#  Pywikibot core encontrado, con la fecha de modificación de sus
+#  ficheros principales, para no tener que buscarlo de nuevo.
+#
+CACHE_PWB = os.path.join(os.path.expanduser("~"), ".csvac.pwb")
+
+#  Ficheros que identifican una instalación de Pywikibot core.
+#
+FICHEROS_PWB = (
+    "pwb.py",
+    os.path.join("scripts", "upload.py"),
+    os.path.join("scripts", "login.py"),
+    "user-config.py",
+)
+
+def marcas_pwb (directorio):
+    """Devuelve las fechas de modificación de los FICHEROS_PWB del
+    directorio [directorio], con None para los que no existen.
+    """
+    marcas = []
+    for nombre in FICHEROS_PWB:
+        try:
+            marcas.append(os.stat(os.path.join(directorio,
+                                               nombre)).st_mtime)
+        except OSError:
+            marcas.append(None)
+    return marcas
+
+def leer_cache_pwb ():
+    try:
+        with open(CACHE_PWB) as f:
+            cache = json.load(f)
+    except (IOError, ValueError):
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+def guardar_cache_pwb (directorio):
+    """Recuerda [directorio] como la instalación de Pywikibot core del
+    directorio de trabajo actual.
+    """
+    cache = leer_cache_pwb()
+    cache[os.getcwd()] = [directorio, marcas_pwb(directorio)]
+    try:
+        with open(CACHE_PWB, 'w') as f:
+            json.dump(cache, f)
+    except IOError:
+        pass
+
+def buscar_pwb ():
+    """Busca una instalación de Pywikibot core en las proximidades del
+    directorio actual y devuelve su ruta, o bien None si no la
+    encuentra.
     """
     nombresPosibles = [
                        "Archivos comunes",
@@ -134,7 +234,6 @@ def comprobar_pwb():
             dirPosibles.append(os.path.join("..",nombre1,nombre2,""))
             dirPosibles.append(os.path.join("..","..",nombre1,nombre2,""))
             dirPosibles.append(os.path.join("..","..","..",nombre1,nombre2,""))
-    directorio = None
     for dirPosible in dirPosibles:
         dirPosible = os.path.abspath(dirPosible)
         check1 = os.path.join(dirPosible,"pwb.py")
@@ -143,8 +242,41 @@ def comprobar_pwb():
         if os.path.isfile(check1) and \
            os.path.isfile(check2) and \
            os.path.isfile(check3):
-            directorio = dirPosible
-            break
+            return dirPosible
+    return None
+
+def comprobar_pwb (directorio=None):
+    """Comprueba si Pywikibot core se encuentra instalado en el
+    directorio [directorio], en el indicado por la variable de entorno
+    VAR_DIR_PWB o, si no se indica ninguno, en las proximidades del
+    directorio actual.
+    
+    La búsqueda en las proximidades del directorio actual se hace una
+    sola vez: su resultado se recuerda en CACHE_PWB y se da por bueno
+    mientras no cambien las fechas de modificación de los ficheros de
+    la instalación.
+    
+    Devuelve la ruta de dicha instalación si se encuentra, o bien None
+    si no se encuentra, emitiendo un error en este último caso.
+    """
+    if not directorio:
+        directorio = os.environ.get(VAR_DIR_PWB)
+    if directorio:
+        directorio = os.path.abspath(directorio)
+        if None in marcas_pwb(directorio)[:3]:
+            print(u"ERROR: No se encuentra una instalación de Pywikibot "
+                  u"core en el directorio {}.".format(directorio))
+            return None
+    else:
+        recordado = leer_cache_pwb().get(os.getcwd())
+        if recordado and len(recordado) == 2 and \
+           None not in recordado[1] and \
+           marcas_pwb(recordado[0]) == recordado[1]:
+            directorio = recordado[0]
+        else:
+            directorio = buscar_pwb()
+            if directorio is not None:
+                guardar_cache_pwb(directorio)
     if directorio is None:
         print(u"ERROR: No se encuentra una instalación de Pywikibot "
               u"core en las proximidades del directorio actual.")
@@ -157,31 +289,133 @@ def comprobar_pwb():
         directorio = None
     return directorio
 
-DIR_PWB = comprobar_pwb()
-if DIR_PWB:
-    sys.path.append(DIR_PWB)
-    import pwb
-    import pywikibot
-    sys.path.append(os.path.join(DIR_PWB,"scripts"))
-    import upload
-    #SITE_PWB = pywikibot.Site('test', 'test')
-    SITE_PWB = pywikibot.Site('commons', 'commons')
-
 #### Hashes ############################################################
 
+#  La constante [TAM_BLOQUE] es el tamaño en bytes de los bloques en que
+#  se leen los ficheros para calcular su hash, de modo que la memoria
+#  empleada no dependa del tamaño de cada fichero.
+#
+TAM_BLOQUE = 1024 * 1024
+
+#  Los ficheros de [UMBRAL_MMAP] bytes o más no se leen por bloques,
+#  sino que se proyectan en memoria (mmap) por ventanas sucesivas de
+#  [TAM_VENTANA_MMAP] bytes, que se liberan tras su uso.
+#
+UMBRAL_MMAP = 512 * 1024 * 1024
+TAM_VENTANA_MMAP = 64 * 1024 * 1024
+
+def sha1_ruta (ruta, modo=None):
+    """Devuelve el SHA-1 del fichero de ruta [ruta], o None en caso de
+    error.
+    
+    Si [modo] es "bloques", el fichero se lee por bloques de TAM_BLOQUE
+    bytes; si es "mmap", se proyecta en memoria por ventanas de
+    TAM_VENTANA_MMAP bytes. Si no se indica, se escoge "mmap" para los
+    ficheros de UMBRAL_MMAP bytes o más, y "bloques" para el resto.
+    En ambos casos, la memoria empleada no depende del tamaño del
+    fichero.
+    """
+    try:
+        with open(ruta, 'rb') as af:
+            tam = os.fstat(af.fileno()).st_size
+            if modo is None:
+                if tam >= UMBRAL_MMAP:
+                    modo = "mmap"
+                else:
+                    modo = "bloques"
+            sha1 = hashlib.sha1()
+            if modo == "mmap":
+                pos = 0
+                while pos < tam:
+                    lon = min(TAM_VENTANA_MMAP, tam - pos)
+                    ventana = mmap.mmap(af.fileno(), lon,
+                                        access=mmap.ACCESS_READ,
+                                        offset=pos)
+                    try:
+                        sha1.update(ventana)
+                    finally:
+                        ventana.close()
+                    pos += lon
+            else:
+                bloque = bytearray(TAM_BLOQUE)
+                vista = memoryview(bloque)
+                leidos = af.readinto(bloque)
+                while leidos:
+                    sha1.update(vista[:leidos])
+                    leidos = af.readinto(bloque)
+            return sha1.hexdigest()
+    except (IOError, OSError, ValueError, mmap.error):
+        return None
+
 def sha1_f (cfg, f):
     """Devuelve el SHA-1 del fichero [f], o None en caso de error."""
-    f = os.path.join(cfg["nombreDir"], f)
     if not SIMULACION:
-        with open(f, 'rb') as af:
-            try:
-                sha1 = hashlib.sha1(af.read()).hexdigest()
-            except:
-                sha1 = None
+        with abimetricas.medir("sha1"):
+            sha1 = sha1_ruta(os.path.join(cfg["nombreDir"], f))
     else:
         sha1 = None
     return sha1
 
+class CacheSha1 (object):
+    """SHA-1 de los ficheros ya calculados en ejecuciones anteriores,
+    guardados en el fichero [ruta]: para cada fichero, su SHA-1 junto a
+    su tamaño y su fecha de modificación, que deben coincidir para
+    reutilizarlo.
+    
+    Solo se graba cuando se pide, de forma atómica. Pueden usarla varios
+    hilos.
+    """
+
+    def __init__ (self, ruta):
+        self.ruta = ruta
+        self.sha1s = {}
+        self.cambios = 0
+        self.cerrojo = threading.Lock()
+        if os.path.isfile(ruta):
+            try:
+                with open(ruta, 'rb') as fr:
+                    self.sha1s = json.load(fr)
+            except ValueError:
+                abilog.aviso(u"La caché de SHA-1 «{}» está dañada; se "
+                             u"calcularán todos de nuevo.".format(ruta))
+
+    def sha1 (self, cfg, f):
+        """Devuelve el SHA-1 del fichero [f], como sha1_f, pero sin
+        calcularlo de nuevo si el fichero no ha cambiado desde que se
+        anotó.
+        """
+        try:
+            st = os.stat(os.path.join(cfg["nombreDir"], f))
+        except OSError:
+            return None
+        with self.cerrojo:
+            anotado = self.sha1s.get(f)
+        if anotado and anotado["tamano"] == st.st_size and \
+           anotado["mtime"] == st.st_mtime:
+            return anotado["sha1"]
+        sha1 = sha1_f(cfg, f)
+        if sha1 is not None:
+            with self.cerrojo:
+                self.sha1s[f] = {"sha1": sha1, "tamano": st.st_size,
+                                 "mtime": st.st_mtime}
+                self.cambios += 1
+        return sha1
+
+    def grabar (self):
+        """Graba los SHA-1 anotados, si hay alguno nuevo."""
+        with self.cerrojo:
+            if not self.cambios:
+                return
+            tmp = u"{}.tmp".format(self.ruta)
+            with open(tmp, 'wb') as fw:
+                json.dump(self.sha1s, fw)
+            os.rename(tmp, self.ruta)
+            self.cambios = 0
+
+def ruta_cache_sha1 (cfg):
+    return u"{}.NOBORRAR.sha1".format(os.path.join(cfg["nombreDir"],
+                                                   cfg["nombreCsv"]))
+
 def log_hash (cfg, f):
     """Registra el hash SHA-1 del fichero [f] en el de depuración."""
     sha1 = sha1_f(cfg, f)
@@ -190,64 +424,662 @@ def log_hash (cfg, f):
     else:
         abilog.debug(u"{}: ???".format(f))
 
+#### Conexión ##########################################################
+
+#  La constante [TCACHE_CONEXION] indica durante cuántos segundos se da
+#  por buena la última comprobación satisfactoria de la conexión con la
+#  API de Wikimedia Commons, sin necesidad de repetirla.
+#
+TCACHE_CONEXION = 60
+
+#  Momento de la última comprobación satisfactoria de la conexión.
+#
+tUltimaConexion = None
+
+#  La constante [INTENTOS_API] es el número máximo de veces que se
+#  repite una consulta a la API cuando el servidor pide esperar.
+#
+INTENTOS_API = 3
+
+#  La constante [TASA_MIN] es el mínimo de subidas por segundo al que
+#  puede reducirse el ritmo de subida, por muy saturado que se
+#  encuentre el servidor.
+#
+TASA_MIN = 1 / 60.0
+
+#  El limitador de la tasa de subidas de la sesión, compartido por todos
+#  los hilos (véase crear_limitador).
+#
+limitador = None
+
+def consultar_api (cfg, params, maxlag=True, post=False, ficheros=None):
+    """Hace una consulta a la API de cfg["urlApi"] con los parámetros
+    [params] y devuelve su respuesta, ya decodificada de JSON.
+    
+    Si [post] es True, los parámetros se envían por POST, lo que admite
+    valores más largos. Si se indican [ficheros] (como en
+    abihttp.post_multipart), se envían por POST junto a ellos.
+    Si [maxlag] es True, se pide al servidor que rechace la consulta
+    mientras su retraso de replicación supere cfg["maxlag"] segundos.
+    Cuando el servidor pide esperar, se reduce el ritmo de subida y,
+    tras esperar lo indicado, se repite la consulta hasta INTENTOS_API
+    veces en total; si la última también se rechaza, se lanza
+    abihttp.Saturacion sin esperar. Los errores de red o de
+    decodificación se propagan como excepciones.
+    """
+    params = dict(params, format="json")
+    if maxlag:
+        params["maxlag"] = cfg["maxlag"]
+    for intento in range(INTENTOS_API):
+        if ficheros:
+            r = abihttp.post_multipart(cfg["urlApi"], params, ficheros)
+        elif post:
+            r = abihttp.post(cfg["urlApi"], params)
+        else:
+            r = abihttp.get(cfg["urlApi"], params)
+        espera = abihttp.espera_pedida(r)
+        if espera is None:
+            return r.json()
+        abilog.debug(u"La API pide esperar {} segundos "
+                     u"(estado {}).".format(espera, r.estado))
+        abimetricas.contar("esperas")
+        if limitador is not None:
+            limitador.penalizar(espera)
+        if intento < INTENTOS_API - 1:
+            time.sleep(espera)
+    raise abihttp.Saturacion(espera)
+
+def crear_limitador (cfg, procesos=1):
+    """Devuelve un limitador de la tasa de subidas según la
+    configuración [cfg].
+    
+    La tasa empieza en la mitad de la máxima, cfg["tasaMax"] subidas por
+    segundo, limitada a su vez por la espera mínima cfg["tEspera"], y se
+    adapta a las respuestas del servidor a las consultas de
+    consultar_api. Con el medio de subida «pywikibot», las subidas no
+    pasan por consultar_api, sino que es Pywikibot quien atiende las
+    esperas que el servidor pide durante ellas (maxlag, ratelimited),
+    de modo que solo las de las comprobaciones reducen el ritmo de
+    subida. Si hay varios [procesos], el
+    limitador es uno solo para todos ellos (abihttp.LimitadorCompartido).
+    """
+    tasaMax = float(cfg["tasaMax"])
+    if cfg["tEspera"] > 0:
+        tasaMax = min(tasaMax, 1.0 / cfg["tEspera"])
+    if procesos > 1:
+        Limitador = abihttp.LimitadorCompartido
+    else:
+        Limitador = abihttp.LimitadorTasa
+    return Limitador(tasaMax / 2, min(TASA_MIN, tasaMax), tasaMax,
+                     capacidad=max(1, cfg["hilos"] * procesos))
+
+def comprobar_conexion (cfg):
+    """Comprueba que pueda accederse a la API de Wikimedia Commons con
+    una consulta ligera (meta=siteinfo).
+    
+    Devuelve None si todo va bien, o un mensaje de error en caso
+    contrario. Un resultado satisfactorio se reutiliza durante
+    TCACHE_CONEXION segundos.
+    """
+    global tUltimaConexion
+    if tUltimaConexion is not None and \
+       time.time() - tUltimaConexion < TCACHE_CONEXION:
+        return None
+    try:
+        d = consultar_api(cfg, {"action": "query", "meta": "siteinfo"},
+                          maxlag=False)
+        d["query"]["general"]
+    except:
+        abilog.debug(u"Error al acceder a {}.".format(cfg["urlApi"]))
+        return (u"No puede accederse a la API de Wikimedia Commons "
+                u"({}).".format(cfg["urlApi"]))
+    tUltimaConexion = time.time()
+    return None
+
 #### Pywikibot #########################################################
 
-def login_pwb ():
-    """Inicia sesión en Wikimedia Commons con Pywikibot core."""
+#  Pywikibot core solo se busca y se importa la primera vez que se
+#  necesita (véase cargar_pwb), nunca al importar este módulo ni en el
+#  modo de simulación.
+#
+DIR_PWB = None
+pywikibot = None
+upload = None
+SITE_PWB = None
+
+def cargar_pwb (directorio=None):
+    """Busca Pywikibot core con comprobar_pwb, si aún no se ha cargado,
+    y lo importa.
+    
+    Devuelve el directorio de la instalación, o bien None si no se
+    encuentra.
+    """
+    global DIR_PWB, pywikibot, upload
+    if DIR_PWB is None:
+        directorio = comprobar_pwb(directorio)
+        if directorio is None:
+            return None
+        sys.path.append(directorio)
+        import pwb
+        import pywikibot
+        sys.path.append(os.path.join(directorio,"scripts"))
+        import upload
+        DIR_PWB = directorio
+    return DIR_PWB
+
+def site_pwb ():
+    """Devuelve el sitio de Wikimedia Commons de Pywikibot, que se crea
+    en la primera llamada.
+    """
+    global SITE_PWB
+    if SITE_PWB is None:
+        cargar_pwb()
+        #SITE_PWB = pywikibot.Site('test', 'test')
+        SITE_PWB = pywikibot.Site('commons', 'commons')
+    return SITE_PWB
+
+def sesion_vigente_pwb (site):
+    """Indica si la sesión de Pywikibot en [site], con las cookies
+    guardadas de ejecuciones anteriores, sigue abierta, mediante una
+    sola consulta ligera (meta=userinfo).
+    """
+    try:
+        info = site.getuserinfo(force=True)
+        usuario = site.username()
+    except Exception:
+        abilog.debug(u"No se ha podido comprobar la sesión guardada de "
+                     u"Pywikibot.")
+        return False
+    return bool(usuario) and "anon" not in info and \
+           info.get("name") == usuario
+
+def login_pwb (cfg):
+    """Inicia sesión en Wikimedia Commons con Pywikibot core, salvo que
+    siga abierta la sesión guardada de una ejecución anterior.
+    
+    Pywikibot guarda las cookies de la sesión entre ejecuciones (en
+    pywikibot.lwp) y, durante cfg["diasCacheApi"] días, la información
+    del sitio y de los parámetros de la API que consulta al empezar.
+    """
     if not SIMULACION:
-        SITE_PWB.login()
-        while not SITE_PWB.logged_in():
+        pywikibot.config.API_config_expiry = cfg["diasCacheApi"]
+        site = site_pwb()
+        if sesion_vigente_pwb(site):
+            abilog.info(u"Se reutiliza la sesión abierta en {} como "
+                        u"«{}».".format(site, site.username()))
+            return
+        site.login()
+        while not site.logged_in():
             abilog.error(u"No se ha iniciado sesión en {} con "
-                         u"Pywikibot.".format(SITE_PWB))
+                         u"Pywikibot.".format(site))
             time.sleep(1.5)
             print
-            SITE_PWB.login()
+            site.login()
             time.sleep(1.5)
-    elif not SITE_PWB.logged_in():
-        abilog.error(u"No se ha iniciado sesión en {} con "
-                     u"Pywikibot.".format(SITE_PWB))
+
+def ajustar_pwb (cfg):
+    """Adapta la configuración de Pywikibot al ritmo de subidas que
+    marca el limitador de la tasa de subidas.
+    
+    Se anula la espera propia de Pywikibot entre escrituras
+    (put_throttle), que de otro modo se sumaría a la del limitador, y se
+    le indica el mismo maxlag que al resto de consultas.
+    """
+    if SIMULACION or cfg["motorSubida"] == "api":
+        return
+    site = site_pwb()
+    pywikibot.config.put_throttle = 0
+    pywikibot.config.maxlag = cfg["maxlag"]
+    try:
+        site.throttle.setDelays(writedelay=0)
+    except (AttributeError, TypeError):
+        abilog.debug(u"No se ha podido ajustar la espera de Pywikibot "
+                     u"entre escrituras.")
 
 def subir (cfg, f, fdestino, descr):
     """Trata de subir el fichero de nombre [f] a Wikimedia Commons con
     el nombre [fdestino] y la descripción [descr].
     """
-    if not SIMULACION:
-        bot = upload.UploadRobot(url=[os.path.join(cfg["nombreDir"], f)],
+    if not SIMULACION and cfg["motorSubida"] == "api":
+        with abimetricas.medir("subida"):
+            subir_api(cfg, f, fdestino, descr)
+    elif not SIMULACION:
+        ruta = os.path.join(cfg["nombreDir"], f)
+        if cfg["tamTrozo"] and os.path.getsize(ruta) >= cfg["umbralTrozos"]:
+            tamTrozo = cfg["tamTrozo"]
+        else:
+            tamTrozo = 0
+        bot = upload.UploadRobot(url=[ruta],
                                  description=descr,
                                  useFilename=fdestino,
                                  keepFilename=True,
                                  verifyDescription=False,
                                  ignoreWarning=False,
-                                 targetSite=SITE_PWB,
+                                 targetSite=site_pwb(),
                                  aborts=True,
-                                 always=True)
-        bot.run()
+                                 always=True,
+                                 chunk_size=tamTrozo)
+        with abimetricas.medir("subida"):
+            bot.run()
     return 0
 
+#### API de subida ####################################################
+
+#  La constante [VAR_CONTRASENA_API] es el nombre de la variable de
+#  entorno que puede indicar la contraseña de bot para subir por la API,
+#  en lugar del archivo de configuración.
+#
+VAR_CONTRASENA_API = "CSVAC_CONTRASENA"
+
+#  La constante [COMENTARIO_API] es el resumen de edición de las
+#  subidas por la API.
+#
+COMENTARIO_API = u"Subida con CSV a Commons"
+
+#  Ficha de edición (csrf) de la sesión iniciada con login_api.
+#
+tokenApi = None
+
+def login_api (cfg):
+    """Inicia sesión en la API de cfg["urlApi"] con el usuario
+    cfg["usuarioApi"] y la contraseña de bot cfg["contrasenaApi"], y
+    obtiene la ficha de edición para las subidas.
+    
+    Devuelve None si todo va bien, o un mensaje de error en caso
+    contrario.
+    """
+    global tokenApi
+    try:
+        d = consultar_api(cfg, {"action": "query", "meta": "tokens",
+                                "type": "login"}, maxlag=False)
+        d = consultar_api(cfg, {"action": "login",
+                                "lgname": cfg["usuarioApi"],
+                                "lgpassword": cfg["contrasenaApi"],
+                                "lgtoken": d["query"]["tokens"]
+                                            ["logintoken"]},
+                          maxlag=False, post=True)
+        if d["login"]["result"] != "Success":
+            return (u"No se ha podido iniciar sesión en {} como «{}»: "
+                    u"{}.".format(cfg["urlApi"], cfg["usuarioApi"],
+                                  d["login"].get("reason",
+                                                 d["login"]["result"])))
+        d = consultar_api(cfg, {"action": "query", "meta": "tokens"},
+                          maxlag=False)
+        tokenApi = d["query"]["tokens"]["csrftoken"]
+    except Exception as e:
+        abilog.debug(u"Error al iniciar sesión en {}: "
+                     u"{}".format(cfg["urlApi"], e))
+        return (u"No se ha podido iniciar sesión en {}.".format(
+                    cfg["urlApi"]))
+    abilog.info(u"Se ha iniciado sesión en {} como "
+                u"«{}».".format(cfg["urlApi"], cfg["usuarioApi"]))
+    return None
+
+def renovar_ficha (cfg):
+    """Obtiene una nueva ficha de edición para las subidas."""
+    global tokenApi
+    abilog.debug(u"Se renueva la ficha de edición.")
+    tokenApi = consultar_api(cfg, {"action": "query", "meta": "tokens"},
+                             maxlag=False)["query"]["tokens"]["csrftoken"]
+
+def peticion_subida (cfg, params, ficheros=None):
+    """Envía a la API una petición de subida (action=upload) con los
+    parámetros [params] y los [ficheros] indicados, como en
+    consultar_api, y devuelve su respuesta.
+    
+    Si la ficha de edición ha caducado, se renueva y se repite la
+    petición una vez. Los errores de red se propagan como excepciones.
+    """
+    for intento in (1, 2):
+        d = consultar_api(cfg, dict(params, action="upload",
+                                    token=tokenApi),
+                          post=True, ficheros=ficheros)
+        if d.get("error", {}).get("code") == "badtoken" and intento == 1:
+            renovar_ficha(cfg)
+            continue
+        return d
+
+def informar_subida (f, d):
+    """Registra los errores o las advertencias de la respuesta [d] de
+    la API a la subida del fichero [f], si los hay.
+    """
+    error = d.get("error")
+    if error:
+        abilog.error(u"La API rechaza la subida de «{}»: {} "
+                     u"({}).".format(f, error.get("info"),
+                                     error.get("code")))
+    elif d["upload"]["result"] != "Success":
+        abilog.error(u"La API no sube «{}» por las advertencias "
+                     u"{}.".format(f, d["upload"].get("warnings")))
+
+def subir_api (cfg, f, fdestino, descr):
+    """Sube el fichero de nombre [f] a Wikimedia Commons con el nombre
+    [fdestino] y la descripción [descr] directamente por la API
+    (action=upload), sin Pywikibot.
+    
+    Como con Pywikibot, cualquier advertencia de la API (fichero ya
+    existente, duplicado...) impide la subida. Los errores se registran;
+    el resultado se verifica después con comprobar_subida.
+    Los ficheros de cfg["umbralTrozos"] bytes o más, y todos si
+    cfg["alijoPrevio"] es True, se suben por trozos, con
+    subir_api_trozos.
+    """
+    ruta = os.path.join(cfg["nombreDir"], f)
+    if cfg["alijoPrevio"] or \
+       (cfg["tamTrozo"] and os.path.getsize(ruta) >= cfg["umbralTrozos"]):
+        subir_api_trozos(cfg, f, fdestino, descr)
+        return
+    with open(ruta, 'rb') as fi:
+        contenido = fi.read()
+    try:
+        d = peticion_subida(cfg, {"filename": fdestino, "text": descr,
+                                  "comment": COMENTARIO_API},
+                            {"file": (fdestino, contenido)})
+    except Exception as e:
+        abilog.error(u"Error al subir «{}»: {}".format(f, e))
+        return
+    informar_subida(f, d)
+
+#### Subidas por trozos ################################################
+
+#  La constante [INTENTOS_TROZO] es el número de veces que se envía un
+#  trozo ante errores de red antes de abandonar la subida, que podrá
+#  reanudarse más tarde desde ese mismo trozo.
+#
+INTENTOS_TROZO = 3
+
+class RegistroTrozos (object):
+    """Progreso de las subidas por trozos en curso, guardado en el
+    fichero [ruta]: para cada fichero, la clave con que el servidor
+    guarda los trozos recibidos (filekey) y los bytes que ya ha
+    aceptado, junto al tamaño y la fecha de modificación del fichero,
+    que deben coincidir para reanudar la subida.
+    
+    Cada cambio se graba de forma atómica y se fuerza a disco antes de
+    enviar el trozo siguiente. Pueden usarlo varios hilos.
+    """
+
+    def __init__ (self, ruta):
+        self.ruta = ruta
+        self.subidas = {}
+        self.cerrojo = threading.Lock()
+        if os.path.isfile(ruta):
+            try:
+                with open(ruta, 'rb') as fr:
+                    self.subidas = json.load(fr)
+            except ValueError:
+                abilog.aviso(u"El registro de subidas por trozos «{}» "
+                             u"está dañado; las subidas empezarán de "
+                             u"nuevo.".format(ruta))
+
+    def reanudar (self, f, st):
+        """Devuelve la clave y los bytes aceptados de la subida en
+        curso del fichero [f], cuyo estado (os.stat) es [st], o bien
+        (None, 0) si no la hay o el fichero ha cambiado.
+        """
+        with self.cerrojo:
+            subida = self.subidas.get(f)
+        if subida and subida["tamano"] == st.st_size and \
+           subida["mtime"] == st.st_mtime:
+            return subida["filekey"], subida["offset"]
+        return None, 0
+
+    def anotar (self, f, st, filekey, offset):
+        """Anota que el servidor ha aceptado [offset] bytes del fichero
+        [f], cuyo estado es [st], con la clave [filekey].
+        """
+        with self.cerrojo:
+            self.subidas[f] = {"filekey": filekey, "offset": offset,
+                               "tamano": st.st_size, "mtime": st.st_mtime}
+            self.grabar()
+
+    def olvidar (self, f):
+        """Elimina la subida en curso del fichero [f], si la hay."""
+        with self.cerrojo:
+            if self.subidas.pop(f, None) is not None:
+                self.grabar()
+
+    def grabar (self):
+        tmp = u"{}.tmp".format(self.ruta)
+        with open(tmp, 'wb') as fw:
+            json.dump(self.subidas, fw)
+            fw.flush()
+            os.fsync(fw.fileno())
+        os.rename(tmp, self.ruta)
+        grabar_directorio(self.ruta)
+
+#  Registro de las subidas por trozos del fichero de CSV en curso,
+#  creado en su primer uso.
+#
+registroTrozos = None
+cerrojoTrozos = threading.Lock()
+
+def ruta_trozos (cfg):
+    return u"{}.NOBORRAR.trozos{}".format(os.path.join(cfg["nombreDir"],
+                                                       cfg["nombreCsv"]),
+                                          sufijo_fragmento())
+
+def registro_trozos (cfg):
+    """Devuelve el registro de las subidas por trozos en curso."""
+    global registroTrozos
+    with cerrojoTrozos:
+        if registroTrozos is None or \
+           registroTrozos.ruta != ruta_trozos(cfg):
+            registroTrozos = RegistroTrozos(ruta_trozos(cfg))
+        return registroTrozos
+
+def alijar_api (cfg, f, fdestino):
+    """Sube el fichero [f], con el nombre [fdestino], al alijo (stash)
+    del servidor por trozos de cfg["tamTrozo"] bytes (o de una vez si es
+    0), sin publicarlo, y devuelve la clave (filekey) con que lo guarda,
+    o bien None si no se ha logrado.
+    
+    Tras cada trozo aceptado, el progreso se guarda en el registro de
+    trozos, de modo que una subida fallida o interrumpida se reanuda
+    desde el último trozo aceptado en lugar de desde el principio; un
+    fichero ya alijado por completo no se sube de nuevo. Si el servidor
+    rechaza la subida guardada (por ejemplo, porque su alijo ha
+    caducado), la siguiente empieza de nuevo. Solo se mantiene en
+    memoria un trozo.
+    """
+    ruta = os.path.join(cfg["nombreDir"], f)
+    registro = registro_trozos(cfg)
+    st = os.stat(ruta)
+    filekey, offset = registro.reanudar(f, st)
+    if 0 < offset < st.st_size:
+        abilog.info(u"Se reanuda la subida de «{}» desde el byte {} de "
+                    u"{}.".format(f, offset, st.st_size))
+    with open(ruta, 'rb') as fi:
+        while filekey is None or offset < st.st_size:
+            fi.seek(offset)
+            trozo = fi.read(cfg["tamTrozo"] or st.st_size)
+            params = {"filename": fdestino, "filesize": st.st_size,
+                      "offset": offset, "stash": 1}
+            if filekey:
+                params["filekey"] = filekey
+            d = None
+            for intento in range(INTENTOS_TROZO):
+                try:
+                    d = peticion_subida(cfg, params,
+                                        {"chunk": (fdestino, trozo)})
+                    break
+                except Exception as e:
+                    abilog.aviso(u"Error al enviar el trozo del byte {} "
+                                 u"de «{}»: {}".format(offset, f, e))
+                    abimetricas.contar("reintentosTrozo")
+            if d is None:
+                abilog.error(u"No se ha podido subir «{}»; la próxima vez "
+                             u"se reanudará desde el byte "
+                             u"{}.".format(f, offset))
+                return None
+            if "error" in d or \
+               d["upload"]["result"] not in ("Continue", "Success"):
+                registro.olvidar(f)
+                informar_subida(f, d)
+                return None
+            filekey = d["upload"]["filekey"]
+            if d["upload"]["result"] == "Continue":
+                offset = int(d["upload"]["offset"])
+            else:
+                offset = st.st_size
+            registro.anotar(f, st, filekey, offset)
+            abimetricas.contar("trozos")
+    return filekey
+
+def subir_api_trozos (cfg, f, fdestino, descr):
+    """Sube el fichero [f] como subir_api, pero al alijo y por trozos,
+    con alijar_api, y lo publica después desde él con la descripción
+    [descr]. Si el fichero ya estaba alijado, solo se publica.
+    """
+    filekey = alijar_api(cfg, f, fdestino)
+    if filekey is None:
+        return
+    try:
+        d = peticion_subida(cfg, {"filename": fdestino, "filekey": filekey,
+                                  "text": descr,
+                                  "comment": COMENTARIO_API})
+    except Exception as e:
+        abilog.error(u"Error al publicar «{}» desde el alijo: "
+                     u"{}".format(f, e))
+        return
+    registro_trozos(cfg).olvidar(f)
+    informar_subida(f, d)
+
 #### CSV ###############################################################
 
+def indexar_csv (ruta):
+    """Recorre una vez el fichero de CSV de ruta [ruta] y devuelve las
+    posiciones (en bytes) en que comienza cada una de sus filas, incluida
+    la de los nombres de los campos.
+    
+    Se tienen en cuenta los saltos de línea dentro de valores entre
+    comillas. Las filas no se conservan en memoria.
+    """
+    posiciones = array.array('L')
+    pos = [0]
+    with open(ruta, 'rb') as f:
+        def lineas ():
+            for linea in f:
+                pos[0] += len(linea)
+                yield linea
+        inicio = 0
+        for fila in csv.reader(lineas()):
+            posiciones.append(inicio)
+            inicio = pos[0]
+    return posiciones
+
+def cargar_indice (cfg):
+    """Devuelve las posiciones de inicio de las filas del fichero de CSV
+    de nombre cfg["nombreCsv"], en el directorio cfg["nombreDir"].
+    
+    Las posiciones se guardan en el fichero cfg["nombreCsv"].NOBORRAR.indice
+    junto al tamaño y la fecha de modificación del fichero de CSV, y se
+    reutilizan mientras estos no cambien; en otro caso, se calculan de
+    nuevo con indexar_csv.
+    """
+    ruta = os.path.join(cfg["nombreDir"], cfg["nombreCsv"])
+    rutaIndice = u"{}.NOBORRAR.indice".format(ruta)
+    st = os.stat(ruta)
+    huella = {"tamano": st.st_size, "mtime": st.st_mtime,
+              "bytes": array.array('L').itemsize}
+    if os.path.isfile(rutaIndice):
+        try:
+            with open(rutaIndice, 'rb') as f:
+                cabecera = json.loads(f.readline())
+                if all(cabecera.get(k) == v for k, v in huella.items()):
+                    posiciones = array.array('L')
+                    posiciones.fromfile(f, cabecera["filas"])
+                    abilog.debug(u"Se reutiliza el índice de filas de "
+                                 u"«{}».".format(cfg["nombreCsv"]))
+                    return posiciones
+        except (IOError, EOFError, ValueError, KeyError):
+            pass
+        abilog.debug(u"El índice de filas de «{}» no corresponde al "
+                     u"fichero actual.".format(cfg["nombreCsv"]))
+    posiciones = indexar_csv(ruta)
+    huella["filas"] = len(posiciones)
+    tmp = u"{}.tmp".format(rutaIndice)
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(json.dumps(huella) + "\n")
+            posiciones.tofile(f)
+        os.rename(tmp, rutaIndice)
+    except (IOError, OSError):
+        abilog.aviso(u"No se ha podido guardar el índice de filas de "
+                     u"«{}».".format(cfg["nombreCsv"]))
+    return posiciones
+
+class FilasCsv (object):
+    """Secuencia de las filas de información de un fichero de CSV que
+    se leen y decodifican solo cuando se piden, a partir de las
+    posiciones de inicio de cada fila [posiciones].
+    
+    El acceso a la fila siguiente a la última leída continúa la lectura
+    sin desplazarse por el fichero; cualquier otra fila se alcanza
+    directamente con seek. [Fila] es la clase de las filas devueltas.
+    Puede compartirse entre varios hilos.
+    """
+
+    def __init__ (self, ruta, posiciones, Fila):
+        self.ruta = ruta
+        self.posiciones = posiciones
+        self.Fila = Fila
+        self.f = None
+        self.lector = None
+        self.siguiente = None
+        self.cerrojo = threading.Lock()
+
+    def __len__ (self):
+        return len(self.posiciones)
+
+    def __getitem__ (self, i):
+        if i < 0:
+            i += len(self.posiciones)
+        if not 0 <= i < len(self.posiciones):
+            raise IndexError(i)
+        with self.cerrojo:
+            if i != self.siguiente:
+                if self.f is None:
+                    self.f = open(self.ruta, 'rb')
+                self.f.seek(self.posiciones[i])
+                self.lector = csv.reader(iter(self.f.readline, b""))
+            fila = next(self.lector)
+            self.siguiente = i + 1
+        return self.Fila(valor.decode('utf-8') for valor in fila)
+
+    def __iter__ (self):
+        for i in xrange(len(self.posiciones)):
+            yield self[i]
+
+    def cerrar (self):
+        with self.cerrojo:
+            if self.f is not None:
+                self.f.close()
+                self.f = None
+                self.siguiente = None
+
 def leer_csv (cfg):
-    """Lee el fichero de CSV de nombre cfg["nombreCsv"], en el
-    directorio cfg["nombreDir"], decodifica su contenido usando UTF-8 y
-    lo devuelve en forma de lista.
+    """Abre el fichero de CSV de nombre cfg["nombreCsv"], en el
+    directorio cfg["nombreDir"], y lo devuelve en forma de
+    ConjuntoDatos cuyas filas se leen y decodifican de UTF-8 a medida
+    que se usan (véanse cargar_indice y FilasCsv).
     
-    La estructura de la lista devuelta es:
-        [fila_1,fila_2,...,fila_i], donde
-            fila_n es una lista de los elementos de la fila n;
-            i es el número de columnas en el fichero de CSV.
-    En caso de error, devuelve la lista vacía.
+    La primera fila del fichero se toma como los nombres de los campos.
+    En caso de error o si el fichero está vacío, devuelve la lista
+    vacía.
     """
     datos = []
-    if os.path.isfile(os.path.join(cfg["nombreDir"], cfg["nombreCsv"])):
+    ruta = os.path.join(cfg["nombreDir"], cfg["nombreCsv"])
+    if os.path.isfile(ruta):
         abilog.info(u"Iniciando lectura del fichero "
                     u"«{}».".format(cfg["nombreCsv"]))
-        with open(os.path.join(cfg["nombreDir"],
-                               cfg["nombreCsv"]), 'rb') as f:
-            reader = csv.reader(f)
-            for fila in reader:
-                for i in range(len(fila)):
-                    fila[i] = fila[i].decode('utf-8')
-                datos.append(fila)
+        posiciones = cargar_indice(cfg)
+        if posiciones:
+            with open(ruta, 'rb') as f:
+                campos = next(csv.reader(f))
+            datos = ConjuntoDatos([valor.decode('utf-8')
+                                   for valor in campos])
+            datos.filas = FilasCsv(ruta, posiciones[1:], datos.Fila)
     else:
         abilog.error(u"No se encuentra el fichero «{}». "
                      u"Es posible que no exista o que no sea "
@@ -256,6 +1088,74 @@ def leer_csv (cfg):
 
 #### Base ##############################################################
 
+class Fila (tuple):
+    """Fila de información de un conjunto de datos, con sus valores
+    accesibles tanto por número de orden del campo (fila[n]) como por
+    nombre del campo (fila.valor(nombre)).
+    
+    Cada ConjuntoDatos crea su propia subclase de Fila, cuyo atributo
+    [indice] relaciona los nombres de sus campos con sus números de
+    orden, de modo que cada fila solo ocupa lo que una tupla.
+    """
+
+    __slots__ = ()
+    indice = {}
+
+    def valor (self, nombreCampo):
+        """Devuelve el valor del campo de nombre [nombreCampo]."""
+        return self[self.indice[nombreCampo]]
+
+class ConjuntoDatos (object):
+    """Conjunto de datos de un fichero de CSV.
+    
+    Como una lista, datos[0] es la lista de nombres de los campos, y
+    datos[n], con n > 0, la n-ésima fila de información (una Fila).
+    Los números de orden de los campos se calculan una sola vez, al
+    construir el conjunto de datos.
+    
+    Las filas se guardan en [filas], una lista o cualquier otra
+    secuencia de objetos de la clase [Fila] del conjunto de datos, como
+    FilasCsv.
+    """
+
+    def __init__ (self, campos, filas=()):
+        self.campos = list(campos)
+        # En caso de nombres repetidos, prevalece el primero, como en
+        # nombre_num_campo.
+        self.indice = {}
+        for ncampo in reversed(range(len(self.campos))):
+            self.indice[self.campos[ncampo]] = ncampo
+        self.Fila = type("Fila", (Fila,), {"__slots__": (),
+                                          "indice": self.indice})
+        self.filas = [self.Fila(fila) for fila in filas]
+        # Plantillas compiladas para el conjunto de datos, por función
+        # (véase plantilla_compilada).
+        self.plantillas = {}
+
+    def append (self, fila):
+        self.filas.append(self.Fila(fila))
+
+    def num_campo (self, nombreCampo):
+        """Devuelve el número de orden del campo de nombre
+        [nombreCampo], o bien None si no existe.
+        """
+        return self.indice.get(nombreCampo)
+
+    def __len__ (self):
+        return len(self.filas) + 1
+
+    def __getitem__ (self, nfila):
+        if nfila < 0:
+            nfila += len(self)
+        if nfila == 0:
+            return self.campos
+        return self.filas[nfila-1]
+
+    def __iter__ (self):
+        yield self.campos
+        for fila in self.filas:
+            yield fila
+
 def print_datos (datos):
     for fila in datos:
         for elemento in fila:
@@ -273,6 +1173,21 @@ def nombre_num_campo (campos, nombreCampo):
     if nombreCampo in campos:
         numCampo = campos.index(nombreCampo)
     return numCampo
+
+def num_campo (datos, nombreCampo):
+    """Devuelve el número de orden del campo de nombre [nombreCampo] del
+    conjunto de datos [datos], o bien None si no existe un campo con tal
+    nombre.
+    
+    Si [datos] es un ConjuntoDatos, se evita recorrer los nombres de los
+    campos. Se reconoce por su método num_campo, y no por su clase, pues
+    csvcfg, al importar csvac, obtiene otra copia del módulo cuando este
+    se ejecuta como programa.
+    """
+    buscar = getattr(datos, "num_campo", None)
+    if buscar is not None:
+        return buscar(nombreCampo)
+    return nombre_num_campo(datos[0], nombreCampo)
     
 def valores (datos, fila, nombreCampos):
     """Devuelve los valores de los campos de nombre [nombreCampos] de la
@@ -282,7 +1197,7 @@ def valores (datos, fila, nombreCampos):
     """
     valores = []
     for nombreCampo in nombreCampos:
-        numCampo = nombre_num_campo(datos[0],nombreCampo)
+        numCampo = num_campo(datos, nombreCampo)
         if numCampo is None:
             abilog.error(u"No existe el campo de nombre «{}» en "
                          u"el fichero de CSV.".format(nombreCampo))
@@ -291,70 +1206,474 @@ def valores (datos, fila, nombreCampos):
             valores.append(datos[fila][numCampo])
     return tuple(valores)
 
+#  La expresión regular [RE_CAMPO_PLANTILLA] reconoce los campos de las
+#  plantillas de descripción, de la forma %(Nombre del campo)s, cuyo
+#  nombre captura, y los signos de porcentaje escritos como %%, sin
+#  captura, para que lo que los sigue no se tome por un campo.
+#
+RE_CAMPO_PLANTILLA = re.compile(r"%\(([^)]*)\)s|%%")
+
+class Plantilla (object):
+    """Plantilla de descripción [texto], con los valores de los campos
+    indicados como %(Nombre del campo)s, compilada para la lista de
+    campos [campos].
+    
+    Los nombres de los campos se resuelven una sola vez, al compilarla;
+    si alguno no existe, se lanza ValueError.
+    """
+
+    def __init__ (self, texto, campos):
+        indices = []
+        for m in RE_CAMPO_PLANTILLA.finditer(texto):
+            if m.group(1) is None:
+                continue
+            ncampo = nombre_num_campo(campos, m.group(1))
+            if ncampo is None:
+                raise ValueError(u"No existe el campo de nombre «{}» en "
+                                 u"el fichero de CSV.".format(m.group(1)))
+            indices.append(ncampo)
+        self.texto = RE_CAMPO_PLANTILLA.sub(
+            lambda m: "%%" if m.group(1) is None else "%s", texto)
+        if len(indices) == 1:
+            ncampo = indices[0]
+            self.valores = lambda fila: (fila[ncampo],)
+        elif indices:
+            self.valores = operator.itemgetter(*indices)
+        else:
+            self.valores = lambda fila: ()
+
+    def rellenar (self, fila):
+        """Devuelve la descripción de la fila de información [fila]."""
+        return self.texto % self.valores(fila)
+
+    def rellenar_filas (self, datos, inicio=1, fin=None):
+        """Devuelve un iterador de pares (número de orden, descripción)
+        de las filas del conjunto de datos [datos] desde la de número de
+        orden [inicio] hasta la anterior a [fin] (o hasta la última).
+        """
+        if fin is None:
+            fin = len(datos)
+        texto = self.texto
+        valores = self.valores
+        for nfila in xrange(inicio, fin):
+            yield nfila, texto % valores(datos[nfila])
+
+    def tamanos (self, datos, inicio=1, fin=None):
+        """Devuelve un iterador de pares (número de orden, tamaño en
+        bytes de la descripción en UTF-8) de las filas de [datos], como
+        rellenar_filas.
+        """
+        for nfila, descr in self.rellenar_filas(datos, inicio, fin):
+            yield nfila, len(descr.encode('utf-8'))
+
+#  Plantillas ya compiladas, por texto y lista de campos.
+#
+plantillas = {}
+
+def compilar_plantilla (datos, texto):
+    """Devuelve la Plantilla de texto [texto] compilada para los campos
+    del conjunto de datos [datos], compilándola solo la primera vez.
+    """
+    clave = (texto, tuple(datos[0]))
+    plantilla = plantillas.get(clave)
+    if plantilla is None:
+        plantilla = plantillas[clave] = Plantilla(texto, datos[0])
+    return plantilla
+
+def plantilla_compilada (datos, funcion):
+    """Devuelve la Plantilla del texto que devuelve [funcion] (como
+    csvcfg.plantilla) compilada para el conjunto de datos [datos], con
+    compilar_plantilla. La función solo se llama la primera vez para
+    cada conjunto de datos.
+    """
+    compiladas = getattr(datos, "plantillas", None)
+    if compiladas is None:
+        return compilar_plantilla(datos, funcion())
+    plantilla = compiladas.get(funcion)
+    if plantilla is None:
+        plantilla = compiladas[funcion] = compilar_plantilla(datos,
+                                                             funcion())
+    return plantilla
+
 #### Ficheros ##########################################################
 
-def copia_seguridad (nombrefichero):
+#  La constante [FICLONE] es la petición ioctl de Linux que hace que un
+#  fichero comparta los bloques de otro (reflink) hasta que alguno de
+#  los dos se modifique, en los sistemas de ficheros que lo permiten
+#  (Btrfs, XFS...).
+#
+FICLONE = 0x40049409
+
+def copiar_fichero (origen, destino):
+    """Copia el fichero [origen] en [destino] mediante un reflink si el
+    sistema de ficheros lo permite, o por bloques de TAM_BLOQUE bytes en
+    caso contrario, sin cargarlo nunca entero en memoria.
+    """
+    with open(origen, 'rb') as fi:
+        with open(destino, 'wb') as fo:
+            try:
+                import fcntl
+                fcntl.ioctl(fo.fileno(), FICLONE, fi.fileno())
+                return
+            except (ImportError, IOError, OSError):
+                pass
+            while True:
+                bloque = fi.read(TAM_BLOQUE)
+                if not bloque:
+                    break
+                fo.write(bloque)
+
+def copias_de_seguridad (nombrefichero):
+    """Devuelve las rutas de las copias de seguridad del fichero de
+    nombre [nombrefichero], de la más antigua a la más reciente.
+    """
+    directorio, base = os.path.split(os.path.abspath(nombrefichero))
+    patron = re.compile(r"{}\.\d{{14}}$".format(re.escape(base)))
+    return [os.path.join(directorio, nombre)
+            for nombre in sorted(os.listdir(directorio))
+            if patron.match(nombre)]
+
+def anotar_copia (nombrefichero, copia, sha1, st):
+    """Anota junto al fichero de nombre [nombrefichero] que su copia de
+    seguridad más reciente es [copia], con SHA-1 [sha1], hecha cuando el
+    fichero tenía el tamaño y la fecha de modificación de [st].
+    """
+    ruta = u"{}.NOBORRAR.copia".format(nombrefichero)
+    tmp = u"{}.tmp".format(ruta)
+    try:
+        with open(tmp, 'wb') as fw:
+            json.dump({"copia": os.path.basename(copia), "sha1": sha1,
+                       "tamano": st.st_size, "mtime": st.st_mtime}, fw)
+        os.rename(tmp, ruta)
+    except (IOError, OSError) as e:
+        abilog.debug(u"No se ha podido anotar la copia de seguridad "
+                     u"«{}»: {}".format(copia, e))
+
+def copia_anotada (nombrefichero, copia):
+    """Devuelve lo anotado con anotar_copia sobre la copia de seguridad
+    [copia] del fichero de nombre [nombrefichero], o None si no consta.
+    """
+    try:
+        with open(u"{}.NOBORRAR.copia".format(nombrefichero), 'rb') as fr:
+            anotado = json.load(fr)
+    except (IOError, OSError, ValueError):
+        return None
+    if anotado.get("copia") != os.path.basename(copia):
+        return None
+    return anotado
+
+def copia_seguridad (nombrefichero, copiasMax=None):
     """Crea una copia de seguridad del fichero de nombre [nombrefichero]
-    con la fecha y la hora actuales.
+    con la fecha y la hora actuales, salvo que su contenido coincida con
+    el de la copia más reciente. Se conservan a lo sumo las [copiasMax]
+    copias más recientes, o todas si no se indica.
+    
+    El SHA-1 de la copia más reciente se anota junto al fichero, con su
+    tamaño y su fecha de modificación, de modo que, si no ha cambiado,
+    no hace falta leer de nuevo ni el fichero ni la copia.
     
     Devuelve None si todo va bien, o un mensaje de error en caso
     contrario.
     """
-    if os.path.isfile(nombrefichero):
-        fi = open(u"{}".format(nombrefichero), 'r')
-        contenido = fi.read()
-        fi.close()
-        fo = open(u"{}.{}".format(nombrefichero,
-                                  time.strftime("%Y%m%d%H%M%S")), 'w')
-        fo.write(contenido)
-        fo.close()
-    else:
+    if not os.path.isfile(nombrefichero):
         return (u"No se encuentra el fichero «{}». "
                 u"Es posible que no exista o que no sea "
                 u"legible.".format(nombrefichero))
+    st = os.stat(nombrefichero)
+    copias = copias_de_seguridad(nombrefichero)
+    coincide = False
+    if copias:
+        anotado = copia_anotada(nombrefichero, copias[-1])
+        if anotado and anotado["tamano"] == st.st_size and \
+           anotado["mtime"] == st.st_mtime:
+            coincide = True
+        elif os.path.getsize(copias[-1]) == st.st_size:
+            if anotado:
+                sha1Copia = anotado["sha1"]
+            else:
+                sha1Copia = sha1_ruta(copias[-1])
+            if sha1Copia is not None and \
+               sha1Copia == sha1_ruta(nombrefichero):
+                coincide = True
+                anotar_copia(nombrefichero, copias[-1], sha1Copia, st)
+    if coincide:
+        abilog.debug(u"La copia de seguridad «{}» ya coincide con el "
+                     u"fichero.".format(copias[-1]))
+    else:
+        copia = u"{}.{}".format(nombrefichero,
+                                time.strftime("%Y%m%d%H%M%S"))
+        tmp = u"{}.tmp".format(copia)
+        try:
+            copiar_fichero(nombrefichero, tmp)
+            os.rename(tmp, copia)
+        except (IOError, OSError) as e:
+            return (u"No se ha podido crear la copia de seguridad "
+                    u"«{}»: {}".format(copia, e))
+        anotar_copia(nombrefichero, copia, sha1_ruta(copia), st)
+        if copia not in copias:
+            copias.append(copia)
+    if copiasMax:
+        for antigua in copias[:-copiasMax]:
+            abilog.aviso(u"Se elimina la copia de seguridad «{}», "
+                         u"pues se conservan solo las {} más "
+                         u"recientes (copiasMax).".format(antigua,
+                                                          copiasMax))
+            os.remove(antigua)
     return None
 
-def guardar_fila (cfg, ifila):
-    """Guarda [ifila] como contenido del fichero de texto
-    cfg["nombreCsv"].NOBORRAR.ifila, ubicado en cfg["nombreDir"].
+#  Estados de las filas en el diario de la sesión de subida.
+#
+PENDIENTE = "pendiente"     # a punto de subirse
+SUBIDA = "subida"           # subida, pero aún no verificada
+VERIFICADA = "verificada"   # verificada en Wikimedia Commons
+FALLIDA = "fallida"         # no se ha logrado subir
+
+#  La constante [DIARIO_LOTE] es el número máximo de registros del
+#  diario que pueden escribirse sin forzar su grabación en disco
+#  (fsync), y el número de filas que se marcan como pendientes de una
+#  sola vez.
+#
+DIARIO_LOTE = 32
+
+class Diario (object):
+    """Diario de la sesión de subida: fichero de texto de solo adición
+    en [ruta] con un registro «número_de_fila estado» por cada cambio de
+    estado de una fila.
+    
+    Antes de subir una fila, se registra como PENDIENTE, de manera que
+    cualquier fila que conste en el diario sin estar VERIFICADA puede
+    haberse subido en una sesión interrumpida (es dudosa), y cualquier
+    fila que no conste en él no ha llegado a subirse.
+    La grabación en disco (fsync) se hace por lotes de DIARIO_LOTE
+    registros, salvo la de las filas pendientes, que se hace siempre
+    antes de subirlas. Puede compartirse entre varios hilos.
     """
-    f = open(u"{}.NOBORRAR.ifila".format(os.path.join(cfg["nombreDir"], 
-                                                      cfg["nombreCsv"])), 
-             'w')
-    f.write(str(ifila))
-    f.close()
+
+    def __init__ (self, ruta):
+        self.ruta = ruta
+        self.estados = {}
+        self.dudosas = set()
+        self.pendientesHasta = 0
+        self.sinGrabar = 0
+        self.f = None
+        self.cerrojo = threading.RLock()
+
+    def cargar (self):
+        """Reconstruye el estado de cada fila con una lectura secuencial
+        del diario, descartando el último registro si quedó a medias.
+        
+        Si el diario tiene muchos más registros que filas, se compacta.
+        """
+        registros = 0
+        validos = 0
+        if os.path.isfile(self.ruta):
+            with open(self.ruta, 'rb') as f:
+                for linea in f:
+                    if not linea.endswith("\n"):
+                        break
+                    partes = linea.split()
+                    if len(partes) != 2 or not partes[0].isdigit() or \
+                       partes[1] not in (PENDIENTE, SUBIDA, VERIFICADA,
+                                         FALLIDA):
+                        break
+                    self.estados[int(partes[0])] = partes[1]
+                    registros += 1
+                    validos += len(linea)
+            if validos < os.path.getsize(self.ruta):
+                abilog.aviso(u"El diario «{}» tiene un último registro "
+                             u"incompleto, que se "
+                             u"descarta.".format(self.ruta))
+                with open(self.ruta, 'r+b') as f:
+                    f.truncate(validos)
+        self.dudosas = set(nfila for nfila, estado in self.estados.items()
+                           if estado != VERIFICADA)
+        if registros > 2 * len(self.estados) + DIARIO_LOTE:
+            self.compactar()
+        return self
+
+    def completas (self):
+        """Devuelve el conjunto de las filas verificadas."""
+        with self.cerrojo:
+            return set(nfila for nfila, estado in self.estados.items()
+                       if estado == VERIFICADA)
+
+    def dudosa (self, nfila):
+        """Indica si la fila [nfila] pudo subirse en una sesión anterior
+        sin llegar a verificarse.
+        """
+        return nfila in self.dudosas
+
+    def abrir (self):
+        if self.f is None:
+            self.f = open(self.ruta, 'ab')
+
+    def escribir (self, nfila, estado):
+        self.abrir()
+        self.f.write("{} {}\n".format(nfila, estado))
+        self.f.flush()
+        self.estados[nfila] = estado
+        self.sinGrabar += 1
+
+    def grabar (self):
+        """Fuerza la grabación en disco de los registros escritos."""
+        with self.cerrojo:
+            if self.f is not None and self.sinGrabar:
+                self.f.flush()
+                os.fsync(self.f.fileno())
+                self.sinGrabar = 0
+
+    def registrar (self, nfila, estado):
+        """Registra el nuevo estado [estado] de la fila [nfila]."""
+        with self.cerrojo:
+            self.escribir(nfila, estado)
+            if self.sinGrabar >= DIARIO_LOTE:
+                self.grabar()
+
+    def preparar_subida (self, nfila, fin, saltar=frozenset()):
+        """Asegura que la fila [nfila] conste en el diario como pendiente
+        antes de subirla. Si no consta, se registran como pendientes, de
+        una sola vez, ella y las siguientes filas anteriores a la de
+        número de orden [fin] hasta completar un lote, salvo las ya
+        verificadas y las de [saltar], y se graban.
+        """
+        with self.cerrojo:
+            if nfila <= self.pendientesHasta and nfila in self.estados:
+                return
+            lote = list(itertools.islice(
+                (n for n in xrange(nfila, fin)
+                 if n not in saltar and self.estados.get(n) != VERIFICADA),
+                DIARIO_LOTE))
+            for n in lote:
+                self.escribir(n, PENDIENTE)
+            if lote:
+                self.pendientesHasta = lote[-1]
+            self.grabar()
+
+    def compactar (self):
+        """Reescribe el diario con un solo registro por fila, en un
+        fichero nuevo que sustituye al anterior de forma atómica.
+        """
+        with self.cerrojo:
+            self.cerrar()
+            tmp = u"{}.tmp".format(self.ruta)
+            with open(tmp, 'wb') as f:
+                for nfila in sorted(self.estados):
+                    f.write("{} {}\n".format(nfila, self.estados[nfila]))
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp, self.ruta)
+            grabar_directorio(self.ruta)
+
+    def reiniciar (self):
+        """Elimina todos los registros del diario."""
+        with self.cerrojo:
+            self.cerrar()
+            self.estados = {}
+            self.dudosas = set()
+            self.pendientesHasta = 0
+            if os.path.isfile(self.ruta):
+                os.remove(self.ruta)
+                grabar_directorio(self.ruta)
+
+    def cerrar (self):
+        with self.cerrojo:
+            if self.f is not None:
+                self.grabar()
+                self.f.close()
+                self.f = None
+
+def grabar_directorio (ruta):
+    """Fuerza la grabación en disco del directorio que contiene [ruta],
+    para que los cambios de nombre en él sobrevivan a un fallo.
+    """
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(ruta)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
 
 def cargar_fila (cfg):
-    """Carga el contenido del fichero de texto
-    cfg["nombreCsv"].NOBORRAR.ifila, en el directorio cfg["nombreDir"],
-    y lo devuelve.
-    """
-    rutaf = "{}.NOBORRAR.ifila".format(os.path.join(cfg["nombreDir"], 
-                                                    cfg["nombreCsv"]))
-    if os.path.isfile(rutaf):
-        f = open(rutaf)
-        contenido = f.read()
-        f.close()
-        try:
-            tmp = int(contenido) + 1
-        except:
-            contenido = str(-1)
-            abilog.debug("El contenido de «{}.NOBORRAR.ifila» es "
-                         "«{}».".format(cfg["nombreCsv"], contenido))
-        if len(contenido) < 8 and int(contenido) >= 0:
-            abilog.debug(u"El archivo «{}.NOBORRAR.ifila» existe y "
-                         u"su contenido parece coherente "
+    """Carga el diario de la sesión de subida, en el fichero
+    cfg["nombreCsv"].NOBORRAR.diario del directorio cfg["nombreDir"], y
+    lo devuelve (véase Diario).
+    
+    Se le incorporan los diarios de los procesos trabajadores de una
+    subida en varios procesos que se interrumpiera (véase
+    fusionar_diarios).
+    Si no existe el diario, pero sí el fichero
+    cfg["nombreCsv"].NOBORRAR.ifila de versiones anteriores del
+    programa, con el número de orden de la última fila tratada, se
+    registran como verificadas todas las filas hasta ella.
+    """
+    base = os.path.join(cfg["nombreDir"], cfg["nombreCsv"])
+    diario = Diario(u"{}.NOBORRAR.diario".format(base)).cargar()
+    fusionar_diarios(diario)
+    rutaf = u"{}.NOBORRAR.ifila".format(base)
+    if not diario.estados and os.path.isfile(rutaf):
+        with open(rutaf) as f:
+            contenido = f.read().strip()
+        if contenido.isdigit() and len(contenido) < 8:
+            abilog.debug(u"Se traslada al diario el contenido de "
+                         u"«{}.NOBORRAR.ifila» "
                          u"(«{}»).".format(cfg["nombreCsv"], contenido))
+            for nfila in range(1, int(contenido) + 1):
+                diario.escribir(nfila, VERIFICADA)
+            diario.cerrar()
         else:
             abilog.aviso(u"El archivo «{}.NOBORRAR.ifila» existe, "
                          u"pero su contenido es incoherente y se "
                          u"ignora.".format(cfg["nombreCsv"]))
-            contenido = 0
-    else:
-        abilog.debug(u"El archivo «{}.NOBORRAR.ifila» no existe. "
-                     u"Se genera desde cero.".format(cfg["nombreCsv"]))
-        contenido = 0
-    return contenido
+        os.remove(rutaf)
+    elif not diario.estados:
+        abilog.debug(u"El diario de «{}» está vacío. "
+                     u"Se empieza desde cero.".format(cfg["nombreCsv"]))
+    return diario
+
+def nombre_commons (nombre):
+    """Devuelve el nombre de fichero [nombre] en la forma normalizada con
+    que lo trata Wikimedia Commons, esto es, con los guiones bajos
+    convertidos en espacios, sin espacios repetidos ni en los extremos y
+    con la primera letra en mayúscula.
+    
+    Dos nombres con la misma forma normalizada designan el mismo archivo
+    en Wikimedia Commons.
+    """
+    nombre = u" ".join(nombre.replace(u"_", u" ").split())
+    return nombre[:1].upper() + nombre[1:]
+
+def filas_repetidas (datos, ncampo, normalizar=None):
+    """Devuelve los valores del campo con número de orden [ncampo] que
+    aparecen en más de una fila del conjunto de datos [datos], con los
+    números de orden de todas las filas en que aparecen.
+    
+    Si se indica la función [normalizar], los valores se comparan según
+    el resultado de aplicarla sobre ellos.
+    El resultado es una lista de pares (valor, [fila_1,...,fila_i]),
+    ordenada según la primera aparición de cada valor, y se obtiene en
+    un único recorrido de los datos.
+    """
+    vistos = {}
+    repetidos = {}
+    for nfila in range(1, len(datos)):
+        valor = datos[nfila][ncampo]
+        if normalizar is not None:
+            valor = normalizar(valor)
+        primera = vistos.setdefault(valor, nfila)
+        if primera != nfila:
+            repetidos.setdefault(valor, [primera]).append(nfila)
+    return sorted(repetidos.items(), key=lambda par: par[1][0])
+
+def enumerar (elementos):
+    """Devuelve la enumeración en texto de [elementos]: «a, b y c»."""
+    elementos = [u"{}".format(e) for e in elementos]
+    if len(elementos) < 2:
+        return u"".join(elementos)
+    return u"{} y {}".format(u", ".join(elementos[:-1]), elementos[-1])
 
 def archivo_de_fila (cfg, datos, nfila):
     """Devuelve el nombre original del fichero contemplado en la fila
@@ -363,7 +1682,7 @@ def archivo_de_fila (cfg, datos, nfila):
     El número de orden 0 se reserva para los nombres de los campos.
     """
     campo = cfg["campoNombres0"]
-    ncampo = nombre_num_campo(datos[0], campo)
+    ncampo = num_campo(datos, campo)
     return datos[nfila][ncampo]
 
 def archivo_destino_de_fila (cfg, datos, nfila):
@@ -374,9 +1693,85 @@ def archivo_destino_de_fila (cfg, datos, nfila):
     El número de orden 0 se reserva para los nombres de los campos.
     """
     campo = cfg["campoNombresC"]
-    ncampo = nombre_num_campo(datos[0], campo)
+    ncampo = num_campo(datos, campo)
     return datos[nfila][ncampo]
 
+#  La constante [HILOS_STAT] es el número de hilos con que se
+#  comprueba en paralelo la existencia de los ficheros que no pueden
+#  consultarse en el inventario del directorio.
+#
+HILOS_STAT = 16
+
+def inventario (directorio, recursivo=False):
+    """Devuelve un diccionario con los ficheros del directorio
+    [directorio], y de sus subdirectorios si [recursivo] es True, o None
+    si no se dispone de os.scandir (o del módulo scandir), sin el cual
+    habría que consultar los datos de cada entrada por separado.
+    
+    Las claves son las rutas de los ficheros relativas a [directorio],
+    y los valores, pares (tamaño, fecha de modificación).
+    Cada directorio se lista una sola vez, aunque se llegue a él por
+    varios enlaces simbólicos, de modo que los enlaces a directorios
+    antecesores no hacen que el recorrido no termine.
+    """
+    if scandir is None:
+        return None
+    if isinstance(directorio, str):
+        directorio = directorio.decode(sys.getfilesystemencoding() or
+                                       'utf-8')
+    inv = {}
+    visitados = set()
+    pendientes = [u""]
+    while pendientes:
+        rel = pendientes.pop()
+        ruta = os.path.join(directorio, rel)
+        try:
+            st = os.stat(ruta)
+            if (st.st_dev, st.st_ino) in visitados:
+                continue
+            visitados.add((st.st_dev, st.st_ino))
+            for entrada in scandir(ruta):
+                if entrada.is_dir():
+                    if recursivo:
+                        pendientes.append(os.path.join(rel, entrada.name))
+                elif entrada.is_file():
+                    st = entrada.stat()
+                    inv[os.path.join(rel, entrada.name)] = (st.st_size,
+                                                            st.st_mtime)
+        except OSError:
+            abilog.debug(u"No se ha podido listar el directorio "
+                         u"«{}».".format(ruta))
+    return inv
+
+def ficheros_ausentes (cfg, nombres):
+    """Devuelve el conjunto de los nombres de ficheros locales de
+    [nombres] que no existen en el directorio cfg["nombreDir"].
+    
+    El directorio se inventaría una sola vez, recursivamente si algún
+    nombre incluye subdirectorios, y la existencia de cada fichero se
+    consulta en el inventario. Los ficheros que no constan en él (fuera
+    del directorio, o en un directorio inventariado por otro camino de
+    enlaces simbólicos), y todos si no puede inventariarse (véase
+    inventario), se comprueban aparte, en paralelo.
+    """
+    recursivo = any(os.sep in nombre or u"/" in nombre
+                    for nombre in nombres)
+    inv = inventario(cfg["nombreDir"], recursivo)
+    ausentes = set()
+    externos = [nombre for nombre in nombres
+                if inv is None or os.path.normpath(nombre) not in inv]
+    if externos:
+        pool = ThreadPool(HILOS_STAT)
+        try:
+            existen = pool.map(lambda nombre: os.path.isfile(
+                                   os.path.join(cfg["nombreDir"], nombre)),
+                               externos)
+        finally:
+            pool.close()
+        ausentes.update(nombre for nombre, existe in zip(externos, existen)
+                        if not existe)
+    return ausentes
+
 #### Comprobaciones ####################################################
 
 def comprobar_ficheros (cfg, datos):
@@ -391,23 +1786,19 @@ def comprobar_ficheros (cfg, datos):
     devuelve None.
     """
     # Número de orden del campo de nombres de origen de los ficheros
-    nCampoNombres0 = nombre_num_campo(datos[0], cfg["campoNombres0"])
+    nCampoNombres0 = num_campo(datos, cfg["campoNombres0"])
     # Número de orden del campo de nombres de destino de los ficheros
-    nCampoNombresC = nombre_num_campo(datos[0], cfg["campoNombresC"])
-    nfila = 1
-    for fila in datos[1:]:
+    nCampoNombresC = num_campo(datos, cfg["campoNombresC"])
+    nombres0 = []
+    for nfila in range(1, len(datos)):
+        fila = datos[nfila]
         # Análsis de los nombres de origen de los ficheros
         if not fila[nCampoNombres0]:
             return (u"Hay ficheros sin un nombre especificado en el "
                     u"campo «{}» de «{}».".format(cfg["campoNombres0"],
                                                   cfg["nombreCsv"]))
-        else:
-            rutaf0 = os.path.join(cfg["nombreDir"],
-                                  fila[nCampoNombres0])
-            if not SIMULACION and not os.path.isfile(rutaf0):
-                return (u"No se encuentra el fichero «{}». "
-                        u"Es posible que no exista o que no sea "
-                        u"legible.".format(rutaf0))
+        else:
+            nombres0.append(fila[nCampoNombres0])
         # Análsis de los nombres de destino los ficheros
         if not fila[nCampoNombresC]:
             return (u"Hay ficheros sin un nombre especificado en el "
@@ -420,35 +1811,85 @@ def comprobar_ficheros (cfg, datos):
                     u"extensión.".format(fila[nCampoNombresC],
                                          nfila,
                                          cfg["nombreCsv"]))
-        # Análisis de nombres de origen o de destino duplicados
-        for nfilacmp in range(nfila+1, len(datos[1:])):
-            if fila[nCampoNombres0] == datos[nfilacmp][nCampoNombres0]:
-                return (u"El nombre de fichero «{}» está contemplado "
-                        u"más de una vez en "
-                        u"«{}».".format(fila[nCampoNombres0],
-                                        cfg["nombreCsv"]))
-            elif fila[nCampoNombresC] == datos[nfilacmp][nCampoNombresC]:
-                return (u"El nombre de fichero «{}» está contemplado "
-                        u"más de una vez en "
-                        u"«{}».".format(fila[nCampoNombresC],
-                                        cfg["nombreCsv"]))
-        nfila += 1
+    # Existencia de los ficheros locales
+    if not SIMULACION:
+        ausentes = ficheros_ausentes(cfg, nombres0)
+        for nombre in nombres0:
+            if nombre in ausentes:
+                return (u"No se encuentra el fichero «{}». "
+                        u"Es posible que no exista o que no sea "
+                        u"legible.".format(os.path.join(cfg["nombreDir"],
+                                                        nombre)))
+    # Análisis de nombres de origen o de destino duplicados; los de
+    # destino se comparan tal como los trata Wikimedia Commons.
+    repeticiones = []
+    for campo, ncampo, normalizar in \
+            ((cfg["campoNombres0"], nCampoNombres0, None),
+             (cfg["campoNombresC"], nCampoNombresC, nombre_commons)):
+        for nombre, filas in filas_repetidas(datos, ncampo, normalizar):
+            repeticiones.append(u"    «{}» (campo «{}»): filas "
+                                u"{}.".format(nombre, campo,
+                                              enumerar(filas)))
+    if repeticiones:
+        return (u"Hay nombres de ficheros contemplados más de una vez "
+                u"en «{}»:\n{}".format(cfg["nombreCsv"],
+                                       u"\n".join(repeticiones)))
     return None
 
+class Validador (object):
+    """Validador de la información de las filas de un conjunto de datos
+    con los campos de nombres [campos], según las reglas definidas en
+    csvcfg.regex.
+    
+    Las expresiones regulares se compilan una sola vez, al construir el
+    validador, y se asocian al número de orden de su campo. Los campos
+    sin regla no se examinan.
+    """
+
+    def __init__ (self, campos):
+        self.reglas = []
+        for ncampo, campo in enumerate(campos):
+            patron = csvcfg.regex(campo)
+            if patron:
+                self.reglas.append((ncampo, campo, re.compile(patron)))
+
+    def validar (self, datos, inicio=1, fin=None):
+        """Comprueba si la información de las filas del conjunto de
+        datos [datos] con números de orden desde [inicio] hasta [fin]
+        (sin incluir) es correcta, recorriéndolas campo a campo.
+        
+        Si no es correcta, devuelve el motivo, referido a la primera
+        fila incorrecta. Si lo es, devuelve None.
+        """
+        if fin is None:
+            fin = len(datos)
+        filas = [datos[nfila] for nfila in range(inicio, fin)]
+        error = None
+        for ncampo, campo, regex in self.reglas:
+            buscar = regex.search
+            # Solo interesan las filas anteriores al primer error ya
+            # encontrado en otro campo.
+            tope = len(filas) if error is None else error[0] - inicio
+            for i in xrange(tope):
+                valor = filas[i][ncampo]
+                if valor and buscar(valor) is None:
+                    error = (inicio + i, campo, valor)
+                    break
+        if error is not None:
+            nfila, campo, valor = error
+            return (u"El valor «{}», en la {}.ª fila, "
+                    u"no es válido para el campo "
+                    u"«{}».".format(valor, nfila+1, campo))
+        return None
+
 def comprobar_fila (datos, fila):
     """Comprueba si la información de la fila con número de orden [fila]
     del conjunto de datos [datos] es correcta.
     
     Si no es correcta, devuelve el motivo. Si lo es, devuelve None.
+    Para comprobar muchas filas, es preferible usar un mismo Validador.
     """
-    for campo in datos[0]:
-        valor = valores(datos,fila,[campo])[0]
-        if valor:
-            if re.search(csvcfg.regex(campo), valor) == None:
-                return (u"El valor «{}», en la {}.ª fila, "
-                        u"no es válido para el campo "
-                        u"«{}».".format(valor, fila+1, campo))
-    return None
+    return Validador(datos[0]).validar(datos, fila, fila+1)
 
 def comprobar_campos (cfg, datos):
     """Comprueba que los nombres de los campos del conjunto de datos
@@ -501,7 +1942,8 @@ def comprobar_todo (cfg, datos):
         * existe el campo donde se indica el nombre de los ficheros;
         * hay, al menos, una fila con información;
         * la información de las filas es válida según las reglas
-              definidas para la subida en particular.
+              definidas para la subida en particular;
+        * ninguna descripción supera el tamaño máximo admitido.
     """
     abilog.info(u"Comprobando la corrección de los datos de "
                 u"«{}».".format(cfg["nombreCsv"]))
@@ -527,8 +1969,15 @@ def comprobar_todo (cfg, datos):
                     division = 25
                 else:
                     division = 10
-                for fila in range(1,lendatos):
-                    comprobacion = comprobar_fila(datos,fila)
+                validador = Validador(datos[0])
+                for inicio in range(1, lendatos, division):
+                    fila = min(inicio + division, lendatos) - 1
+                    comprobacion = validador.validar(datos, inicio,
+                                                     fila + 1)
+                    if not comprobacion:
+                        comprobacion = comprobar_descripciones(cfg, datos,
+                                                               inicio,
+                                                               fila + 1)
                     if comprobacion:
                         break
                     if fila % division == 0:
@@ -543,32 +1992,66 @@ def comprobar_todo (cfg, datos):
                         abilog.info(u"Comprobación completada.")
     return comprobacion
 
-def comprobar_subida (cfg, f):
+def comprobar_descripciones (cfg, datos, inicio, fin):
+    """Comprueba que las descripciones de las filas del conjunto de
+    datos [datos] desde la de número de orden [inicio] hasta la anterior
+    a [fin] no superen cfg["tamDescrMax"] bytes.
+    
+    Si csvcfg define una plantilla de descripción, las descripciones se
+    obtienen de una vez con ella; si no, fila a fila con
+    csvcfg.descripcion.
+    
+    Si alguna lo supera, devuelve un motivo. Si no, devuelve None.
+    """
+    if hasattr(csvcfg, "plantilla"):
+        try:
+            plantilla = plantilla_compilada(datos, csvcfg.plantilla)
+        except ValueError as e:
+            return u"La plantilla de descripción no es válida: {}".format(e)
+        tamanos = plantilla.tamanos(datos, inicio, fin)
+    else:
+        tamanos = ((nfila,
+                    len(csvcfg.descripcion(datos, nfila).encode('utf-8')))
+                   for nfila in xrange(inicio, fin))
+    excesivas = [(nfila, tamano) for nfila, tamano in tamanos
+                 if tamano > cfg["tamDescrMax"]]
+    if not excesivas:
+        return None
+    return (u"Las descripciones de las siguientes filas superan el "
+            u"tamaño máximo de {} bytes:\n{}".format(
+                cfg["tamDescrMax"],
+                u"\n".join(u"  * {}.ª fila: {} bytes".format(nfila, tamano)
+                           for nfila, tamano in excesivas)))
+
+def comprobar_subida (cfg, f, aisha1=None):
     """Comprueba si el fichero [f] existe íntegramente en Commons.
     
     Devuelve None en caso afirmativo, o un mensaje de error en caso
     contrario.
-    Se basa en SHA-1 y en la API de Wikimedia Commons.
+    Se basa en SHA-1 y en la API de Wikimedia Commons. Si ya se conoce
+    el SHA-1 del fichero, puede indicarse en [aisha1] para no volver a
+    leerlo.
     """
-    aisha1 = sha1_f(cfg, f)
+    if aisha1 is None:
+        aisha1 = sha1_f(cfg, f)
     abilog.debug(u"SHA-1 de {}: {}".format(f, aisha1))
     if not SIMULACION:
-        url = u"https://commons.wikimedia.org/w/api.php?action=query&" \
-              u"list=allimages&format=json&aiprop=sha1&" \
-              u"aisha1={}".format(aisha1)
+        params = {"action": "query", "list": "allimages",
+                  "aiprop": "sha1", "aisha1": aisha1}
         try:
-            f = urllib.urlopen(url)
+            with abimetricas.medir("comprobacion"):
+                d = consultar_api(cfg, params)
         except:
-            abilog.debug(u"Error al acceder a {}.".format(url))
+            abilog.debug(u"Error al consultar el SHA-1 {} en "
+                         u"{}.".format(aisha1, cfg["urlApi"]))
             return u"No se ha logrado acceder a la API de Wikimedia " \
                    u"Commons. Revise la conexión e inténtelo de nuevo."
-        txt = f.read()
-        d = json.loads(txt)
         abilog.debug(u"Contenido de la consulta: {}".format(d))
         try:
             sha1 = d['query']['allimages'][0]['sha1']
         except:
-            abilog.debug(u"Error al obtener el SHA-1 con {}.".format(url))
+            abilog.debug(u"Error al obtener el SHA-1 {} en "
+                         u"{}.".format(aisha1, cfg["urlApi"]))
             return u"Es probable que el archivo no haya podido subirse " \
                    u"a Wikimedia Commons. Inténtelo de nuevo o repare " \
                    u"el error."
@@ -578,6 +2061,126 @@ def comprobar_subida (cfg, f):
                    u"por medio de <{}>.".format(correoAyuda)
     return None
 
+#  La constante [TITULOS_POR_CONSULTA] es el número máximo de títulos
+#  de archivos por los que preguntar a la API en una misma consulta.
+#
+TITULOS_POR_CONSULTA = 50
+
+#  Las constantes [HILOS_SHA1] y [HILOS_API] son el número de hilos con
+#  que se calculan en paralelo los SHA-1 de los ficheros y se hacen
+#  consultas independientes a la API, respectivamente, en la
+#  comprobación previa.
+#
+HILOS_SHA1 = 4
+HILOS_API = 8
+
+def sha1_en_titulos (cfg, titulos):
+    """Devuelve un diccionario con el SHA-1 de cada uno de los archivos
+    de [titulos] (de la forma «File:Nombre») que existen en Wikimedia
+    Commons, hechas tantas consultas a la API como sea necesario.
+    
+    Los títulos se devuelven tal como se han pedido, aunque la API los
+    normalice.
+    """
+    sha1s = {}
+    for i in range(0, len(titulos), TITULOS_POR_CONSULTA):
+        lote = titulos[i:i+TITULOS_POR_CONSULTA]
+        d = consultar_api(cfg, {"action": "query", "prop": "imageinfo",
+                                "iiprop": "sha1",
+                                "titles": u"|".join(lote)}, post=True)
+        normalizados = dict((n["from"], n["to"])
+                            for n in d["query"].get("normalized", []))
+        encontrados = {}
+        for pagina in d["query"].get("pages", {}).values():
+            if pagina.get("imageinfo"):
+                encontrados[pagina["title"]] = \
+                    pagina["imageinfo"][0]["sha1"]
+        for titulo in lote:
+            sha1 = encontrados.get(normalizados.get(titulo, titulo))
+            if sha1:
+                sha1s[titulo] = sha1
+    return sha1s
+
+def sha1_existe (cfg, sha1):
+    """Devuelve True si hay algún archivo con el SHA-1 [sha1] en
+    Wikimedia Commons, o False en caso contrario.
+    """
+    d = consultar_api(cfg, {"action": "query", "list": "allimages",
+                            "aiprop": "sha1", "aisha1": sha1})
+    return bool(d["query"]["allimages"])
+
+def comprobacion_previa (cfg, datos, inicio, completas=frozenset()):
+    """Busca qué ficheros de las filas del conjunto de datos [datos],
+    desde la de número de orden [inicio], salvo las de [completas], ya
+    verificadas, se encuentran ya íntegramente en Wikimedia Commons,
+    según su SHA-1, para no volver a subirlos.
+    
+    Se calculan en paralelo los SHA-1 de todos los ficheros, salvo los
+    que ya se calcularon en una ejecución anterior y no han cambiado
+    (véase CacheSha1), y se comparan, por lotes de
+    TITULOS_POR_CONSULTA, con los de los archivos que ya llevan en
+    Commons sus nombres de destino. Si cfg["buscarSha1"] es True, el
+    SHA-1 de los ficheros restantes se busca además en cualquier archivo
+    de Commons, con una consulta para cada uno.
+    
+    Devuelve un par (omitir, sha1s), donde omitir es el conjunto de
+    números de orden de las filas que no es necesario subir, y sha1s,
+    un diccionario con el SHA-1 del fichero de cada fila. Si la API no
+    responde, se avisa y se devuelve lo averiguado hasta entonces.
+    """
+    filas = []
+    for nfila in range(inicio, len(datos)):
+        if nfila not in completas:
+            filas.append((nfila, archivo_de_fila(cfg, datos, nfila),
+                          archivo_destino_de_fila(cfg, datos, nfila)))
+    omitir = set()
+    sha1s = {}
+    if not filas:
+        return omitir, sha1s
+    abilog.info(u"Calculando el SHA-1 de {} ficheros.".format(len(filas)))
+    cache = CacheSha1(ruta_cache_sha1(cfg))
+    pool = ThreadPool(HILOS_SHA1)
+    try:
+        for n, (nfila, sha1) in enumerate(pool.imap(
+                lambda fila: (fila[0], cache.sha1(cfg, fila[1])),
+                filas, 16)):
+            sha1s[nfila] = sha1
+            if (n + 1) % 1000 == 0:
+                abilog.info(u"{} ficheros analizados.".format(n + 1))
+                cache.grabar()
+    finally:
+        pool.close()
+        cache.grabar()
+    abilog.info(u"Buscando en Wikimedia Commons los ficheros ya "
+                u"subidos.")
+    try:
+        titulos = [u"File:{}".format(nombre_commons(fdestino))
+                   for nfila, f, fdestino in filas]
+        enCommons = sha1_en_titulos(cfg, titulos)
+        restantes = []
+        for (nfila, f, fdestino), titulo in zip(filas, titulos):
+            if sha1s[nfila] and enCommons.get(titulo) == sha1s[nfila]:
+                omitir.add(nfila)
+            elif sha1s[nfila]:
+                restantes.append(nfila)
+        if cfg["buscarSha1"] and restantes:
+            pool = ThreadPool(HILOS_API)
+            try:
+                existen = pool.map(lambda nfila: sha1_existe(cfg,
+                                                             sha1s[nfila]),
+                                   restantes)
+            finally:
+                pool.close()
+            omitir.update(nfila for nfila, existe in zip(restantes, existen)
+                          if existe)
+    except Exception as e:
+        abilog.aviso(u"No se ha podido completar la búsqueda de ficheros "
+                     u"ya subidos: {}".format(e))
+    for nfila in sorted(omitir):
+        abilog.debug(u"La {}.ª fila ya está en Wikimedia Commons y se "
+                     u"omite.".format(nfila))
+    return omitir, sha1s
+
 #### Interacción #######################################################
 
 def descansar (tDescansoSeg):
@@ -604,6 +2207,45 @@ def descansar (tDescansoSeg):
     else:
         print
 
+def pausa (segundos):
+    """Espera [segundos] segundos para dar tiempo al operador a leer,
+    salvo en el modo desatendido.
+    """
+    if not DESATENDIDO:
+        time.sleep(segundos)
+
+class Progreso (object):
+    """Línea de progreso del modo desatendido, que se muestra a lo sumo
+    cada [intervalo] segundos, para [total] ficheros por tratar.
+    """
+
+    def __init__ (self, total, intervalo):
+        self.total = total
+        self.intervalo = intervalo
+        self.tratados = 0
+        self.t0 = time.time()
+        self.tMostrado = self.t0
+
+    def avanzar (self, n=1):
+        self.tratados += n
+        if time.time() - self.tMostrado >= self.intervalo:
+            self.mostrar()
+
+    def mostrar (self):
+        t = time.time() - self.t0
+        ritmo = self.tratados / t if t else 0
+        linea = u"Progreso: {}/{} ({:.1f} %), {:.2f} ficheros/s".format(
+            self.tratados, self.total,
+            self.tratados * 100.0 / self.total if self.total else 100.0,
+            ritmo)
+        if ritmo and self.tratados < self.total:
+            linea += u", quedan unos {}".format(time.strftime(
+                "%H:%M:%S", time.gmtime((self.total - self.tratados) /
+                                        ritmo)))
+        print linea
+        sys.stdout.flush()
+        self.tMostrado = time.time()
+
 def sn (pregunta):
     """Plantea la pregunta [pregunta] al operador y le pide que responda
     afirmativa ("s") o negativamente ("n"), devolviendo True o False,
@@ -613,40 +2255,833 @@ def sn (pregunta):
     """
     while True:
         print u"\n{}".format(pregunta)
-        r = raw_input("s/n: ").upper()
+        with abimetricas.medir("operador"):
+            r = raw_input("s/n: ").upper()
         if r == "S":
             return True
         elif r == "N":
             return False
 
 def reintentar (cfg,datos,f,fdestino,descr):
-    abilog.debug(u"Se pregunta si reintentar la subida.")
-    r = sn(u"¿Desea reintentar la subida?")
-    if r:
+    """Ofrece reintentar la subida del fichero [f] hasta que se logre o
+    el operador desista, y devuelve True o False, respectivamente.
+    
+    En el modo desatendido, se reintenta sin preguntar hasta
+    cfg["reintentos"] veces.
+    """
+    intentos = 0
+    while True:
+        if DESATENDIDO:
+            intentos += 1
+            if intentos > cfg["reintentos"]:
+                break
+        else:
+            abilog.debug(u"Se pregunta si reintentar la subida.")
+            if not sn(u"¿Desea reintentar la subida?"):
+                break
         abilog.debug(u"Se escoge reintentar la subida.")
-        subir(cfg,f,fdestino,descr)
-        comprobacion = comprobar_subida(cfg,f)
-        if comprobacion:
-            abilog.error(comprobacion)
-            reintentar(cfg,datos,f,fdestino,descr)
-    else:
-        abilog.debug(u"Se escoge no reintentar la subida.")
-        flog = open(u"{}.fallidas.log".format(os.path.join(cfg["nombreDir"], 
-                                                           cfg["nombreCsv"])),
-                    'a')
-        flog.write("{}\n".format(f))
-        flog.close()
+        abimetricas.contar("reintentos")
+        comprobacion = subir_y_comprobar(cfg,f,fdestino,descr)
+        if not comprobacion:
+            return True
+        abilog.error(comprobacion)
+    abilog.debug(u"Se escoge no reintentar la subida.")
+    flog = open(u"{}.fallidas.log".format(os.path.join(cfg["nombreDir"], 
+                                                       cfg["nombreCsv"])),
+                'a')
+    flog.write("{}\n".format(f))
+    flog.close()
+    return False
+
+#### Varios procesos ##################################################
+
+def sufijo_fragmento ():
+    """Devuelve el sufijo de los ficheros propios de cada proceso
+    trabajador de una subida en varios procesos o de cada nodo (véase
+    NODO), o "" en otro caso.
+    """
+    if NODO is not None:
+        return u".{}".format(NODO)
+    if FRAGMENTO is None:
+        return u""
+    return u".{}".format(FRAGMENTO[0])
+
+class FilasAjenas (object):
+    """Conjunto de los números de orden de las filas que no son del
+    fragmento [k] de [n], unido al conjunto [otras]. Las filas del
+    fragmento k son las de número de orden congruente con k módulo n,
+    de modo que los ficheros grandes o pequeños, a menudo contiguos, se
+    reparten por igual.
+    """
+
+    def __init__ (self, k, n, otras=frozenset()):
+        self.k = k
+        self.n = n
+        self.otras = otras
+
+    def __contains__ (self, nfila):
+        return nfila % self.n != self.k or nfila in self.otras
+
+class ProgresoCompartido (object):
+    """Progreso de un proceso trabajador, que solo suma los ficheros
+    tratados al [contador] compartido (multiprocessing.Value) con el
+    coordinador, que es quien muestra el progreso de todos.
+    """
+
+    def __init__ (self, contador):
+        self.contador = contador
+
+    def avanzar (self, n=1):
+        with self.contador.get_lock():
+            self.contador.value += n
+
+    def mostrar (self):
+        pass
+
+class SalidaNula (object):
+    """Salida estándar que descarta todo lo que se escribe en ella."""
+
+    encoding = 'utf-8'
+
+    def write (self, texto):
+        pass
+
+    def flush (self):
+        pass
+
+def fusionar_diarios (diario):
+    """Incorpora al [diario] de la sesión los registros de los diarios
+    de los procesos trabajadores de una subida en varios procesos (el
+    mismo fichero con el número del fragmento como sufijo), que se
+    eliminan después.
+    """
+    for ruta in glob.glob(u"{}.*".format(diario.ruta)):
+        if not ruta[len(diario.ruta) + 1:].isdigit():
+            continue
+        fragmento = Diario(ruta).cargar()
+        with diario.cerrojo:
+            for nfila, estado in sorted(fragmento.estados.items()):
+                if diario.estados.get(nfila) != estado:
+                    diario.escribir(nfila, estado)
+            diario.cerrar()
+            diario.dudosas = set(nfila for nfila, estado
+                                 in diario.estados.items()
+                                 if estado != VERIFICADA)
+        os.remove(ruta)
+        grabar_directorio(ruta)
+
+def trabajar_fragmento (cfg, datos, diario, contador, sha1s):
+    """Proceso trabajador de coordinar: sube con bucle los ficheros de
+    las filas de su FRAGMENTO, con su propio diario, que parte de los
+    estados del [diario] de la sesión, y con sus propios ficheros de
+    registros, métricas y trozos. Avanza el [contador] de progreso
+    compartido.
+    """
+    sys.stdout = SalidaNula()
+    abilog.config(u"{}.log{}".format(os.path.join(cfg["nombreDir"],
+                                                  cfg["nombreCsv"]),
+                                     sufijo_fragmento()),
+                  cfg["registroAsincrono"], cfg["registroJson"],
+                  FRAGMENTO[0])
+    abimetricas.METRICAS = abimetricas.Metricas()
+    try:
+        propio = Diario(u"{}{}".format(diario.ruta,
+                                       sufijo_fragmento())).cargar()
+        for nfila, estado in diario.estados.items():
+            if nfila % FRAGMENTO[1] == FRAGMENTO[0]:
+                propio.estados.setdefault(nfila, estado)
+                if propio.estados[nfila] != VERIFICADA:
+                    propio.dudosas.add(nfila)
+        abilog.debug(u"Se inicia el proceso {} de {}.".format(
+            FRAGMENTO[0], FRAGMENTO[1]))
+        bucle(cfg, datos, propio, sha1s=sha1s,
+              progreso=ProgresoCompartido(contador))
+    except:
+        abilog.error(u"El proceso {} termina por un error "
+                     u"inesperado.".format(FRAGMENTO[0]))
+        abilog.debug(traceback.format_exc().decode('utf-8', 'replace'))
+        raise
+    finally:
+        abilog.cerrar()
+
+def coordinar (cfg, datos, diario, procesos, omitir=frozenset(),
+               sha1s=None):
+    """Sube los ficheros como bucle, pero en [procesos] procesos
+    trabajadores (véase trabajar_fragmento), cada uno con un fragmento
+    de las filas, que reparten entre varios núcleos y conexiones el
+    cálculo de los SHA-1, la composición de las descripciones y las
+    subidas. Todos comparten un mismo limitador de la tasa de subidas.
+    
+    Mientras trabajan, se muestra el progreso de todos ellos. Al
+    terminar, sus diarios se incorporan al [diario] de la sesión; sus
+    ficheros de registros, al de la sesión, y sus recuentos, a las
+    métricas del coordinador. Devuelve True si todos los procesos han
+    terminado normalmente, o False en caso contrario.
+    """
+    global limitador, FRAGMENTO
+    limitador = crear_limitador(cfg, procesos)
+    for nfila in omitir:
+        diario.registrar(nfila, VERIFICADA)
+    completas = diario.completas()
+    progreso = Progreso(sum(1 for nfila in xrange(1, len(datos))
+                            if nfila not in completas),
+                        cfg["tProgreso"])
+    contador = multiprocessing.Value('l', 0)
+    metricas = [u"{}.{}.json".format(ruta_metricas(cfg), k)
+                for k in range(procesos)]
+    for ruta in metricas:
+        if os.path.isfile(ruta):
+            os.remove(ruta)
+    abilog.info(u"Se reparten las filas entre {} "
+                u"procesos.".format(procesos))
+    #
+    #  Nada abierto ni a medio escribir debe heredarse en los procesos
+    #  trabajadores.
+    #
+    diario.cerrar()
+    datos.filas.cerrar()
+    abihttp.sesion().cerrar()
+    abilog.cerrar()
+    trabajadores = []
+    for k in range(procesos):
+        FRAGMENTO = (k, procesos)
+        trabajador = multiprocessing.Process(
+            target=trabajar_fragmento,
+            args=(cfg, datos, diario, contador, sha1s))
+        trabajador.start()
+        trabajadores.append(trabajador)
+    FRAGMENTO = None
+    rutaRegistros = u"{}.log".format(os.path.join(cfg["nombreDir"],
+                                                  cfg["nombreCsv"]))
+    abilog.config(rutaRegistros, cfg["registroAsincrono"],
+                  cfg["registroJson"])
+    try:
+        for trabajador in trabajadores:
+            while trabajador.is_alive():
+                trabajador.join(cfg["tProgreso"] or None)
+                progreso.tratados = contador.value
+                progreso.mostrar()
+    finally:
+        for trabajador in trabajadores:
+            trabajador.join()
+        fusionar_diarios(diario)
+        abilog.cerrar()
+        abilog.fusionar(rutaRegistros,
+                        [u"{}.{}".format(rutaRegistros, k)
+                         for k in range(procesos)
+                         if os.path.isfile(u"{}.{}".format(rutaRegistros,
+                                                           k))])
+        abilog.config(rutaRegistros, cfg["registroAsincrono"],
+                      cfg["registroJson"])
+    for ruta in metricas:
+        if os.path.isfile(ruta):
+            with open(ruta) as f:
+                for contador, n in json.load(f)["contadores"].items():
+                    abimetricas.contar(contador, n)
+    resumir_metricas(cfg)
+    fallidos = [k for k, trabajador in enumerate(trabajadores)
+                if trabajador.exitcode != 0]
+    for k in fallidos:
+        abilog.error(u"El proceso {} ha terminado con el código "
+                     u"{}.".format(k, trabajadores[k].exitcode))
+    return not fallidos
+
+#### Varios nodos ######################################################
+
+#  Estado de las filas de la tabla de arriendos que nadie ha tomado aún.
+#  Las demás tienen los estados del diario de la sesión de subida.
+#
+LIBRE = "libre"
+
+class TablaArriendos (object):
+    """Tabla de arriendos en la base de datos SQLite [ruta], con la que
+    varios nodos, en una o varias máquinas que comparten el sistema de
+    ficheros, se reparten las filas de una misma subida. Cada nodo se
+    identifica con [nodo] (véase NODO).
+    
+    Un nodo toma (arrienda) las filas de lote en lote, y cada arriendo
+    vence a los [tArriendo] segundos si no se renueva. Mientras el nodo
+    tiene filas, un hilo renueva sus arriendos cada tArriendo/3
+    segundos; si
+    muere, sus filas sin terminar vuelven a arrendarse a otro al vencer,
+    y para este son dudosas, de modo que antes de subirlas se comprueba
+    si ya están en Wikimedia Commons (véase subir_y_comprobar). Justo
+    antes de subir una fila, el nodo comprueba que aún es suya.
+    
+    Hace de diario de la sesión de subida para bucle. Puede compartirse
+    entre varios hilos, cada uno con su propia conexión. Requiere que el
+    sistema de ficheros compartido respete los bloqueos de SQLite y que
+    los relojes de las máquinas estén sincronizados con un margen muy
+    inferior a tArriendo.
+    """
+
+    def __init__ (self, ruta, nodo, tArriendo):
+        self.ruta = ruta
+        self.nodo = nodo
+        self.tArriendo = tArriendo
+        self.local = threading.local()
+        self.dudosas = set()
+        self.arrendadas = set()
+        self.iniciadas = set()
+        self.cerrojo = threading.Lock()
+        self.parar = None
+        self.latido = None
+
+    def conexion (self):
+        c = getattr(self.local, "c", None)
+        if c is None:
+            c = sqlite3.connect(self.ruta, timeout=60, isolation_level=None)
+            self.local.c = c
+        return c
+
+    @contextlib.contextmanager
+    def transaccion (self):
+        """Ejecuta el bloque with en una transacción que bloquea la
+        escritura de los demás nodos desde el principio.
+        """
+        c = self.conexion()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            yield c
+        except:
+            c.execute("ROLLBACK")
+            raise
+        c.execute("COMMIT")
+
+    def iniciar (self, n, completas=frozenset()):
+        """Crea la tabla con las filas de número de orden 1 a [n] - 1,
+        libres salvo las de [completas], que constan como verificadas,
+        si aún no existe.
         
+        Si la tabla ya existe y todas sus filas están terminadas, las
+        fallidas vuelven a quedar libres, para reintentarlas. Devuelve
+        None si todo va bien, o un mensaje de error en caso contrario.
+        """
+        with self.transaccion() as c:
+            c.execute("CREATE TABLE IF NOT EXISTS filas ("
+                      "nfila INTEGER PRIMARY KEY, estado TEXT NOT NULL, "
+                      "nodo TEXT, vence REAL, "
+                      "intentos INTEGER NOT NULL DEFAULT 0)")
+            c.execute("CREATE INDEX IF NOT EXISTS filas_estado "
+                      "ON filas (estado, nfila)")
+            total = c.execute("SELECT COUNT(*) FROM filas").fetchone()[0]
+            if not total:
+                c.executemany("INSERT INTO filas (nfila, estado) "
+                              "VALUES (?, ?)",
+                              ((nfila, VERIFICADA if nfila in completas
+                                else LIBRE) for nfila in xrange(1, n)))
+            elif total != n - 1:
+                return (u"La tabla de arriendos «{}» tiene {} filas, pero "
+                        u"el fichero de CSV tiene {}; no parece de esta "
+                        u"subida.".format(self.ruta, total, n - 1))
+            elif not c.execute("SELECT COUNT(*) FROM filas WHERE estado "
+                               "IN (?, ?, ?)", (LIBRE, PENDIENTE,
+                                                SUBIDA)).fetchone()[0]:
+                c.execute("UPDATE filas SET estado = ?, nodo = NULL "
+                          "WHERE estado = ?", (LIBRE, FALLIDA))
+        return None
+
+    def arrendar (self, lote):
+        """Toma hasta [lote] filas, libres o de arriendos vencidos, y
+        devuelve la lista de sus números de orden. Si no se estaban
+        renovando los arriendos de este nodo, se empieza a hacerlo.
+        """
+        if self.latido is None:
+            self.parar = threading.Event()
+            self.latido = threading.Thread(target=self.latir,
+                                           args=(self.parar,))
+            self.latido.daemon = True
+            self.latido.start()
+        ahora = time.time()
+        with self.transaccion() as c:
+            tomadas = c.execute(
+                "SELECT nfila, estado, nodo, intentos FROM filas "
+                "WHERE estado = ? OR (estado IN (?, ?) AND vence < ?) "
+                "ORDER BY nfila LIMIT ?",
+                (LIBRE, PENDIENTE, SUBIDA, ahora, lote)).fetchall()
+            c.executemany("UPDATE filas SET estado = ?, nodo = ?, "
+                          "vence = ?, intentos = intentos + 1 "
+                          "WHERE nfila = ?",
+                          ((PENDIENTE, self.nodo, ahora + self.tArriendo,
+                            nfila) for nfila, _, _, _ in tomadas))
+        with self.cerrojo:
+            for nfila, estado, nodo, intentos in tomadas:
+                self.arrendadas.add(nfila)
+                if intentos:
+                    self.dudosas.add(nfila)
+                if estado != LIBRE:
+                    abimetricas.contar("vencidos")
+                    abilog.aviso(u"Se toma la {}.ª fila, cuyo arriendo "
+                                 u"al nodo {} ha vencido.".format(nfila,
+                                                                 nodo))
+        if tomadas:
+            abimetricas.contar("arriendos")
+        return [nfila for nfila, _, _, _ in tomadas]
+
+    def ajenas (self):
+        """Devuelve el número de filas sin terminar que no son de este
+        nodo.
+        """
+        return self.conexion().execute(
+            "SELECT COUNT(*) FROM filas WHERE estado = ? OR "
+            "(estado IN (?, ?) AND nodo != ?)",
+            (LIBRE, PENDIENTE, SUBIDA, self.nodo)).fetchone()[0]
+
+    def restantes (self):
+        """Devuelve el número de filas sin terminar."""
+        return self.conexion().execute(
+            "SELECT COUNT(*) FROM filas WHERE estado IN (?, ?, ?)",
+            (LIBRE, PENDIENTE, SUBIDA)).fetchone()[0]
+
+    def filas (self, lote, tomadas=()):
+        """Genera los números de orden de las filas ya [tomadas] y de
+        las que se arriendan después, de [lote] en [lote], hasta que no
+        queda ninguna por arrendar.
+        """
+        while tomadas:
+            for nfila in tomadas:
+                yield nfila
+            tomadas = self.arrendar(lote)
+
+    def latir (self, parar):
+        """Renueva los arriendos de este nodo hasta que se cierra."""
+        while not parar.wait(self.tArriendo / 3.0):
+            try:
+                with self.transaccion() as c:
+                    c.execute("UPDATE filas SET vence = ? WHERE nodo = ? "
+                              "AND estado IN (?, ?)",
+                              (time.time() + self.tArriendo, self.nodo,
+                               PENDIENTE, SUBIDA))
+            except sqlite3.Error as e:
+                abilog.aviso(u"No se han podido renovar los arriendos: "
+                             u"{}".format(e))
+
+    def completas (self):
+        """Devuelve el conjunto de las filas verificadas."""
+        return set(nfila for nfila, in self.conexion().execute(
+            "SELECT nfila FROM filas WHERE estado = ?", (VERIFICADA,)))
+
+    def dudosa (self, nfila):
+        """Indica si la fila [nfila] pudo subirla antes otro nodo, o
+        este mismo en una ejecución anterior, sin llegar a verificarse.
+        """
+        with self.cerrojo:
+            return nfila in self.dudosas
+
+    def preparar_subida (self, nfila, fin=None, saltar=frozenset()):
+        """Renueva el arriendo de la fila [nfila] antes de subirla.
+        Devuelve True si la fila sigue arrendada a este nodo, o False si
+        su arriendo venció y la ha tomado otro, en cuyo caso no debe
+        subirse.
+        """
+        with self.transaccion() as c:
+            vigente = c.execute("UPDATE filas SET vence = ? WHERE nfila = ? "
+                                "AND nodo = ? AND estado = ?",
+                                (time.time() + self.tArriendo, nfila,
+                                 self.nodo, PENDIENTE)).rowcount == 1
+        if vigente:
+            with self.cerrojo:
+                self.iniciadas.add(nfila)
+        return vigente
+
+    def registrar (self, nfila, estado):
+        """Registra el nuevo estado [estado] de la fila [nfila], si
+        sigue arrendada a este nodo.
+        """
+        with self.transaccion() as c:
+            registrada = c.execute("UPDATE filas SET estado = ? "
+                                   "WHERE nfila = ? AND nodo = ?",
+                                   (estado, nfila, self.nodo)).rowcount
+        if not registrada:
+            abilog.aviso(u"La {}.ª fila la ha tomado otro nodo; no se "
+                         u"registra como {}.".format(nfila, estado))
+        if estado in (VERIFICADA, FALLIDA):
+            with self.cerrojo:
+                self.arrendadas.discard(nfila)
+                self.iniciadas.discard(nfila)
+
+    def grabar (self):
+        pass
+
+    def cerrar (self):
+        """Deja de renovar los arriendos y los abandona: las filas que
+        no se han empezado a subir quedan libres, y las demás, que
+        pueden haberse subido, vencen en el acto, para que otro nodo las
+        tome como dudosas.
+        """
+        if self.latido is not None:
+            self.parar.set()
+            self.latido.join()
+            self.latido = None
+        with self.cerrojo:
+            libres = self.arrendadas.difference(self.iniciadas)
+            self.arrendadas = set()
+            self.iniciadas = set()
+        with self.transaccion() as c:
+            c.executemany("UPDATE filas SET estado = ?, nodo = NULL, "
+                          "vence = NULL, intentos = intentos - 1 "
+                          "WHERE nfila = ? AND nodo = ? AND estado = ?",
+                          ((LIBRE, nfila, self.nodo, PENDIENTE)
+                           for nfila in libres))
+            c.execute("UPDATE filas SET vence = 0 WHERE nodo = ? "
+                      "AND estado IN (?, ?)", (self.nodo, PENDIENTE,
+                                               SUBIDA))
+
+def identificador_nodo ():
+    """Devuelve un identificador de este proceso que lo distingue de
+    cualquier otro nodo, en esta o en otra máquina (véase NODO).
+    """
+    return u"{}-{}".format(socket.gethostname().decode('utf-8', 'replace'),
+                           os.getpid())
+
+def trabajar_nodo (cfg, datos, tabla):
+    """Sube con bucle, en el modo de nodo, los ficheros de las filas que
+    se toman de la [tabla] de arriendos, ya iniciada, de
+    cfg["loteArriendo"] en cfg["loteArriendo"], y la cierra al terminar
+    o al interrumpirse.
+    
+    Cuando no queda ninguna fila por arrendar, pero otros nodos tienen
+    aún filas sin terminar, se espera, comprobándolo cada
+    cfg["tArriendo"]/6 segundos, por si alguno muere y hay que tomar
+    las suyas.
+    """
+    abilog.info(u"El nodo {} toma filas de la tabla de arriendos «{}», "
+                u"con {} sin terminar.".format(NODO, tabla.ruta,
+                                               tabla.restantes()))
+    progreso = None
+    if DESATENDIDO:
+        progreso = Progreso(tabla.restantes(), cfg["tProgreso"])
+    try:
+        while True:
+            tomadas = tabla.arrendar(cfg["loteArriendo"])
+            if tomadas:
+                bucle(cfg, datos, tabla, progreso=progreso,
+                      filas=tabla.filas(cfg["loteArriendo"], tomadas))
+            elif tabla.ajenas():
+                time.sleep(cfg["tArriendo"] / 6.0)
+            else:
+                break
+    finally:
+        tabla.cerrar()
 
 #### Procesamiento #####################################################
 
-def bucle (cfg, datos, nultimof):
+def subir_y_comprobar (cfg, f, fdestino, descr, sha1=None, diario=None,
+                       nfila=None):
+    """Sube el fichero [f] con subir y comprueba la subida con
+    comprobar_subida, usando el SHA-1 [sha1] si ya se conoce.
+    
+    Devuelve None si todo va bien, o un mensaje de error en caso
+    contrario. Antes de subir, se espera lo que indique el limitador de
+    la tasa de subidas, si lo hay.
+    Si se indica el [diario] de la sesión y el número de orden [nfila]
+    de la fila, se registra en él la subida; y si la fila es dudosa, se
+    comprueba antes si el fichero ya está en Wikimedia Commons, en cuyo
+    caso no se sube de nuevo.
+    """
+    if diario is not None and diario.dudosa(nfila) and \
+       comprobar_subida(cfg, f, sha1) is None:
+        abilog.info(u"El fichero «{}» ya se subió en una sesión "
+                    u"anterior.".format(f))
+        return None
+    if limitador is not None:
+        with abimetricas.medir("limitador"):
+            limitador.esperar()
+    subir(cfg, f, fdestino, descr)
+    if diario is not None:
+        diario.registrar(nfila, SUBIDA)
+    comprobacion = comprobar_subida(cfg, f, sha1)
+    if comprobacion is None and limitador is not None:
+        limitador.exito()
+    return comprobacion
+
+class ReservaSubidas (object):
+    """Conjunto de [hilos] hilos que suben y comprueban ficheros en
+    paralelo.
+    
+    Las subidas se encargan con enviar, que se bloquea mientras haya
+    demasiadas por empezar, y sus resultados se obtienen con recoger,
+    en el orden en que terminan.
+    """
+
+    def __init__ (self, cfg, hilos, diario):
+        self.cfg = cfg
+        self.diario = diario
+        self.porEmpezar = Queue.Queue(hilos)
+        self.terminadas = Queue.Queue()
+        self.enCurso = 0
+        self.hilos = []
+        for i in range(hilos):
+            hilo = threading.Thread(target=self.trabajar)
+            hilo.daemon = True
+            hilo.start()
+            self.hilos.append(hilo)
+
+    def trabajar (self):
+        while True:
+            tarea = self.porEmpezar.get()
+            if tarea is None:
+                return
+            nfila, f, fdestino, descr, sha1 = tarea
+            try:
+                comprobacion = subir_y_comprobar(self.cfg, f, fdestino,
+                                                 descr, sha1, self.diario,
+                                                 nfila)
+            except Exception as e:
+                comprobacion = u"Error inesperado al subir «{}»: " \
+                               u"{}".format(f, e)
+            self.terminadas.put((nfila, f, fdestino, descr, comprobacion))
+
+    def enviar (self, nfila, f, fdestino, descr, sha1=None):
+        self.enCurso += 1
+        self.porEmpezar.put((nfila, f, fdestino, descr, sha1))
+
+    def recoger (self, todas=False):
+        """Devuelve los resultados (nfila, f, fdestino, descr,
+        comprobacion) de las subidas ya terminadas o, si [todas] es
+        True, de todas las encargadas, esperando a que terminen.
+        """
+        resultados = []
+        while self.enCurso:
+            try:
+                resultado = self.terminadas.get(todas)
+            except Queue.Empty:
+                break
+            self.enCurso -= 1
+            resultados.append(resultado)
+        return resultados
+
+    def cerrar (self):
+        for hilo in self.hilos:
+            self.porEmpezar.put(None)
+        for hilo in self.hilos:
+            hilo.join()
+
+class Preparador (object):
+    """Preparación en segundo plano de las filas del conjunto de datos
+    [datos] cuyos números de orden da el iterable [filas]: para cada
+    una, se obtienen los nombres del fichero, su descripción y su SHA-1,
+    con [hilos] hilos.
+    
+    Las filas se recorren iterando sobre el preparador, en el orden de
+    [filas], y sus datos se obtienen con obtener. Nunca se preparan más
+    de [adelanto] filas por delante de la última obtenida, de modo que
+    la memoria empleada no crece con el número de filas. Los SHA-1 ya
+    conocidos pueden indicarse en [sha1s] ({número de orden de la fila:
+    SHA-1}).
+    
+    Si cfg["alijoPrevio"] es True, cada fichero preparado se sube además
+    al alijo del servidor con alijar_api, de modo que la transferencia
+    se solapa con la revisión del operador y subirlo después consiste
+    solo en publicarlo desde el alijo.
+    """
+
+    def __init__ (self, cfg, datos, filas, adelanto, hilos, sha1s=None):
+        self.cfg = cfg
+        self.datos = datos
+        self.filas = iter(filas)
+        self.sha1s = sha1s or {}
+        self.adelanto = adelanto
+        self.pedidas = 0
+        self.obtenidas = 0
+        self.orden = collections.deque()
+        self.agotadas = False
+        self.preparadas = {}
+        self.cerrado = False
+        self.condicion = threading.Condition()
+        #  [filas] puede tardar en dar la siguiente fila (véase
+        #  TablaArriendos.filas), así que se recorre fuera de la
+        #  condición, para no bloquear entretanto a obtener.
+        self.cerrojoFilas = threading.Lock()
+        for i in range(hilos):
+            hilo = threading.Thread(target=self.trabajar)
+            hilo.daemon = True
+            hilo.start()
+
+    def preparar (self, nfila):
+        f = archivo_de_fila(self.cfg, self.datos, nfila)
+        fdestino = archivo_destino_de_fila(self.cfg, self.datos, nfila)
+        descr = csvcfg.descripcion(self.datos, nfila)
+        sha1 = self.sha1s.get(nfila)
+        if sha1 is None:
+            sha1 = sha1_f(self.cfg, f)
+        if self.cfg["alijoPrevio"] and not SIMULACION:
+            with abimetricas.medir("alijo"):
+                alijar_api(self.cfg, f, fdestino)
+        return f, fdestino, descr, sha1
+
+    def trabajar (self):
+        while True:
+            with self.cerrojoFilas:
+                with self.condicion:
+                    while not self.cerrado and not self.agotadas and \
+                          self.pedidas >= self.obtenidas + self.adelanto:
+                        self.condicion.wait()
+                    if self.cerrado or self.agotadas:
+                        return
+                try:
+                    nfila = next(self.filas)
+                except StopIteration:
+                    nfila = None
+                except Exception:
+                    nfila = None
+                    abilog.error(u"No se ha podido obtener la siguiente "
+                                 u"fila que preparar.")
+                    abilog.debug(traceback.format_exc().decode('utf-8',
+                                                               'replace'))
+                with self.condicion:
+                    if nfila is None:
+                        self.agotadas = True
+                    else:
+                        self.pedidas += 1
+                        self.orden.append(nfila)
+                    self.condicion.notify_all()
+                if nfila is None:
+                    return
+            try:
+                preparada = (True, self.preparar(nfila))
+            except Exception:
+                preparada = (False, sys.exc_info())
+            with self.condicion:
+                self.preparadas[nfila] = preparada
+                self.condicion.notify_all()
+
+    def __iter__ (self):
+        while True:
+            with self.condicion:
+                while not self.orden and not self.agotadas:
+                    self.condicion.wait()
+                if not self.orden:
+                    return
+                nfila = self.orden.popleft()
+            yield nfila
+
+    def obtener (self, nfila):
+        """Devuelve los nombres original y de destino, la descripción y
+        el SHA-1 del fichero de la fila [nfila], esperando a que estén
+        preparados.
+        
+        Las filas deben obtenerse en el orden en que se recorren.
+        Cualquier excepción producida al preparar la fila se relanza
+        aquí.
+        """
+        with self.condicion:
+            self.obtenidas += 1
+            self.condicion.notify_all()
+            while nfila not in self.preparadas:
+                self.condicion.wait()
+            correcta, preparada = self.preparadas.pop(nfila)
+        if not correcta:
+            raise preparada[0], preparada[1], preparada[2]
+        return preparada
+
+    def cerrar (self):
+        with self.condicion:
+            self.cerrado = True
+            self.condicion.notify_all()
+
+def tratar_resultados (cfg, datos, resultados, diario, progreso=None):
+    """Trata los [resultados] de las subidas, como los devuelve
+    ReservaSubidas.recoger: ofrece reintentar las fallidas y registra
+    en el [diario] el estado final de cada fila, y en el [progreso], si
+    lo hay, cuántas se han tratado.
+    """
+    for nfila, f, fdestino, descr, comprobacion in resultados:
+        if comprobacion:
+            abilog.error(comprobacion)
+            correcta = reintentar(cfg, datos, f, fdestino, descr)
+        else:
+            correcta = True
+        diario.registrar(nfila, VERIFICADA if correcta else FALLIDA)
+        if correcta:
+            abimetricas.contar("ficheros")
+            try:
+                abimetricas.contar("bytes", os.path.getsize(
+                    os.path.join(cfg["nombreDir"], f)))
+            except OSError:
+                pass
+        else:
+            abimetricas.contar("fallos")
+    if progreso is not None:
+        progreso.avanzar(len(resultados))
+    abimetricas.METRICAS.exportar_cada(ruta_metricas(cfg),
+                                       cfg["tMetricas"])
+
+def ruta_metricas (cfg):
+    """Devuelve la ruta, sin extensión, de los ficheros en que se
+    exportan las métricas del proceso de subida (véase abimetricas).
+    """
+    return u"{}.metricas{}".format(os.path.join(cfg["nombreDir"],
+                                                cfg["nombreCsv"]),
+                                   sufijo_fragmento())
+
+def resumir_metricas (cfg):
+    """Informa de las métricas del proceso de subida hasta el momento y
+    las exporta.
+    """
+    abilog.info(u"Tiempos y recuentos hasta ahora:")
+    for linea in abimetricas.METRICAS.texto():
+        abilog.info(u"    {}".format(linea))
+    abimetricas.METRICAS.exportar(ruta_metricas(cfg))
+
+def bucle (cfg, datos, diario, omitir=frozenset(), sha1s=None,
+           progreso=None, filas=None):
+    """Sube por tandas los ficheros de las filas del conjunto de datos
+    [datos] que no consten como verificadas en el [diario] de la sesión,
+    salvo los de las filas de [omitir], que se registran como
+    verificadas sin subirlos. En un proceso trabajador, solo se tratan
+    las filas de su FRAGMENTO.
+    
+    Si se indica el iterable [filas], se suben en cambio las filas cuyos
+    números de orden da, en ese orden; así, en el modo de nodo, las que
+    se toman de la tabla de arriendos, que hace de [diario] (véase
+    TablaArriendos).
+    Los SHA-1 ya conocidos pueden indicarse en [sha1s] ({número de orden
+    de la fila: SHA-1}). En el modo desatendido, el avance se muestra
+    con [progreso] o, si no se indica, con uno nuevo (véase Progreso).
+    """
+    global limitador
+    if FRAGMENTO is None:
+        limitador = crear_limitador(cfg)
+    ajustar_pwb(cfg)
+    if cfg["hilos"] > 1:
+        reserva = ReservaSubidas(cfg, cfg["hilos"], diario)
+    else:
+        reserva = None
+    if filas is None:
+        completas = diario.completas()
+        for nfila in sorted(set(omitir).difference(completas)):
+            diario.registrar(nfila, VERIFICADA)
+        saltar = completas.union(omitir)
+        if FRAGMENTO is not None:
+            saltar = FilasAjenas(FRAGMENTO[0], FRAGMENTO[1], saltar)
+        inicio = 1
+        while inicio in completas:
+            inicio += 1
+        filas = (n for n in xrange(inicio, len(datos)) if n not in saltar)
+        if progreso is None and DESATENDIDO:
+            progreso = Progreso(sum(1 for n in xrange(inicio, len(datos))
+                                    if n not in saltar), cfg["tProgreso"])
+    else:
+        saltar = frozenset()
+    preparador = Preparador(cfg, datos, filas, cfg["adelanto"],
+                            min(cfg["adelanto"], max(2, cfg["hilos"])),
+                            sha1s)
     correctos = 0
     tanda = cfg["tanda0"]
     tDescansoSeg = cfg["tDescanso"] * 60 # cálculos en segundos
     t0 = time.time()
-    for nfila in range(nultimof+1, len(datos)):
-        if correctos == tanda:
+    #
+    #  Sin operador, no se hacen tandas (ni se espera entre ellas a que
+    #  terminen todas las subidas en curso) salvo que se pida una pausa
+    #  entre ellas con cfg["pausaTanda"].
+    #
+    tandas = INTERACTIVO or cfg["pausaTanda"] is not None
+    for nfila in preparador:
+        if tandas and correctos == tanda:
+            if reserva is not None:
+                tratar_resultados(cfg, datos, reserva.recoger(True), diario,
+                                  progreso)
             print
             print '*' * 80
             print
@@ -658,6 +3093,7 @@ def bucle (cfg, datos, nultimof):
                         u"{}".format(len(datos)-nfila))
             completado = (float(nfila)-1)*100/(float(len(datos))-1)
             abilog.info(u"Completado: {:.3f} %".format(completado))
+            resumir_metricas(cfg)
             tanda = int(tanda * cfg["crecimTanda"])
             if INTERACTIVO:
                 tmp = random.randint(0, 6)
@@ -692,7 +3128,8 @@ def bucle (cfg, datos, nultimof):
                 continuar = False
                 t0rev = time.time()
                 while not continuar:
-                    r = raw_input("> ")
+                    with abimetricas.medir("operador"):
+                        r = raw_input("> ")
                     abilog.debug("Se escribe «{}».".format(r))
                     if r.upper() == palabra:
                         if time.time() - t0rev < 7 + tanda/20:
@@ -716,32 +3153,38 @@ def bucle (cfg, datos, nultimof):
                                 t0 = time.time()
                             continuar = True
             else:
-                print
-                abilog.info(u"El proceso se pausará por 115 segundos.")
-                time.sleep(115)
+                if cfg["pausaTanda"]:
+                    print
+                    abilog.info(u"El proceso se pausará por {} "
+                                u"segundos.".format(cfg["pausaTanda"]))
+                    with abimetricas.medir("pausa"):
+                        time.sleep(cfg["pausaTanda"])
                 abilog.info(u"La siguiente tanda será de {} "
                             u"archivos.".format(tanda))
             correctos = 0
-            try:
-                urllib.urlopen("https://commons.wikimedia.org/")
-            except:
-                abilog.error(u"No puede accederse a Wikimedia Commons.")
+            error = comprobar_conexion(cfg)
+            if error:
+                abilog.error(error)
                 print u"Por favor, inténtelo más tarde."
                 sys.exit()
-        f = archivo_de_fila(cfg, datos, nfila)
-        print
-        abilog.info(u"Cargando {}.ª fila.".format(nfila))
-        print '-' * 80
-        abilog.info(u"Archivo original: {}".format(f))
-        fdestino = archivo_destino_de_fila(cfg, datos, nfila)
-        abilog.info(u"Archivo en Commons: {}".format(fdestino))
-        descr = csvcfg.descripcion(datos,nfila)
-        print u"Descripción:"
-        print descr.encode(sys.stdout.encoding, errors='replace')
-        print '-' * 80
+        f, fdestino, descr, sha1 = preparador.obtener(nfila)
+        if DESATENDIDO:
+            abilog.debug(u"Cargando {}.ª fila: «{}» como «{}». "
+                         u"Descripción:\n{}".format(nfila, f, fdestino,
+                                                    descr))
+        else:
+            print
+            abilog.info(u"Cargando {}.ª fila.".format(nfila))
+            print '-' * 80
+            abilog.info(u"Archivo original: {}".format(f))
+            abilog.info(u"Archivo en Commons: {}".format(fdestino))
+            print u"Descripción:"
+            print descr.encode(sys.stdout.encoding, errors='replace')
+            print '-' * 80
         if INTERACTIVO and correctos < cfg["aprobar"]:
             preg = u"¿Son correctos los datos indicados?"
-            time.sleep(4.5)
+            with abimetricas.medir("pausa"):
+                time.sleep(4.5)
             r = sn(preg)
             if r:
                 abilog.debug(u"Los datos se dan por correctos.")
@@ -753,48 +3196,168 @@ def bucle (cfg, datos, nultimof):
                 print (u"Gracias.")
                 time.sleep(20)
                 sys.exit()
-        subir(cfg,f,fdestino,descr)
-        comprobacion = comprobar_subida(cfg,f)
-        if comprobacion:
-            abilog.error(comprobacion)
-            reintentar(cfg,datos,f,fdestino,descr)
-        guardar_fila(cfg,nfila)
+        if diario.preparar_subida(nfila, len(datos), saltar) is False:
+            abilog.aviso(u"La {}.ª fila ya no está arrendada a este nodo "
+                         u"y no se sube.".format(nfila))
+            continue
+        if reserva is None or (INTERACTIVO and correctos < cfg["aprobar"]):
+            #
+            #  Las filas que aprobar se suben de una en una, en el orden
+            #  en que se aprueban.
+            #
+            comprobacion = subir_y_comprobar(cfg, f, fdestino, descr, sha1,
+                                             diario, nfila)
+            tratar_resultados(cfg, datos,
+                              [(nfila, f, fdestino, descr, comprobacion)],
+                              diario, progreso)
+        else:
+            reserva.enviar(nfila, f, fdestino, descr, sha1)
+            tratar_resultados(cfg, datos, reserva.recoger(), diario,
+                              progreso)
         correctos += 1
-        time.sleep(cfg["tEspera"])
+    preparador.cerrar()
+    if reserva is not None:
+        tratar_resultados(cfg, datos, reserva.recoger(True), diario,
+                          progreso)
+        reserva.cerrar()
+    diario.cerrar()
+    if progreso is not None:
+        progreso.mostrar()
+    resumir_metricas(cfg)
 
-def fin (cfg):
+def fin (cfg, diario):
     """Notifica el fin del proceso de subida y reinicializa los datos
-    guardados.
+    guardados en el [diario] de la sesión, si todas sus filas están
+    verificadas.
+    
+    Si alguna ha fallado o no llegó a verificarse, el diario solo se
+    compacta, y se conservan el registro de las subidas por trozos y la
+    caché de SHA-1, para que la siguiente ejecución reintente solo esas
+    filas.
     """
-    time.sleep(1)
+    pausa(1)
     print
     print '*' * 80
     print
     abilog.info(u"El proceso de subida se da por concluido.")
+    pendientes = [nfila for nfila, estado in diario.estados.items()
+                  if estado != VERIFICADA]
+    if pendientes:
+        abilog.aviso(u"{} ficheros no se han podido subir o verificar "
+                     u"(el primero, el de la {}.ª fila); se reintentarán "
+                     u"en la próxima ejecución.".format(len(pendientes),
+                                                       min(pendientes)))
     abilog.info(u"Por favor, revise los resultados.")
     abilog.info(u"Mil gracias por su contribución.")
     log_hash(cfg, u"{}.log".format(cfg["nombreCsv"]))
     print
     print '*' * 80
     print
-    guardar_fila(cfg, 0)
-    time.sleep(10)
+    if pendientes:
+        diario.compactar()
+    else:
+        diario.reiniciar()
+        for ruta in [ruta_trozos(cfg), ruta_cache_sha1(cfg)] + glob.glob(
+                u"{}.*".format(ruta_trozos(cfg))):
+            if os.path.isfile(ruta):
+                os.remove(ruta)
+    pausa(10)
+
+def adoptar_numero (cfg, tmp, clave, descripcion, unidad=None,
+                    minimo=None, maximo=None, entero=False):
+    """Adopta como cfg[clave] el valor tmp[clave], definido en el archivo
+    de configuración, si es un número (entero si [entero] es True) entre
+    [minimo] y [maximo], ambos incluidos. Si no, conserva el valor por
+    defecto, ya en cfg[clave], e informa de ello.
+    
+    [descripcion] es la descripción del valor en los mensajes, y
+    [unidad], la unidad en que se expresa, si la tiene.
+    """
+    if unidad:
+        porDefecto = u"«{} [{}]»".format(cfg[clave], unidad)
+    else:
+        porDefecto = u"{}".format(cfg[clave])
+    if clave not in tmp:
+        abilog.debug(u"No se ha definido {} en el archivo de "
+                     u"configuración.".format(descripcion))
+        abilog.debug(u"Se asumirá {}, el valor por "
+                     u"defecto.".format(porDefecto))
+        return
+    valor = tmp[clave]
+    if entero:
+        tipos = (int, long)
+    else:
+        tipos = (int, long, float)
+    if type(valor) not in tipos:
+        abilog.error(u"El valor «{}», definido en el archivo de "
+                     u"configuración como {}, no es un {} "
+                     u"válido.".format(valor, descripcion,
+                                       u"entero" if entero else u"número"))
+    elif (minimo is not None and valor < minimo) or \
+         (maximo is not None and valor > maximo):
+        if maximo is None:
+            rango = u"inferior a {}".format(minimo)
+            abilog.error(u"El valor «{}», definido en el archivo de "
+                         u"configuración como {}, no puede ser "
+                         u"{}.".format(valor, descripcion, rango))
+        else:
+            abilog.error(u"El valor «{}», definido en el archivo de "
+                         u"configuración como {}, debe estar entre {} y "
+                         u"{}.".format(valor, descripcion, minimo, maximo))
+    else:
+        #
+        #  Superadas todas las pruebas, el valor del archivo de
+        #  configuración se considera válido y se adopta.
+        #
+        cfg[clave] = valor
+        return
+    abilog.info(u"Se asumirá {}, el valor por defecto.".format(porDefecto))
+    print
+
+#  Valores por defecto de la configuración (véase obtener_cfg).
+#
+CFG_POR_DEFECTO = {
+    "nombreDir":     None,
+    "nombreCsv":     None,
+    "campoNombres0": None,
+    "campoNombresC": None,
+    "tDescanso":     30,
+    "tEspera":       0,
+    "tanda0":        5,
+    "aprobar":       3,
+    "crecimTanda":   1.5,
+    "urlApi":        u"https://commons.wikimedia.org/w/api.php",
+    "tConexion":     30,
+    "hilos":         1,
+    "tasaMax":       1,
+    "maxlag":        5,
+    "adelanto":      4,
+    "buscarSha1":    False,
+    "copiasMax":     0,
+    "tamDescrMax":   2097152,
+    "dirPwb":        None,
+    "diasCacheApi":  30,
+    "registroAsincrono": True,
+    "registroJson":  False,
+    "tMetricas":     60,
+    "motorSubida":   "pywikibot",
+    "usuarioApi":    None,
+    "contrasenaApi": None,
+    "pausaTanda":    None,
+    "tProgreso":     10,
+    "reintentos":    3,
+    "tamTrozo":      5242880,
+    "umbralTrozos":  52428800,
+    "alijoPrevio":   False,
+    "tArriendo":     300,
+    "loteArriendo":  16,
+}
 
 def obtener_cfg ():
     ##
     ##  Valores por defecto
     ##
-    cfg = {
-        "nombreDir":     None,
-        "nombreCsv":     None,
-        "campoNombres0": None,
-        "campoNombresC": None,
-        "tDescanso":     30,
-        "tEspera":       0,
-        "tanda0":        5,
-        "aprobar":       3,
-        "crecimTanda":   1.5,
-    }
+    cfg = dict(CFG_POR_DEFECTO)
     try:
         tmp = csvcfg.cte()
     except:
@@ -916,8 +3479,18 @@ def obtener_cfg ():
     ##
     ##  Configuración del fichero de registros
     ##
-    abilog.config(u"{}.log".format(os.path.join(cfg["nombreDir"],
-                                                cfg["nombreCsv"])))
+    for clave in ("registroAsincrono", "registroJson"):
+        if type(tmp.get(clave, cfg[clave])) is bool:
+            cfg[clave] = tmp.get(clave, cfg[clave])
+        else:
+            print (u"AVISO: El valor «{}», definido en el archivo de "
+                   u"configuración como {}, no es True ni False. Se "
+                   u"asumirá {}, el valor por "
+                   u"defecto.".format(tmp[clave], clave, cfg[clave]))
+    abilog.config(u"{}.log{}".format(os.path.join(cfg["nombreDir"],
+                                                  cfg["nombreCsv"]),
+                                     sufijo_fragmento()),
+                  cfg["registroAsincrono"], cfg["registroJson"], NODO)
     
     ##
     ##  Campo con los nombres locales de los ficheros que subir
@@ -1181,12 +3754,255 @@ def obtener_cfg ():
                     u"defecto.".format(cfg["crecimTanda"]))
         print
     
+    ##
+    ##  Dirección de la API de Wikimedia Commons
+    ##
+    if "urlApi" not in tmp:
+        abilog.debug(u"No se ha definido la dirección de la API de "
+                     u"Wikimedia Commons.")
+        abilog.debug(u"Se asumirá «{}», el valor por "
+                     u"defecto.".format(cfg["urlApi"]))
+    elif (not type(tmp["urlApi"]) is str and \
+          not type(tmp["urlApi"]) is unicode) or \
+         not tmp["urlApi"].startswith(("http://", "https://")):
+        abilog.error(u"El valor «{}», definido en el archivo de "
+                     u"configuración como la dirección de la API de "
+                     u"Wikimedia Commons, no es una dirección "
+                     u"HTTP o HTTPS.".format(tmp["urlApi"]))
+        abilog.info(u"Se asumirá «{}», el valor por "
+                    u"defecto.".format(cfg["urlApi"]))
+        print
+    else:
+        cfg["urlApi"] = tmp["urlApi"]
+    
+    ##
+    ##  Tiempo máximo de espera por la red en cada petición
+    ##
+    adoptar_numero(cfg, tmp, "tConexion",
+                   u"el tiempo máximo de espera por la red en cada "
+                   u"petición", u"segundos", minimo=0.1)
+    
+    ##
+    ##  Número de hilos que suben ficheros en paralelo
+    ##
+    adoptar_numero(cfg, tmp, "hilos",
+                   u"el número de ficheros que subir en paralelo",
+                   minimo=1, maximo=32, entero=True)
+    
+    ##
+    ##  Ritmo máximo de subida y retraso de replicación tolerado
+    ##
+    adoptar_numero(cfg, tmp, "tasaMax",
+                   u"el número máximo de subidas por segundo",
+                   u"subidas/s", minimo=0.001)
+    adoptar_numero(cfg, tmp, "maxlag",
+                   u"el retraso de replicación máximo tolerado",
+                   u"segundos", minimo=1, entero=True)
+    
+    ##
+    ##  Número de filas que preparar por delante de la que se sube
+    ##
+    adoptar_numero(cfg, tmp, "adelanto",
+                   u"el número de filas que preparar por adelantado",
+                   minimo=1, maximo=1000, entero=True)
+    
+    ##
+    ##  Número de copias de seguridad del fichero de CSV que conservar
+    ##
+    adoptar_numero(cfg, tmp, "copiasMax",
+                   u"el número de copias de seguridad que conservar",
+                   minimo=0, entero=True)
+    
+    ##
+    ##  Tamaño máximo de las descripciones
+    ##
+    adoptar_numero(cfg, tmp, "tamDescrMax",
+                   u"el tamaño máximo de las descripciones",
+                   u"bytes", minimo=1, entero=True)
+    
+    ##
+    ##  Directorio de Pywikibot core
+    ##
+    if tmp.get("dirPwb") is not None:
+        if type(tmp["dirPwb"]) in (str, unicode) and \
+           os.path.isdir(tmp["dirPwb"]):
+            cfg["dirPwb"] = tmp["dirPwb"]
+        else:
+            abilog.error(u"El valor «{}», definido en el archivo de "
+                         u"configuración como el directorio de "
+                         u"Pywikibot, no es un directorio "
+                         u"existente.".format(tmp["dirPwb"]))
+            abilog.info(u"Se buscará Pywikibot en las proximidades del "
+                        u"directorio actual.")
+    
+    ##
+    ##  Días que se reutiliza la información del sitio y de la API
+    ##
+    adoptar_numero(cfg, tmp, "diasCacheApi",
+                   u"los días que se reutiliza la información de la API",
+                   u"días", minimo=0)
+    
+    ##
+    ##  Intervalo de exportación de las métricas
+    ##
+    adoptar_numero(cfg, tmp, "tMetricas",
+                   u"el intervalo de exportación de las métricas",
+                   u"segundos", minimo=1)
+    
+    ##
+    ##  Pausa entre tandas sin operador
+    ##
+    if tmp.get("pausaTanda") is not None:
+        adoptar_numero(cfg, tmp, "pausaTanda",
+                       u"la pausa entre tandas sin operador",
+                       u"segundos", minimo=0)
+    
+    ##
+    ##  Intervalo entre líneas de progreso del modo desatendido
+    ##
+    adoptar_numero(cfg, tmp, "tProgreso",
+                   u"el intervalo entre líneas de progreso",
+                   u"segundos", minimo=0)
+    
+    ##
+    ##  Reintentos automáticos del modo desatendido
+    ##
+    adoptar_numero(cfg, tmp, "reintentos",
+                   u"el número de reintentos de cada subida fallida en "
+                   u"el modo desatendido", minimo=0, entero=True)
+    
+    ##
+    ##  Subidas por trozos de los ficheros grandes
+    ##
+    adoptar_numero(cfg, tmp, "tamTrozo",
+                   u"el tamaño de los trozos de las subidas por trozos",
+                   u"bytes", minimo=0, entero=True)
+    adoptar_numero(cfg, tmp, "umbralTrozos",
+                   u"el tamaño a partir del cual se sube por trozos",
+                   u"bytes", minimo=0, entero=True)
+    
+    ##
+    ##  Arriendos de filas del modo de nodo
+    ##
+    adoptar_numero(cfg, tmp, "tArriendo",
+                   u"la duración de los arriendos de filas",
+                   u"segundos", minimo=3)
+    adoptar_numero(cfg, tmp, "loteArriendo",
+                   u"el número de filas que se arriendan de una vez",
+                   minimo=1, entero=True)
+    
+    ##
+    ##  Medio de subida: Pywikibot o directamente la API
+    ##
+    if tmp.get("motorSubida", cfg["motorSubida"]) in ("pywikibot", "api"):
+        cfg["motorSubida"] = tmp.get("motorSubida", cfg["motorSubida"])
+    else:
+        abilog.error(u"El valor «{}», definido en el archivo de "
+                     u"configuración como el medio de subida, no es "
+                     u"«pywikibot» ni «api».".format(tmp["motorSubida"]))
+        abilog.info(u"Se asumirá «{}», el valor por "
+                    u"defecto.".format(cfg["motorSubida"]))
+    if cfg["motorSubida"] == "api":
+        cfg["usuarioApi"] = tmp.get("usuarioApi")
+        cfg["contrasenaApi"] = tmp.get("contrasenaApi") or \
+                               os.environ.get(VAR_CONTRASENA_API)
+        if not INTERACTIVO and not (cfg["usuarioApi"] and
+                                    cfg["contrasenaApi"]):
+            print(u"ERROR: No se ha definido el usuario o la contraseña "
+                  u"de bot para subir por la API en el archivo de "
+                  u"configuración ni en la variable de entorno "
+                  u"{}.".format(VAR_CONTRASENA_API))
+            sys.exit()
+        while not cfg["usuarioApi"]:
+            print (u"\nEscriba el nombre de usuario (de la contraseña "
+                   u"de bot) con el que subir los ficheros.\n")
+            cfg["usuarioApi"] = raw_input("> ").decode(sys.stdin.encoding
+                                                       or 'utf-8')
+        while not cfg["contrasenaApi"]:
+            print (u"\nEscriba la contraseña de bot de "
+                   u"«{}».\n".format(cfg["usuarioApi"]))
+            cfg["contrasenaApi"] = getpass.getpass("> ")
+    
+    ##
+    ##  Subida previa de los ficheros al alijo, para publicarlos después
+    ##
+    if "alijoPrevio" in tmp:
+        if type(tmp["alijoPrevio"]) is not bool:
+            abilog.error(u"El valor «{}», definido en el archivo de "
+                         u"configuración para indicar si subir los "
+                         u"ficheros al alijo antes de publicarlos, no es "
+                         u"True ni False.".format(tmp["alijoPrevio"]))
+            abilog.info(u"Se asumirá {}, el valor por "
+                        u"defecto.".format(cfg["alijoPrevio"]))
+            print
+        elif tmp["alijoPrevio"] and cfg["motorSubida"] != "api":
+            abilog.aviso(u"La subida previa de los ficheros al alijo "
+                         u"solo es posible con el medio de subida "
+                         u"«api»; se subirán directamente.")
+        else:
+            cfg["alijoPrevio"] = tmp["alijoPrevio"]
+    
+    ##
+    ##  Búsqueda previa de cada SHA-1 en todo Wikimedia Commons
+    ##
+    if "buscarSha1" in tmp:
+        if type(tmp["buscarSha1"]) is bool:
+            cfg["buscarSha1"] = tmp["buscarSha1"]
+        else:
+            abilog.error(u"El valor «{}», definido en el archivo de "
+                         u"configuración para indicar si buscar el SHA-1 "
+                         u"de cada fichero en todo Wikimedia Commons, no "
+                         u"es True ni False.".format(tmp["buscarSha1"]))
+            abilog.info(u"Se asumirá {}, el valor por "
+                        u"defecto.".format(cfg["buscarSha1"]))
+            print
+    
     return cfg
 
+def opciones ():
+    """Devuelve las opciones de la línea de órdenes."""
+    analizador = argparse.ArgumentParser(
+        description=u"Sube a Wikimedia Commons los ficheros descritos en "
+                    u"un fichero de CSV, según la configuración de "
+                    u"csvcfg.py.")
+    analizador.add_argument(
+        "--desatendido", action="store_true",
+        help=u"sube sin operador, sin esperas fijas y con una línea de "
+             u"progreso periódica, para colecciones ya revisadas")
+    analizador.add_argument(
+        "--procesos", type=int, default=1, metavar="N",
+        help=u"reparte las filas entre N procesos, con un mismo límite "
+             u"de la tasa de subidas para todos; implica --desatendido "
+             u"y requiere el medio de subida «api»")
+    analizador.add_argument(
+        "--arriendos", metavar="RUTA",
+        help=u"modo de nodo: toma las filas de la tabla de arriendos de "
+             u"SQLite RUTA, que comparte con otros nodos, en esta o en "
+             u"otras máquinas, que suben la misma colección; implica "
+             u"--desatendido")
+    return analizador.parse_args()
+
 def main ():
-    if not (DIR_PWB or SIMULACION):
-        sys.exit()
+    global INTERACTIVO, DESATENDIDO, NODO
+    args = opciones()
+    procesos = max(1, args.procesos)
+    if args.arriendos:
+        NODO = identificador_nodo()
+    if args.desatendido or procesos > 1 or NODO is not None:
+        INTERACTIVO = False
+        DESATENDIDO = True
     cfg = obtener_cfg()
+    if procesos > 1 and NODO is not None:
+        abilog.aviso(u"En el modo de nodo se sube en un solo proceso; "
+                     u"para más, láncense más nodos.")
+        procesos = 1
+    if procesos > 1 and not SIMULACION and cfg["motorSubida"] != "api":
+        abilog.aviso(u"Solo puede subirse en varios procesos con el "
+                     u"medio de subida «api»; se usará uno solo.")
+        procesos = 1
+    if not (SIMULACION or cfg["motorSubida"] == "api" or
+            cargar_pwb(cfg["dirPwb"])):
+        sys.exit()
     abilog.debug(u"---")
     abilog.debug(u"Se inicia el programa.")
     try:
@@ -1194,25 +4010,23 @@ def main ():
     except:
         abilog.debug(u"Operador/a: ???")
     log_hash(cfg, u"{}.log".format(cfg["nombreCsv"]))
-    abilog.info(u"El directorio de Pywikibot encontrado es "
-                u"«{}».".format(DIR_PWB))
-    error = None
-    try:
-        urllib.urlopen("https://commons.wikimedia.org/")
-    except:
-        error = u"No puede accederse a Wikimedia Commons."
-    try:
-        urllib.urlopen("https://commons.wikimedia.org/w/api.php")
-    except:
-        error = u"No puede accederse a la API de Wikimedia " \
-                u"Commons (https://commons.wikimedia.org/w/api.php)."
+    if DIR_PWB:
+        abilog.info(u"El directorio de Pywikibot encontrado es "
+                    u"«{}».".format(DIR_PWB))
+    abihttp.config(cfg["tConexion"])
+    error = comprobar_conexion(cfg)
     if not error:
         abilog.info(u"La conexión se ha comprobado "
                     u"satisfactoriamente.")
-        login_pwb()
+        if cfg["motorSubida"] == "api":
+            error = login_api(cfg)
+        else:
+            login_pwb(cfg)
+    if not error:
         abilog.info(u"Creando copias de seguridad.")
         error = copia_seguridad(os.path.join(cfg["nombreDir"],
-                                             cfg["nombreCsv"]))
+                                             cfg["nombreCsv"]),
+                                cfg["copiasMax"])
     if error:
         abilog.error(error)
     else:
@@ -1228,30 +4042,33 @@ def main ():
             if error:
                 abilog.error(error)
             else:
-                ifila = int(cargar_fila(cfg))
-                if ifila == 0:
-                    #
-                    #  En caso de error al intentar reanudar la sesión,
-                    #  [ifila] será 0, y tal valor se guarda en el
-                    #  fichero para reiniciar el proceso de subida.
-                    #
-                    guardar_fila(cfg,ifila)
+                diario = cargar_fila(cfg)
+                completas = diario.completas()
                 abilog.info(u"Ficheros de {} tratados hasta "
-                            u"ahora: {}".format(cfg["nombreCsv"],ifila))
+                            u"ahora: {}".format(cfg["nombreCsv"],
+                                                len(completas)))
                 abilog.info(u"Ficheros por subir: "
-                            u"{}".format(len(datos)-ifila-1))
-                time.sleep(2)
+                            u"{}".format(len(datos)-len(completas)-1))
+                pausa(2)
                 print
-                ultimof = archivo_de_fila(cfg, datos, ifila)
-                if ifila > 0:
+                if diario.estados:
                     abilog.info(u"Hay datos guardados de una "
                                 u"sesión anterior de la subida "
                                 u"de archivos de "
                                 u"«{}».".format(cfg["nombreCsv"]))
-                    abilog.info(u"Según los cálculos, el "
-                                u"último fichero tratado fue "
-                                u"«{}», de la {}.ª "
-                                u"fila.".format(ultimof, ifila))
+                    if completas:
+                        ifila = max(completas)
+                        ultimof = archivo_de_fila(cfg, datos, ifila)
+                        abilog.info(u"Según los cálculos, el "
+                                    u"último fichero tratado fue "
+                                    u"«{}», de la {}.ª "
+                                    u"fila.".format(ultimof, ifila))
+                    if diario.dudosas:
+                        abilog.info(u"Hay {} ficheros cuya subida no "
+                                    u"llegó a verificarse; antes de "
+                                    u"subirlos, se comprobará si ya "
+                                    u"están en Wikimedia "
+                                    u"Commons.".format(len(diario.dudosas)))
                     if INTERACTIVO:
                         desconocido = True
                         while desconocido:
@@ -1285,13 +4102,11 @@ def main ():
                                                 u"para "
                                                 u"«{}».".format(cfg["nombreCsv"]))
                                     abilog.info(u"Se empezará de cero.")
-                                    ifila = 0
-                                    guardar_fila(cfg,0)
+                                    diario.reiniciar()
                                     desconocido = False
                                 else:
                                     abilog.debug(u"No se confirma.")
                 else:
-                    ifila = 0
                     if INTERACTIVO:
                         print (u"\nEscriba «COMENZAR» si ha revisado "
                                u"concienzudamente la información del "
@@ -1328,8 +4143,33 @@ def main ():
                 print
                 if INTERACTIVO:
                     time.sleep(10)
-                bucle(cfg,datos,ifila)
-                fin(cfg)
+                if NODO is not None:
+                    tabla = TablaArriendos(args.arriendos, NODO,
+                                           cfg["tArriendo"])
+                    error = tabla.iniciar(len(datos), diario.completas())
+                    diario.cerrar()
+                    if error:
+                        abilog.error(error)
+                    else:
+                        trabajar_nodo(cfg, datos, tabla)
+                    return
+                omitir, sha1s = frozenset(), None
+                if not SIMULACION:
+                    inicio = 1
+                    while diario.estados.get(inicio) == VERIFICADA:
+                        inicio += 1
+                    omitir, sha1s = comprobacion_previa(
+                        cfg, datos, inicio, diario.completas())
+                    if omitir:
+                        abilog.info(u"{} de los ficheros por subir ya "
+                                    u"están en Wikimedia Commons y se "
+                                    u"omitirán.".format(len(omitir)))
+                if procesos > 1:
+                    if coordinar(cfg,datos,diario,procesos,omitir,sha1s):
+                        fin(cfg,diario)
+                else:
+                    bucle(cfg,datos,diario,omitir,sha1s)
+                    fin(cfg,diario)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,538 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+#    Pruebas de rendimiento de CSV a Commons.
+#
+#    Cada prueba se ejecuta en un proceso independiente para que la
+#    memoria máxima (RSS) medida corresponda solo a ella. Uso:
+#
+#        python csvbench.py sha1 [--mib N] [--fichero RUTA]
+#        python csvbench.py duplicados [--filas N N ...]
+#        python csvbench.py previas [--filas N N ...] [--columnas N]
+#                                   [--repetidos P] [--dir RUTA]
+#                                   [--json RUTA] [--base RUTA]
+#        python csvbench.py trozos [--mib N N ...] [--trozo BYTES]
+#                                  [--errores P] [--latencia S]
+#
+#   Copyright (C) 2015, David Abián <da [at] davidabian.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+def rss_max_kib ():
+    """Devuelve la memoria máxima (RSS) usada hasta ahora por el proceso
+    actual, en KiB.
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        rss = rss / 1024
+    return rss
+
+def en_subproceso (args):
+    """Ejecuta este mismo programa con los argumentos [args] en un
+    proceso nuevo y devuelve el resultado que este emite en JSON.
+    """
+    entorno = dict(os.environ, PYTHONIOENCODING="utf-8")
+    salida = subprocess.check_output([sys.executable,
+                                      os.path.abspath(__file__)] + args,
+                                     env=entorno)
+    return json.loads(salida.splitlines()[-1])
+
+def crear_fichero (ruta, mib):
+    """Crea en [ruta] un fichero de [mib] MiB de contenido aleatorio."""
+    trozo = os.urandom(1024 * 1024)
+    with open(ruta, 'wb') as f:
+        for i in range(mib):
+            f.write(trozo)
+
+#### SHA-1 #############################################################
+
+def medir_sha1 (ruta, modo):
+    """Calcula el SHA-1 de [ruta] con el modo [modo] ("bloques", "mmap"
+    o "completo", este último equivalente a leer todo el fichero de una
+    vez) y devuelve las medidas obtenidas.
+    """
+    import csvac
+    tam = os.path.getsize(ruta)
+    t0 = time.time()
+    if modo == "completo":
+        with open(ruta, 'rb') as f:
+            sha1 = hashlib.sha1(f.read()).hexdigest()
+    else:
+        sha1 = csvac.sha1_ruta(ruta, modo)
+    t = time.time() - t0
+    return {
+        "modo": modo,
+        "bytes": tam,
+        "segundos": t,
+        "MBs": tam / 1e6 / t if t else None,
+        "rssMaxKiB": rss_max_kib(),
+        "sha1": sha1,
+    }
+
+def bench_sha1 (mib, fichero=None, modos=("bloques", "mmap", "completo")):
+    """Compara la velocidad y la memoria máxima de cada modo de cálculo
+    del SHA-1 sobre [fichero] o, si no se indica, sobre un fichero
+    temporal de [mib] MiB.
+    """
+    temporal = fichero is None
+    if temporal:
+        fd, fichero = tempfile.mkstemp(prefix="csvbench-", suffix=".bin")
+        os.close(fd)
+        crear_fichero(fichero, mib)
+    try:
+        # Lectura previa para que todos los modos partan de la misma
+        # situación de la caché de disco.
+        en_subproceso(["sha1-modo", fichero, "bloques"])
+        resultados = [en_subproceso(["sha1-modo", fichero, modo])
+                      for modo in modos]
+    finally:
+        if temporal:
+            os.remove(fichero)
+    for r in resultados:
+        print u"{:>9}: {:8.1f} MB/s, RSS máximo {:8d} KiB".format(
+            r["modo"], r["MBs"] or 0, r["rssMaxKiB"]).encode('utf-8')
+    return resultados
+
+#### Duplicados ########################################################
+
+CFG_SINTETICA = {
+    "nombreDir": u".",
+    "nombreCsv": u"sintetico.csv",
+    "campoNombres0": u"Nombre fichero local",
+    "campoNombresC": u"Nombre fichero en Commons",
+}
+
+def datos_sinteticos (filas, repetidos=0.0):
+    """Devuelve un conjunto de datos en memoria con [filas] filas de
+    información, de las cuales aproximadamente una proporción
+    [repetidos] tiene un nombre de destino ya usado en otra fila (con
+    distinto uso de mayúsculas y guiones bajos).
+    """
+    cada = int(1 / repetidos) if repetidos else 0
+    datos = [[CFG_SINTETICA["campoNombres0"],
+              CFG_SINTETICA["campoNombresC"], u"Descripción"]]
+    for n in range(1, filas + 1):
+        m = n - 1 if cada and n > 1 and n % cada == 0 else n
+        datos.append([u"f{:07d}.jpg".format(n),
+                      u"archivo_ñ_{:07d}.jpg".format(m) if m != n
+                      else u"Archivo ñ {:07d}.jpg".format(n),
+                      u"Texto de la fila {}".format(n)])
+    return datos
+
+def medir_duplicados (filas, repetidos):
+    """Mide comprobar_ficheros sobre [filas] filas sintéticas."""
+    import csvac
+    csvac.SIMULACION = True
+    datos = datos_sinteticos(filas, repetidos)
+    datos = csvac.ConjuntoDatos(datos[0], datos[1:])
+    t0 = time.time()
+    motivo = csvac.comprobar_ficheros(CFG_SINTETICA, datos)
+    t = time.time() - t0
+    return {
+        "filas": filas,
+        "segundos": t,
+        "filasPorSegundo": filas / t if t else None,
+        "rssMaxKiB": rss_max_kib(),
+        "repeticiones": motivo.count(u"\n") if motivo else 0,
+    }
+
+def bench_duplicados (tamanos=(10000, 100000, 1000000), repetidos=0.001):
+    """Mide la detección de nombres repetidos para cada número de filas
+    de [tamanos].
+    """
+    resultados = [en_subproceso(["duplicados-n", str(n), str(repetidos)])
+                  for n in tamanos]
+    for r in resultados:
+        print u"{:>9} filas: {:8.3f} s, {:>10.0f} filas/s, RSS máximo " \
+              u"{:8d} KiB, {} repeticiones".format(
+            r["filas"], r["segundos"], r["filasPorSegundo"] or 0,
+            r["rssMaxKiB"], r["repeticiones"]).encode('utf-8')
+    return resultados
+
+#### Comprobaciones previas ###########################################
+
+#  Textos con los que se rellenan los campos sintéticos, con caracteres
+#  de varios alfabetos, comas, comillas y saltos de línea, como los de
+#  los ficheros de CSV reales.
+#
+TEXTOS = (
+    u"Fotografía de la ermita de San Úrbez, año {}",
+    u"Vista aérea: «Castillo de Peñíscola», n.º {}",
+    u"Ídolo de Ὀδυσσεύς; colección \"Ánfora\", {}",
+    u"東京の風景 {}, con comas, y más comas",
+    u"Línea 1 del registro {}\nLínea 2, continuación",
+)
+
+#  La constante [SUBDIRECTORIOS] es el número de subdirectorios entre
+#  los que se reparten los ficheros multimedia sintéticos.
+#
+SUBDIRECTORIOS = 100
+
+def generar_csv (ruta, filas, columnas=8, repetidos=0.0):
+    """Escribe en [ruta] un fichero de CSV sintético, en UTF-8, con
+    [filas] filas de información y [columnas] campos (al menos 4): el
+    nombre local de cada fichero, su nombre en Commons, CAMPO1, CAMPO2
+    (los de la plantilla de descripción de ejemplo de csvcfg) y campos de
+    texto adicionales.
+    
+    Aproximadamente una proporción [repetidos] de las filas repite el
+    nombre de destino de la fila anterior (con distinto uso de
+    mayúsculas y guiones bajos).
+    """
+    columnas = max(columnas, 4)
+    cada = int(1 / repetidos) if repetidos else 0
+    campos = [CFG_SINTETICA["campoNombres0"], CFG_SINTETICA["campoNombresC"],
+              u"CAMPO1", u"CAMPO2"]
+    campos += [u"Campo {}".format(n) for n in range(5, columnas + 1)]
+    with open(ruta, 'wb') as f:
+        escritor = csv.writer(f)
+        escritor.writerow([campo.encode('utf-8') for campo in campos])
+        for n in xrange(1, filas + 1):
+            m = n - 1 if cada and n > 1 and n % cada == 0 else n
+            fila = [u"d{:02d}/f{:07d}.jpg".format(n % SUBDIRECTORIOS, n),
+                    u"archivo_ñ_{:07d}.jpg".format(m) if m != n
+                    else u"Archivo ñ {:07d}.jpg".format(n)]
+            fila += [TEXTOS[(n + c) % len(TEXTOS)].format(n)
+                     for c in range(2, columnas)]
+            escritor.writerow([valor.encode('utf-8') for valor in fila])
+
+def generar_ficheros (directorio, filas):
+    """Crea en [directorio] los ficheros multimedia (vacíos) de las
+    [filas] filas de un fichero de CSV de generar_csv.
+    """
+    for d in range(SUBDIRECTORIOS):
+        subdirectorio = os.path.join(directorio, "d{:02d}".format(d))
+        if not os.path.isdir(subdirectorio):
+            os.makedirs(subdirectorio)
+    for n in xrange(1, filas + 1):
+        open(os.path.join(directorio, "d{:02d}".format(n % SUBDIRECTORIOS),
+                          "f{:07d}.jpg".format(n)), 'wb').close()
+
+#  La constante [REGLAS_SINTETICAS] recoge las expresiones regulares de
+#  los campos de los ficheros de CSV de generar_csv, que todos sus
+#  valores cumplen, para medir la validación de comprobar_campos. Los
+#  campos que no aparecen en ella siguen la regla de "".
+#
+REGLAS_SINTETICAS = {
+    CFG_SINTETICA["campoNombres0"]: ur"\Ad\d\d/f\d{7}\.jpg\Z",
+    CFG_SINTETICA["campoNombresC"]:
+        ur"(?i)\Aarchivo[ _]ñ[ _]\d{7}\.jpg\Z",
+    u"": ur"\A[^<>{}\[\]|]+\Z",
+}
+
+def regex_sintetica (campo):
+    """Sustituye a csvcfg.regex para los ficheros de CSV de
+    generar_csv (véase REGLAS_SINTETICAS).
+    """
+    return REGLAS_SINTETICAS.get(campo, REGLAS_SINTETICAS[u""])
+
+def preparar_sinteticos (directorio, filas, columnas, repetidos):
+    """Genera en un subdirectorio de [directorio] el fichero de CSV y
+    los ficheros multimedia sintéticos de los parámetros indicados, si
+    no se generaron ya en una ejecución anterior, y devuelve la
+    configuración con la que usarlos.
+    """
+    nombre = "f{}-c{}-r{}".format(filas, columnas, repetidos)
+    cfg = dict(CFG_SINTETICA,
+               nombreDir=os.path.join(directorio, nombre).decode('utf-8'),
+               tamDescrMax=2097152)
+    completo = os.path.join(cfg["nombreDir"], ".completo")
+    if not os.path.isfile(completo):
+        if os.path.isdir(cfg["nombreDir"]):
+            shutil.rmtree(cfg["nombreDir"])
+        os.makedirs(cfg["nombreDir"])
+        generar_csv(os.path.join(cfg["nombreDir"], cfg["nombreCsv"]),
+                    filas, columnas, repetidos)
+        generar_ficheros(cfg["nombreDir"], filas)
+        open(completo, 'w').close()
+    return cfg
+
+ETAPAS_PREVIAS = ("leer_csv", "comprobar_campos", "comprobar_ficheros",
+                  "inventario", "validar", "comprobar_todo")
+
+def medir_previa (directorio, filas, columnas, repetidos, etapa):
+    """Mide la etapa [etapa] de las comprobaciones previas sobre los
+    datos sintéticos de los parámetros indicados, en modo de simulación.
+    
+    La etapa "leer_csv" se mide sin índice de filas previo; las demás,
+    sobre un conjunto de datos ya leído. La etapa "inventario" es la
+    comprobación de la existencia de los ficheros (ficheros_ausentes),
+    que comprobar_ficheros omite en modo de simulación, y la etapa
+    "validar", la validación de los valores de todas las filas con las
+    expresiones regulares (Validador), que comprobar_todo incluye. Los
+    valores se validan con las reglas de REGLAS_SINTETICAS, que todos
+    cumplen.
+    """
+    import abilog
+    import csvac
+    import csvcfg
+    csvcfg.regex = regex_sintetica
+    csvac.SIMULACION = True
+    abilog.config(os.devnull)
+    cfg = preparar_sinteticos(directorio, filas, columnas, repetidos)
+    ruta = os.path.join(cfg["nombreDir"], cfg["nombreCsv"])
+    if etapa == "leer_csv" and os.path.isfile(ruta + ".NOBORRAR.indice"):
+        os.remove(ruta + ".NOBORRAR.indice")
+    t0 = time.time()
+    datos = csvac.leer_csv(cfg)
+    t = time.time() - t0
+    rssLectura = rss_max_kib()
+    resultado = None
+    if etapa != "leer_csv":
+        t0 = time.time()
+        if etapa == "comprobar_campos":
+            resultado = csvac.comprobar_campos(cfg, datos)
+        elif etapa == "comprobar_ficheros":
+            resultado = csvac.comprobar_ficheros(cfg, datos)
+        elif etapa == "inventario":
+            ncampo = csvac.num_campo(datos, cfg["campoNombres0"])
+            resultado = len(csvac.ficheros_ausentes(
+                cfg, [fila[ncampo] for fila in datos.filas])) or None
+        elif etapa == "validar":
+            resultado = csvac.Validador(datos[0]).validar(datos)
+        else:
+            resultado = csvac.comprobar_todo(cfg, datos)
+        t = time.time() - t0
+    return {
+        "filas": filas,
+        "etapa": etapa,
+        "segundos": t,
+        "filasPorSegundo": filas / t if t else None,
+        "rssLecturaKiB": rssLectura,
+        "rssMaxKiB": rss_max_kib(),
+        "correcto": resultado is None,
+    }
+
+def bench_previas (tamanos=(10000, 100000, 1000000), columnas=8,
+                   repetidos=0.0, directorio=None, base=None):
+    """Mide cada etapa de las comprobaciones previas para cada número
+    de filas de [tamanos], cada una en un proceso independiente.
+    
+    Los datos sintéticos se generan en [directorio] (por defecto, uno
+    temporal que se elimina al terminar), donde pueden reutilizarse en
+    ejecuciones posteriores. Si se indican los resultados [base] de una
+    ejecución anterior, se muestra la variación de tiempo respecto a
+    ellos.
+    """
+    temporal = directorio is None
+    if temporal:
+        directorio = tempfile.mkdtemp(prefix="csvbench-")
+    try:
+        resultados = []
+        for n in tamanos:
+            # Los datos se generan antes de medir nada.
+            preparar_sinteticos(directorio, n, columnas, repetidos)
+            for etapa in ETAPAS_PREVIAS:
+                resultados.append(en_subproceso(
+                    ["previa-n", directorio, str(n), str(columnas),
+                     str(repetidos), etapa]))
+    finally:
+        if temporal:
+            shutil.rmtree(directorio)
+    anteriores = dict(((r["filas"], r["etapa"]), r) for r in base or ())
+    for r in resultados:
+        linea = u"{:>9} filas, {:<18}: {:8.3f} s, RSS máximo {:8d} KiB".format(
+            r["filas"], r["etapa"], r["segundos"], r["rssMaxKiB"])
+        if not r["correcto"]:
+            linea += u", NO SUPERADA"
+        anterior = anteriores.get((r["filas"], r["etapa"]))
+        if anterior and anterior["segundos"]:
+            linea += u", {:+.1f} % respecto a la base".format(
+                (r["segundos"] / anterior["segundos"] - 1) * 100)
+        print linea.encode('utf-8')
+    return resultados
+
+#### Subidas por trozos ###############################################
+
+def medir_trozos (url, fichero, tamTrozo):
+    """Sube [fichero] por trozos de [tamTrozo] bytes a la API simulada
+    de [url] con csvac.subir_api, repitiendo la subida (que se reanuda
+    desde el último trozo aceptado) hasta que se verifica, y devuelve las
+    medidas obtenidas. El SHA-1 se calcula antes y no se mide.
+    """
+    import abilog
+    import abimetricas
+    import csvac
+    abilog.config(os.devnull)
+    directorio, f = os.path.split(os.path.abspath(fichero))
+    directorio = directorio.decode('utf-8')
+    f = f.decode('utf-8')
+    cfg = dict(csvac.CFG_POR_DEFECTO, nombreDir=directorio,
+               nombreCsv=u"trozos.csv", urlApi=url, motorSubida="api",
+               usuarioApi=u"Prueba@csvac", contrasenaApi=u"x",
+               tamTrozo=tamTrozo, umbralTrozos=0)
+    error = csvac.login_api(cfg)
+    if error:
+        raise RuntimeError(error)
+    sha1 = csvac.sha1_ruta(fichero)
+    tam = os.path.getsize(fichero)
+    intentos = 0
+    t0 = time.time()
+    comprobacion = True
+    while comprobacion and intentos < 20:
+        intentos += 1
+        csvac.subir_api(cfg, f, f, u"Prueba de subida por trozos.")
+        comprobacion = csvac.comprobar_subida(cfg, f, sha1)
+    t = time.time() - t0
+    if os.path.isfile(csvac.ruta_trozos(cfg)):
+        os.remove(csvac.ruta_trozos(cfg))
+    contadores = abimetricas.METRICAS.resumen()["contadores"]
+    return {
+        "bytes": tam,
+        "tamTrozo": tamTrozo,
+        "segundos": t,
+        "MBs": tam / 1e6 / t if t else None,
+        "intentos": intentos,
+        "reintentosTrozo": contadores.get("reintentosTrozo", 0),
+        "rssMaxKiB": rss_max_kib(),
+        "correcto": comprobacion is None,
+    }
+
+def bench_trozos (tamanos=(1024, 2048, 4096), tamTrozo=5242880,
+                  errores=0.0, latencia=0.0):
+    """Sube por trozos ficheros de cada tamaño de [tamanos] (en MiB) a
+    una API simulada local, con una proporción [errores] de peticiones
+    fallidas y [latencia] segundos más por petición, cada uno desde un
+    proceso independiente.
+    
+    Los ficheros son dispersos (sin bloques en disco), para no depender
+    de la velocidad ni del espacio del disco. Se muestra cuántos bytes
+    ha recibido el servidor respecto al tamaño del fichero: sin
+    reanudación, cada fallo obligaría a enviar de nuevo todo el fichero.
+    """
+    import simcommons
+    commons = simcommons.Commons(latencia, errores)
+    servidor = simcommons.iniciar_servidor(commons)
+    directorio = tempfile.mkdtemp(prefix="csvbench-")
+    try:
+        resultados = []
+        for mib in tamanos:
+            fichero = os.path.join(directorio, "f{}.bin".format(mib))
+            with open(fichero, 'wb') as f:
+                # El último byte distingue el SHA-1 de cada fichero.
+                f.seek(mib * 1024 * 1024 - 1)
+                f.write("\x01")
+            recibidos = commons.estadisticas["bytesRecibidos"]
+            r = en_subproceso(["trozos-n", servidor.url, fichero,
+                               str(tamTrozo)])
+            r["bytesRecibidos"] = (commons.estadisticas["bytesRecibidos"] -
+                                   recibidos)
+            resultados.append(r)
+            os.remove(fichero)
+    finally:
+        servidor.shutdown()
+        shutil.rmtree(directorio)
+    for r in resultados:
+        print (u"{:>6} MiB: {:8.1f} MB/s, {} intentos, {} trozos "
+               u"repetidos, {:.3f} veces el fichero enviado, RSS máximo "
+               u"{:8d} KiB{}".format(
+                   r["bytes"] // (1024 * 1024), r["MBs"] or 0,
+                   r["intentos"], r["reintentosTrozo"],
+                   float(r["bytesRecibidos"]) / r["bytes"],
+                   r["rssMaxKiB"],
+                   u"" if r["correcto"] else u", NO VERIFICADO")
+               ).encode('utf-8')
+    return resultados
+
+########################################################################
+
+def main ():
+    parser = argparse.ArgumentParser(description=u"Pruebas de rendimiento "
+                                                 u"de CSV a Commons.")
+    sub = parser.add_subparsers(dest="prueba")
+    p = sub.add_parser("sha1")
+    p.add_argument("--mib", type=int, default=1024)
+    p.add_argument("--fichero", default=None)
+    p.add_argument("--json", default=None)
+    p = sub.add_parser("sha1-modo")
+    p.add_argument("fichero")
+    p.add_argument("modo")
+    p = sub.add_parser("duplicados")
+    p.add_argument("--filas", type=int, nargs="+",
+                   default=[10000, 100000, 1000000])
+    p.add_argument("--repetidos", type=float, default=0.001)
+    p.add_argument("--json", default=None)
+    p = sub.add_parser("duplicados-n")
+    p.add_argument("filas", type=int)
+    p.add_argument("repetidos", type=float)
+    p = sub.add_parser("previas")
+    p.add_argument("--filas", type=int, nargs="+",
+                   default=[10000, 100000, 1000000])
+    p.add_argument("--columnas", type=int, default=8)
+    p.add_argument("--repetidos", type=float, default=0.0)
+    p.add_argument("--dir", default=None)
+    p.add_argument("--json", default=None)
+    p.add_argument("--base", default=None)
+    p = sub.add_parser("previa-n")
+    p.add_argument("dir")
+    p.add_argument("filas", type=int)
+    p.add_argument("columnas", type=int)
+    p.add_argument("repetidos", type=float)
+    p.add_argument("etapa", choices=ETAPAS_PREVIAS)
+    p = sub.add_parser("trozos")
+    p.add_argument("--mib", type=int, nargs="+", default=[1024, 2048, 4096])
+    p.add_argument("--trozo", type=int, default=5242880)
+    p.add_argument("--errores", type=float, default=0.0)
+    p.add_argument("--latencia", type=float, default=0.0)
+    p.add_argument("--json", default=None)
+    p = sub.add_parser("trozos-n")
+    p.add_argument("url")
+    p.add_argument("fichero")
+    p.add_argument("trozo", type=int)
+    args = parser.parse_args()
+    if args.prueba == "sha1-modo":
+        print json.dumps(medir_sha1(args.fichero, args.modo))
+        return
+    elif args.prueba == "duplicados-n":
+        print json.dumps(medir_duplicados(args.filas, args.repetidos))
+        return
+    elif args.prueba == "previa-n":
+        print json.dumps(medir_previa(args.dir, args.filas, args.columnas,
+                                      args.repetidos, args.etapa))
+        return
+    elif args.prueba == "trozos-n":
+        print json.dumps(medir_trozos(args.url, args.fichero, args.trozo))
+        return
+    elif args.prueba == "duplicados":
+        resultados = bench_duplicados(args.filas, args.repetidos)
+    elif args.prueba == "previas":
+        base = None
+        if args.base:
+            with open(args.base) as f:
+                base = json.load(f)
+        resultados = bench_previas(args.filas, args.columnas,
+                                   args.repetidos, args.dir, base)
+    elif args.prueba == "trozos":
+        resultados = bench_trozos(args.mib, args.trozo, args.errores,
+                                  args.latencia)
+    else:
+        resultados = bench_sha1(args.mib, args.fichero)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(resultados, f, indent=2)
+
+if __name__ == '__main__':
+    main()
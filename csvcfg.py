@@ -40,8 +40,8 @@ def regex (campo):
         #
         "NOMBREDELCAMPO": "\A[Rr]egex[A-Z]$",
     }
-    if regla in dictReglas:
-        return dictReglas[regla]
+    if campo in dictReglas:
+        return dictReglas[campo]
     else:
         return ""
 
@@ -49,16 +49,30 @@ def regex (campo):
 ##           DESCRIPCIÓN DE ARCHIVOS EN WIKIMEDIA COMMONS             ##
 ########################################################################
 
+def plantilla ():
+    """Devuelve la plantilla de la descripción que se incluirá junto a
+    cada archivo que subir a Wikimedia Commons.
+    
+    El valor de cada campo de la fila se indica con %(NOMBREDELCAMPO)s,
+    y el signo de porcentaje, con %%. La plantilla se compila una sola
+    vez para todas las filas.
+    """
+    return u"""Descripción de prueba. {{testing with
+|1=%(CAMPO1)s
+|2=%(CAMPO2)s
+}}
+That's all."""
+
 def descripcion (datos, fila):
     """Devuelve la descripción que se incluirá finalmente junto al
     archivo que subir a Wikimedia Commons tomando la información de la
     fila [fila] del conjunto de datos [datos].
+    
+    Por defecto, es la plantilla de plantilla() con los valores de la
+    fila. Si se cambia esta función para construir la descripción de
+    otra manera, elimínese la función plantilla().
     """
-    return u"Descripción de prueba. {{testing with\n|1=%s\n|2=%s\n}}\nThat's all." \
-           % csvac.valores(datos,fila,[\
-                                    u"CAMPO1",\
-                                    u"CAMPO2",\
-                                   ])
+    return csvac.plantilla_compilada(datos, plantilla).rellenar(datos[fila])
 
 ########################################################################
 ##
@@ -87,6 +101,8 @@ def cte ():
         "tDescanso": 30,
         
         # Segundos mínimos de espera entre una subida y la siguiente.
+        # Dentro de este límite, el ritmo de subida se adapta a las
+        # respuestas del servidor.
         "tEspera": 1,
         
         # Número de ficheros que subir en la tanda inicial.
@@ -100,6 +116,123 @@ def cte ():
         # ficheros que tratar en cada tanda.
         # Número real mayor o igual que 1.
         "crecimTanda": 1.5,
+        
+        # Dirección de la API de Wikimedia Commons a la que se dirigen
+        # las comprobaciones.
+        "urlApi": u"https://commons.wikimedia.org/w/api.php",
+        
+        # Segundos máximos de espera por la red en cada petición a la
+        # API. Las conexiones se mantienen abiertas y se reutilizan.
+        "tConexion": 30,
+        
+        # Número de ficheros que subir y comprobar en paralelo. Los
+        # ficheros que el operador debe aprobar en cada tanda se suben
+        # siempre de uno en uno.
+        "hilos": 1,
+        
+        # Número máximo de subidas por segundo. El ritmo de subida se
+        # reduce automáticamente cuando el servidor lo pide; con
+        # motorSubida "pywikibot", solo en las comprobaciones, pues de
+        # las esperas pedidas durante las subidas se ocupa Pywikibot.
+        "tasaMax": 1,
+        
+        # Segundos máximos de retraso de replicación de los servidores
+        # de Wikimedia Commons con los que se siguen haciendo consultas
+        # (parámetro maxlag de la API).
+        "maxlag": 5,
+        
+        # Número de filas cuya descripción y SHA-1 se preparan en
+        # segundo plano por delante de la fila que se está subiendo.
+        "adelanto": 4,
+        
+        # Antes de empezar, se omiten los ficheros que ya están en
+        # Wikimedia Commons con su nombre de destino. Si este valor es
+        # True, se omiten también los que estén con cualquier otro
+        # nombre, a costa de una consulta a la API por fichero.
+        "buscarSha1": False,
+        
+        # Número de copias de seguridad del fichero de CSV que se
+        # conservan; las más antiguas se eliminan, avisando de cada una.
+        # Solo se hace una copia nueva si el fichero ha cambiado desde
+        # la última. Con 0, se conservan todas.
+        "copiasMax": 0,
+        
+        # Tamaño máximo en bytes de la descripción de cada fichero. Antes
+        # de empezar la subida, se comprueba que ninguna lo supere.
+        "tamDescrMax": 2097152,
+        
+        # Directorio de la instalación de Pywikibot core. Si es None,
+        # se toma el de la variable de entorno CSVAC_PWB o, si tampoco
+        # se indica, se busca en las proximidades del directorio actual
+        # (la primera vez; después se recuerda).
+        "dirPwb": None,
+        
+        # Días durante los que Pywikibot reutiliza la información del
+        # sitio y de los parámetros de la API obtenida en ejecuciones
+        # anteriores, en lugar de volver a consultarla al empezar.
+        "diasCacheApi": 30,
+        
+        # Si es True, el fichero de registros se escribe en segundo
+        # plano, a través de un búfer, sin detener la subida.
+        "registroAsincrono": True,
+        
+        # Si es True, el fichero de registros se escribe en JSON, un
+        # registro por línea, para su tratamiento automático.
+        "registroJson": False,
+        
+        # Segundos entre exportaciones de los tiempos de cada etapa y de
+        # los recuentos del proceso de subida, en los ficheros
+        # [nombreCsv].metricas.json y [nombreCsv].metricas.prom.
+        "tMetricas": 60,
+        
+        # Medio de subida de los ficheros: "pywikibot", con
+        # Pywikibot core, o "api", directamente por la API de [urlApi]
+        # con una contraseña de bot (Especial:BotPasswords).
+        "motorSubida": "pywikibot",
+        
+        # Nombre de usuario de la contraseña de bot, de la forma
+        # "Usuario@NombreDelBot", para subir por la API.
+        "usuarioApi": None,
+        
+        # Contraseña de bot para subir por la API. Si es None, se toma
+        # de la variable de entorno CSVAC_CONTRASENA o se pregunta.
+        "contrasenaApi": None,
+        
+        # Segundos de pausa entre tandas cuando no hay operador que
+        # revise las subidas (modo desatendido); 0 para dividir la
+        # subida en tandas sin pausa entre ellas, y None para no
+        # dividirla en tandas.
+        "pausaTanda": None,
+        
+        # Segundos entre líneas de progreso en el modo desatendido
+        # (opción --desatendido).
+        "tProgreso": 10,
+        
+        # Veces que se reintenta sin preguntar cada subida fallida en el
+        # modo desatendido.
+        "reintentos": 3,
+        
+        # Los ficheros de [umbralTrozos] bytes o más se suben por trozos
+        # de [tamTrozo] bytes. Con la API, si la subida falla o se
+        # interrumpe, se reanuda desde el último trozo aceptado. Con
+        # tamTrozo 0 no se sube nunca por trozos.
+        "tamTrozo": 5242880,
+        "umbralTrozos": 52428800,
+        
+        # Si es True, los ficheros se suben en segundo plano al alijo
+        # (stash) del servidor por delante de la fila en curso, mientras
+        # el operador revisa las anteriores, y cada fila aprobada solo
+        # se publica desde el alijo. Requiere motorSubida "api".
+        "alijoPrevio": False,
+        
+        # Segundos que dura el arriendo de una fila en el modo de nodo
+        # (opción --arriendos) si el nodo que la tomó deja de
+        # renovarlo; pasado ese tiempo, la toma otro nodo. Debe ser
+        # mucho mayor que el desfase entre los relojes de las máquinas.
+        "tArriendo": 300,
+        
+        # Filas que un nodo toma de una vez de la tabla de arriendos.
+        "loteArriendo": 16,
     }
     return dictCte
         
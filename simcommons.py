@@ -0,0 +1,684 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+#    Servidor local que imita la API de MediaWiki de Wikimedia Commons
+#    (inicio de sesión, subidas, también por trozos, alijo, allimages por
+#    SHA-1 e imageinfo),
+#    con latencia, errores y limitación de ritmo configurables, y banco
+#    de pruebas que ejecuta el proceso de subida completo contra él.
+#
+#    Uso:
+#
+#        python simcommons.py servidor [--puerto N] [--latencia S] ...
+#        python simcommons.py prueba [--filas N] [--kib N] [--hilos N]
+#                                    [--tasaMax N] [--latencia S]
+#                                    [--errores P] [--saturacion P]
+#                                    [--tasaServidor N] [--alijo]
+#                                    [--procesos N] [--nodos N]
+#                                    [--matar] [--tArriendo S]
+#                                    [--json RUTA]
+#
+#   Copyright (C) 2015, David Abián <da [at] davidabian.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import BaseHTTPServer
+import cgi
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import signal
+import SocketServer
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import urlparse
+
+#### Servidor ##########################################################
+
+def titulo_fichero (nombre):
+    """Devuelve el título «File:Nombre» del fichero de nombre [nombre],
+    normalizado como en MediaWiki.
+    """
+    if nombre.startswith(u"File:"):
+        nombre = nombre[len(u"File:"):]
+    nombre = u" ".join(nombre.replace(u"_", u" ").split())
+    return u"File:{}{}".format(nombre[:1].upper(), nombre[1:])
+
+class Commons (object):
+    """Estado del Wikimedia Commons simulado y parámetros de su
+    comportamiento.
+
+    Cada petición tarda [latencia] segundos más; una proporción
+    [errores] de ellas falla con un error 500 (salvo las de comprobación
+    de la conexión, inicio de sesión y fichas, que csvac no reintenta),
+    y otra [saturacion] se rechaza como ratelimited, pidiendo esperar
+    [espera] segundos. Si se
+    indica [tasa], las subidas que superen ese número por segundo se
+    rechazan también como ratelimited.
+
+    Del contenido de los ficheros solo se conservan el SHA-1 y el
+    tamaño, de modo que pueden recibirse ficheros de varios GB.
+    """
+
+    def __init__ (self, latencia=0.0, errores=0.0, saturacion=0.0,
+                  tasa=None, espera=1):
+        self.latencia = latencia
+        self.errores = errores
+        self.saturacion = saturacion
+        self.tasa = tasa
+        self.espera = espera
+        self.ficheros = {}
+        self.porSha1 = {}
+        self.alijo = {}
+        self.enCurso = {}
+        self.sesiones = {}
+        self.estadisticas = {"peticiones": 0, "subidas": 0, "alijadas": 0,
+                             "trozos": 0, "bytesRecibidos": 0,
+                             "advertencias": 0, "errores": 0,
+                             "saturaciones": 0}
+        self.fichas = 1.0
+        self.tFichas = time.time()
+        self.cerrojo = threading.Lock()
+
+    def contar (self, clave, n=1):
+        with self.cerrojo:
+            self.estadisticas[clave] += n
+
+    def admitir_subida (self):
+        """Indica si la tasa de subidas permite una más ahora."""
+        if not self.tasa:
+            return True
+        with self.cerrojo:
+            ahora = time.time()
+            self.fichas = min(1.0, self.fichas +
+                              (ahora - self.tFichas) * self.tasa)
+            self.tFichas = ahora
+            if self.fichas >= 1:
+                self.fichas -= 1
+                return True
+            return False
+
+    def publicar (self, nombre, sha1, tamano, descr):
+        """Publica el fichero de SHA-1 [sha1] y [tamano] bytes como
+        [nombre] y devuelve su información.
+        """
+        titulo = titulo_fichero(nombre)
+        info = {"sha1": sha1, "size": tamano, "descr": descr}
+        with self.cerrojo:
+            self.ficheros[titulo] = info
+            self.porSha1.setdefault(info["sha1"], titulo)
+            self.estadisticas["subidas"] += 1
+        return titulo, info
+
+    def advertencias (self, nombre, sha1):
+        titulo = titulo_fichero(nombre)
+        advertencias = {}
+        with self.cerrojo:
+            if titulo in self.ficheros:
+                advertencias["exists"] = titulo[len(u"File:"):]
+            duplicado = self.porSha1.get(sha1)
+            if duplicado:
+                advertencias["duplicate"] = [duplicado[len(u"File:"):]]
+        return advertencias
+
+class ManejadorApi (BaseHTTPServer.BaseHTTPRequestHandler):
+    """Atiende las peticiones a la API simulada en cualquier ruta."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message (self, formato, *args):
+        pass
+
+    def responder (self, estado, contenido, cabeceras=None):
+        if not isinstance(contenido, str):
+            contenido = json.dumps(contenido)
+        self.send_response(estado)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(contenido)))
+        for k, v in (cabeceras or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(contenido)
+
+    def parametros (self):
+        """Devuelve los parámetros de la petición, en unicode, y los
+        ficheros enviados ({nombre: contenido}).
+        """
+        params = dict((k, v[-1].decode('utf-8')) for k, v in
+                      urlparse.parse_qs(urlparse.urlsplit(self.path).query)
+                      .items())
+        ficheros = {}
+        if self.command == "POST":
+            tipo = self.headers.getheader("content-type", "")
+            if tipo.startswith("multipart/form-data"):
+                formulario = cgi.FieldStorage(
+                    fp=self.rfile, headers=self.headers,
+                    environ={"REQUEST_METHOD": "POST",
+                             "CONTENT_TYPE": tipo})
+                for k in formulario.keys():
+                    campo = formulario[k]
+                    if campo.filename is not None:
+                        ficheros[k] = campo.value
+                    else:
+                        params[k] = campo.value.decode('utf-8')
+            else:
+                longitud = int(self.headers.getheader("content-length", 0))
+                params.update((k, v[-1].decode('utf-8')) for k, v in
+                              urlparse.parse_qs(self.rfile.read(longitud))
+                              .items())
+        return params, ficheros
+
+    def usuario (self):
+        cookies = self.headers.getheader("cookie", "")
+        for cookie in cookies.split(";"):
+            nombre, _, valor = cookie.strip().partition("=")
+            if nombre == "simsesion":
+                return self.server.commons.sesiones.get(valor)
+        return None
+
+    def do_GET (self):
+        self.atender()
+
+    def do_POST (self):
+        self.atender()
+
+    def atender (self):
+        commons = self.server.commons
+        params, ficheros = self.parametros()
+        commons.contar("peticiones")
+        commons.contar("bytesRecibidos",
+                       int(self.headers.getheader("content-length", 0)))
+        if commons.latencia:
+            time.sleep(commons.latencia)
+        accion = params.get("action")
+        if (accion != "login" and
+            params.get("meta") not in ("siteinfo", "tokens") and
+            random.random() < commons.errores):
+            commons.contar("errores")
+            self.responder(500, "<html>Error interno simulado</html>")
+            return
+        if (random.random() < commons.saturacion or
+            (accion == "upload" and not commons.admitir_subida())):
+            commons.contar("saturaciones")
+            self.responder(200, {"error": {"code": "ratelimited",
+                                           "info": "Rate limit exceeded"}},
+                           {"MediaWiki-API-Error": "ratelimited",
+                            "Retry-After": str(commons.espera)})
+            return
+        if accion == "login":
+            self.login(params)
+        elif accion == "upload":
+            self.upload(params, ficheros)
+        elif accion == "query":
+            self.query(params)
+        else:
+            self.error("badvalue", u"Acción desconocida")
+
+    def error (self, codigo, info):
+        self.responder(200, {"error": {"code": codigo, "info": info}},
+                       {"MediaWiki-API-Error": codigo})
+
+    def login (self, params):
+        if params.get("lgtoken") != "L+\\":
+            self.responder(200, {"login": {"result": "WrongToken"}})
+            return
+        clave = os.urandom(8).encode('hex')
+        self.server.commons.sesiones[clave] = params.get("lgname")
+        self.responder(200, {"login": {"result": "Success",
+                                       "lgusername": params.get("lgname")}},
+                       {"Set-Cookie": "simsesion={}; Path=/".format(clave)})
+
+    def query (self, params):
+        commons = self.server.commons
+        r = {}
+        meta = params.get("meta", "").split("|")
+        if "siteinfo" in meta:
+            r["general"] = {"sitename": "SimCommons",
+                            "maxuploadsize": 4 * 1024 ** 3}
+        if "tokens" in meta:
+            if params.get("type") == "login":
+                r["tokens"] = {"logintoken": "L+\\"}
+            elif self.usuario():
+                r["tokens"] = {"csrftoken": "C+\\"}
+            else:
+                r["tokens"] = {"csrftoken": "+\\"}
+        if "userinfo" in meta:
+            usuario = self.usuario()
+            r["userinfo"] = {"name": usuario} if usuario else \
+                            {"name": "127.0.0.1", "anon": ""}
+        if params.get("list") == "allimages":
+            titulo = commons.porSha1.get(params.get("aisha1"))
+            r["allimages"] = [] if titulo is None else \
+                [{"name": titulo[len(u"File:"):],
+                  "sha1": commons.ficheros[titulo]["sha1"]}]
+        if params.get("prop") == "imageinfo":
+            r["pages"] = {}
+            r["normalized"] = []
+            for n, titulo in enumerate(params.get("titles", "").split(u"|")):
+                normalizado = titulo_fichero(titulo)
+                if normalizado != titulo:
+                    r["normalized"].append({"from": titulo,
+                                            "to": normalizado})
+                info = commons.ficheros.get(normalizado)
+                if info is None:
+                    r["pages"][str(-1 - n)] = {"title": normalizado,
+                                               "missing": ""}
+                else:
+                    r["pages"][str(n + 1)] = {
+                        "title": normalizado,
+                        "imageinfo": [{"sha1": info["sha1"],
+                                       "size": info["size"]}]}
+        self.responder(200, {"batchcomplete": "", "query": r})
+
+    def upload (self, params, ficheros):
+        commons = self.server.commons
+        if params.get("token") != "C+\\" or not self.usuario():
+            self.error("badtoken", u"Invalid CSRF token.")
+            return
+        nombre = params.get("filename")
+        if "chunk" in ficheros:
+            self.trozo(params, ficheros["chunk"])
+            return
+        if "filekey" in params and "file" not in ficheros:
+            alijado = commons.alijo.get(params["filekey"])
+            if alijado is None:
+                self.error("stashfailed", u"Fichero no encontrado en el "
+                                          u"alijo.")
+                return
+            sha1, tamano = alijado
+        elif "file" in ficheros:
+            sha1 = hashlib.sha1(ficheros["file"]).hexdigest()
+            tamano = len(ficheros["file"])
+        else:
+            self.error("missingparam", u"Falta el fichero.")
+            return
+        if params.get("stash"):
+            clave = os.urandom(8).encode('hex')
+            commons.alijo[clave] = (sha1, tamano)
+            commons.contar("alijadas")
+            self.responder(200, {"upload": {"result": "Success",
+                                            "filekey": clave}})
+            return
+        advertencias = {} if params.get("ignorewarnings") else \
+                       commons.advertencias(nombre, sha1)
+        if advertencias:
+            commons.contar("advertencias")
+            self.responder(200, {"upload": {"result": "Warning",
+                                            "warnings": advertencias}})
+            return
+        commons.alijo.pop(params.get("filekey"), None)
+        titulo, info = commons.publicar(nombre, sha1, tamano,
+                                        params.get("text"))
+        self.responder(200, {"upload": {
+            "result": "Success", "filename": titulo[len(u"File:"):],
+            "imageinfo": {"sha1": info["sha1"], "size": info["size"]}}})
+
+    def trozo (self, params, contenido):
+        """Recibe un trozo de una subida por trozos. Del primero
+        (offset 0, sin filekey) resulta una clave nueva; los siguientes
+        deben indicarla y continuar donde terminó el anterior. Al
+        recibir el último, el fichero pasa al alijo con esa clave.
+        """
+        commons = self.server.commons
+        offset = int(params.get("offset", 0))
+        tamano = int(params.get("filesize", 0))
+        error = None
+        with commons.cerrojo:
+            clave = params.get("filekey")
+            if clave is None and offset == 0:
+                clave = os.urandom(8).encode('hex')
+                commons.enCurso[clave] = {"sha1": hashlib.sha1(),
+                                          "offset": 0, "tamano": tamano}
+            subida = commons.enCurso.get(clave)
+            if subida is None:
+                error = u"Fichero no encontrado en el alijo."
+            elif offset != subida["offset"] or \
+                 offset + len(contenido) > subida["tamano"]:
+                error = u"Desplazamiento del trozo no válido."
+            else:
+                subida["sha1"].update(contenido)
+                subida["offset"] += len(contenido)
+                commons.estadisticas["trozos"] += 1
+                if subida["offset"] == subida["tamano"]:
+                    del commons.enCurso[clave]
+                    commons.alijo[clave] = (subida["sha1"].hexdigest(),
+                                            subida["tamano"])
+                    commons.estadisticas["alijadas"] += 1
+        if error:
+            self.error("stashfailed", error)
+        elif clave in commons.enCurso:
+            self.responder(200, {"upload": {"result": "Continue",
+                                            "offset": subida["offset"],
+                                            "filekey": clave}})
+        else:
+            self.responder(200, {"upload": {"result": "Success",
+                                            "filekey": clave}})
+
+class Servidor (SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+def iniciar_servidor (commons, puerto=0):
+    """Inicia en segundo plano el servidor de la API simulada [commons]
+    en el puerto [puerto] de 127.0.0.1 (uno libre si es 0) y lo
+    devuelve. Su dirección es servidor.url.
+    """
+    servidor = Servidor(("127.0.0.1", puerto), ManejadorApi)
+    servidor.commons = commons
+    servidor.url = u"http://127.0.0.1:{}/w/api.php".format(
+        servidor.server_address[1])
+    hilo = threading.Thread(target=servidor.serve_forever)
+    hilo.daemon = True
+    hilo.start()
+    return servidor
+
+#### Banco de pruebas ##################################################
+
+def preparar_datos (directorio, filas, kib):
+    """Genera en [directorio] un fichero de CSV sintético de [filas]
+    filas con sus ficheros, de [kib] KiB de contenido aleatorio cada
+    uno, y devuelve la configuración con la que usarlos.
+    """
+    import csvbench
+    cfg = dict(csvbench.CFG_SINTETICA, nombreDir=directorio.decode('utf-8'))
+    csvbench.generar_csv(os.path.join(directorio, "sintetico.csv"), filas)
+    csvbench.generar_ficheros(directorio, filas)
+    for n in xrange(1, filas + 1):
+        with open(os.path.join(directorio,
+                               "d{:02d}".format(n % csvbench.SUBDIRECTORIOS),
+                               "f{:07d}.jpg".format(n)), 'wb') as f:
+            f.write(os.urandom(kib * 1024))
+    return cfg
+
+def plantilla_information ():
+    """Plantilla de las pruebas en varios procesos, con líneas que
+    empiezan por «{», como las de {{Information}}, para comprobar que
+    los ficheros de registros de los procesos se fusionan bien.
+    """
+    return u"""=={{int:filedesc}}==
+{{Information
+|description=%(CAMPO1)s
+|source=%(CAMPO2)s
+}}"""
+
+def cfg_prueba (directorio, servidor, filas, kib, hilos, tasaMax,
+                alijoPrevio=False):
+    """Devuelve la configuración del proceso de subida de [filas]
+    ficheros sintéticos de [kib] KiB, creados en [directorio], al
+    [servidor] simulado, sin operador.
+    """
+    import csvac
+    cfg = dict(csvac.CFG_POR_DEFECTO,
+               **preparar_datos(directorio, filas, kib))
+    cfg.update(urlApi=servidor.url, motorSubida="api",
+               usuarioApi=u"Prueba@csvac", contrasenaApi=u"x",
+               hilos=hilos, tasaMax=tasaMax, tEspera=0,
+               adelanto=max(4, 2 * hilos), reintentos=10,
+               registroAsincrono=True,
+               alijoPrevio=alijoPrevio)
+    return cfg
+
+def prueba (filas=200, kib=64, hilos=4, tasaMax=50, commons=None,
+            alijoPrevio=False, procesos=1):
+    """Sube [filas] ficheros sintéticos de [kib] KiB al Wikimedia
+    Commons simulado [commons] con el proceso de subida completo
+    (csvac.bucle) sin operador, con [hilos] hilos y un máximo de
+    [tasaMax] subidas por segundo, y devuelve las medidas obtenidas.
+    Si [alijoPrevio] es True, los ficheros se suben antes al alijo y se
+    publican desde él. Con varios [procesos], las filas se reparten
+    entre ellos con csvac.coordinar, y [hilos] son los de cada uno, y
+    se comprueba que sus ficheros de registros se fusionan en el de la
+    sesión.
+    """
+    import abihttp
+    import abilog
+    import abimetricas
+    import csvac
+    import csvcfg
+    commons = commons or Commons()
+    servidor = iniciar_servidor(commons)
+    directorio = tempfile.mkdtemp(prefix="simcommons-")
+    try:
+        cfg = cfg_prueba(directorio, servidor, filas, kib, hilos, tasaMax,
+                         alijoPrevio)
+        csvac.INTERACTIVO = False
+        csvac.DESATENDIDO = True
+        abilog.config(os.path.join(directorio, "sintetico.csv.log"), True)
+        abimetricas.METRICAS = abimetricas.Metricas()
+        error = csvac.comprobar_conexion(cfg) or csvac.login_api(cfg)
+        if error:
+            raise RuntimeError(error.encode("utf-8"))
+        datos = csvac.leer_csv(cfg)
+        diario = csvac.cargar_fila(cfg)
+        salida = sys.stdout
+        sys.stdout = csvac.SalidaNula()
+        plantilla = csvcfg.plantilla
+        if procesos > 1:
+            csvcfg.plantilla = plantilla_information
+        t0 = time.time()
+        try:
+            if procesos > 1:
+                csvac.coordinar(cfg, datos, diario, procesos)
+            else:
+                csvac.bucle(cfg, datos, diario)
+        finally:
+            t = time.time() - t0
+            sys.stdout = salida
+            csvcfg.plantilla = plantilla
+        rutaRegistros = os.path.join(directorio, "sintetico.csv.log")
+        with open(rutaRegistros, 'rb') as f:
+            registros = f.read()
+        fusionados = not glob.glob(u"{}.*".format(rutaRegistros)) and \
+                     (procesos == 1 or "\n{{Information\n" in registros)
+        contadores = abimetricas.METRICAS.resumen()["contadores"]
+        return {
+            "filas": filas,
+            "kib": kib,
+            "hilos": hilos,
+            "tasaMax": tasaMax,
+            "alijoPrevio": alijoPrevio,
+            "procesos": procesos,
+            "segundos": t,
+            "ficherosPorSegundo": contadores.get("ficheros", 0) / t,
+            "bytesPorSegundo": contadores.get("bytes", 0) / t,
+            "reintentos": contadores.get("reintentos", 0),
+            "esperas": contadores.get("esperas", 0),
+            "fallos": contadores.get("fallos", 0),
+            "verificadas": len(diario.completas()),
+            "registrosFusionados": fusionados,
+            "servidor": dict(commons.estadisticas),
+        }
+    finally:
+        abihttp.sesion().cerrar()
+        servidor.shutdown()
+        shutil.rmtree(directorio)
+
+def nodo_prueba (cfg, ruta):
+    """Nodo de prueba_nodos: sube como csvac en el modo de nodo, con la
+    tabla de arriendos [ruta].
+    """
+    import abilog
+    import abimetricas
+    import csvac
+    csvac.NODO = csvac.identificador_nodo()
+    csvac.INTERACTIVO = False
+    csvac.DESATENDIDO = True
+    sys.stdout = csvac.SalidaNula()
+    abilog.config(u"{}.log{}".format(os.path.join(cfg["nombreDir"],
+                                                  cfg["nombreCsv"]),
+                                     csvac.sufijo_fragmento()),
+                  True, proceso=csvac.NODO)
+    abimetricas.METRICAS = abimetricas.Metricas()
+    error = csvac.comprobar_conexion(cfg) or csvac.login_api(cfg)
+    if error:
+        raise RuntimeError(error.encode("utf-8"))
+    datos = csvac.leer_csv(cfg)
+    tabla = csvac.TablaArriendos(ruta, csvac.NODO, cfg["tArriendo"])
+    error = tabla.iniciar(len(datos))
+    if error:
+        raise RuntimeError(error.encode("utf-8"))
+    csvac.trabajar_nodo(cfg, datos, tabla)
+
+def prueba_nodos (filas=200, kib=64, hilos=4, tasaMax=50, commons=None,
+                  nodos=3, matar=False, tArriendo=3):
+    """Sube [filas] ficheros sintéticos como prueba, pero con [nodos]
+    procesos independientes en el modo de nodo, que se reparten las
+    filas con una misma tabla de arriendos de [tArriendo] segundos. Si
+    [matar] es True, uno de ellos se mata (SIGKILL) cuando se ha subido
+    un tercio de las filas, para que los demás tomen las suyas.
+    
+    Devuelve las medidas obtenidas; entre ellas, las filas sin
+    verificar en la tabla y las publicaciones repetidas en el servidor,
+    que deben ser 0.
+    """
+    import csvac
+    commons = commons or Commons()
+    servidor = iniciar_servidor(commons)
+    directorio = tempfile.mkdtemp(prefix="simcommons-")
+    try:
+        cfg = cfg_prueba(directorio, servidor, filas, kib, hilos, tasaMax)
+        cfg.update(tArriendo=tArriendo, loteArriendo=max(4, 2 * hilos))
+        ruta = os.path.join(directorio, "arriendos.sqlite")
+        t0 = time.time()
+        procesos = [multiprocessing.Process(target=nodo_prueba,
+                                            args=(cfg, ruta))
+                    for k in range(nodos)]
+        for proceso in procesos:
+            proceso.start()
+        if matar:
+            while procesos[0].is_alive():
+                try:
+                    with sqlite3.connect(ruta, timeout=60) as c:
+                        verificadas = c.execute(
+                            "SELECT COUNT(*) FROM filas WHERE estado = ?",
+                            (csvac.VERIFICADA,)).fetchone()[0]
+                except sqlite3.Error:
+                    verificadas = 0
+                if verificadas >= filas / 3:
+                    os.kill(procesos[0].pid, signal.SIGKILL)
+                    break
+                time.sleep(0.05)
+        for proceso in procesos:
+            proceso.join()
+        t = time.time() - t0
+        with sqlite3.connect(ruta) as c:
+            estados = dict(c.execute("SELECT estado, COUNT(*) FROM filas "
+                                     "GROUP BY estado").fetchall())
+        contadores = {}
+        for rutaMetricas in glob.glob(os.path.join(
+                directorio, "sintetico.csv.metricas.*.json")):
+            with open(rutaMetricas) as f:
+                for contador, n in json.load(f)["contadores"].items():
+                    contadores[contador] = contadores.get(contador, 0) + n
+        return {
+            "filas": filas,
+            "kib": kib,
+            "hilos": hilos,
+            "tasaMax": tasaMax,
+            "nodos": nodos,
+            "matar": matar,
+            "tArriendo": tArriendo,
+            "segundos": t,
+            "ficherosPorSegundo": estados.get(csvac.VERIFICADA, 0) / t,
+            "codigos": [proceso.exitcode for proceso in procesos],
+            "estados": estados,
+            "vencidos": contadores.get("vencidos", 0),
+            "verificadas": estados.get(csvac.VERIFICADA, 0),
+            "sinVerificar": filas - estados.get(csvac.VERIFICADA, 0),
+            "repetidas": commons.estadisticas["subidas"] -
+                         len(commons.ficheros),
+            "servidor": dict(commons.estadisticas),
+        }
+    finally:
+        servidor.shutdown()
+        shutil.rmtree(directorio)
+
+########################################################################
+
+def main ():
+    parser = argparse.ArgumentParser(description=u"Wikimedia Commons "
+                                                 u"simulado.")
+    sub = parser.add_subparsers(dest="orden")
+    for nombre in ("servidor", "prueba"):
+        p = sub.add_parser(nombre)
+        p.add_argument("--latencia", type=float, default=0.0)
+        p.add_argument("--errores", type=float, default=0.0)
+        p.add_argument("--saturacion", type=float, default=0.0)
+        p.add_argument("--tasaServidor", type=float, default=None)
+        p.add_argument("--espera", type=float, default=1)
+        if nombre == "servidor":
+            p.add_argument("--puerto", type=int, default=8080)
+        else:
+            p.add_argument("--filas", type=int, default=200)
+            p.add_argument("--kib", type=int, default=64)
+            p.add_argument("--hilos", type=int, default=4)
+            p.add_argument("--tasaMax", type=float, default=50)
+            p.add_argument("--alijo", action="store_true")
+            p.add_argument("--procesos", type=int, default=1)
+            p.add_argument("--nodos", type=int, default=0)
+            p.add_argument("--matar", action="store_true")
+            p.add_argument("--tArriendo", type=float, default=3)
+            p.add_argument("--json", default=None)
+    args = parser.parse_args()
+    commons = Commons(args.latencia, args.errores, args.saturacion,
+                      args.tasaServidor, args.espera)
+    if args.orden == "servidor":
+        servidor = iniciar_servidor(commons, args.puerto)
+        print u"API simulada en {}".format(servidor.url)
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            servidor.shutdown()
+        return
+    if args.nodos:
+        r = prueba_nodos(args.filas, args.kib, args.hilos, args.tasaMax,
+                         commons, args.nodos, args.matar, args.tArriendo)
+        print (u"{} nodos, {} ficheros en {:.2f} s: {:.1f} ficheros/s; "
+               u"{} filas sin verificar, {} filas de arriendos vencidos, "
+               u"{} publicaciones repetidas; códigos de salida "
+               u"{}".format(r["nodos"], r["verificadas"], r["segundos"],
+                            r["ficherosPorSegundo"], r["sinVerificar"],
+                            r["vencidos"], r["repetidas"],
+                            r["codigos"])).encode('utf-8')
+        print json.dumps(r["servidor"])
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(r, f, indent=2)
+        return
+    r = prueba(args.filas, args.kib, args.hilos, args.tasaMax, commons,
+               args.alijo, args.procesos)
+    print (u"{} ficheros en {:.2f} s: {:.1f} ficheros/s, {:.2f} MB/s; "
+           u"{} reintentos, {} esperas pedidas, {} "
+           u"fallos".format(r["verificadas"], r["segundos"],
+                            r["ficherosPorSegundo"],
+                            r["bytesPorSegundo"] / 1e6, r["reintentos"],
+                            r["esperas"], r["fallos"])).encode('utf-8')
+    if not r["registrosFusionados"]:
+        print (u"ERROR: Los ficheros de registros de los procesos no se "
+               u"han fusionado.").encode('utf-8')
+    print json.dumps(r["servidor"])
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(r, f, indent=2)
+
+if __name__ == '__main__':
+    main()